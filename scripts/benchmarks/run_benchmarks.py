@@ -0,0 +1,247 @@
+import argparse
+import functools
+import http.server
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import synthetic_data
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent
+# The crate packagers import the shared mgnify_crates package from the scripts folder
+sys.path.insert(0, str(SCRIPTS_DIR))
+for script_dir in ('prepare_motus_crates', 'prepare_sanntis_gffs', 'prepare_sanntis_crates', 'prepare_metapuf_crates',
+                   'prepare_eez_abs_data'):
+    sys.path.insert(0, str(SCRIPTS_DIR / script_dir))
+
+
+class QuietHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalFileServer:
+    """Serves a folder over HTTP, with directory listings, in place of the FTP."""
+
+    def __init__(self, folder):
+        handler = functools.partial(QuietHTTPRequestHandler, directory=str(folder))
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_port}/"
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def fresh_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return path
+
+
+def time_best_of(repeat, run, setup=None):
+    """The shortest of `repeat` timed calls of run, each after an untimed call of setup."""
+    best = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def benchmark_motus(work_dir, args, stream_archive=False):
+    from motus_ro_crates_preparer import MotusRoCratesPreparer
+
+    served_folder = work_dir / 'motus_web'
+    synthetic_data.write_motus_tree(served_folder, args.motus_runs, args.motus_files, args.motus_file_size)
+    destination_folder = work_dir / 'motus_crates'
+
+    with LocalFileServer(served_folder) as base_url:
+        def run():
+            preparer = MotusRoCratesPreparer(base_url, str(destination_folder), extract_multiple=True,
+                                             workers=args.workers, stream_archive=stream_archive,
+                                             direct_zip=stream_archive)
+            preparer.show_progress = False
+            failed = [result for result in preparer.prepare_motus_ro_crate() if not result.succeeded]
+            if failed:
+                raise RuntimeError(f'{len(failed)} mOTUs crates failed, e.g. {failed[0].error}')
+
+        seconds = time_best_of(args.repeat, run, lambda: fresh_dir(destination_folder))
+    return seconds, args.motus_runs, 'crates', synthetic_data.get_size_on_disk(served_folder)
+
+
+def benchmark_motus_streaming(work_dir, args):
+    return benchmark_motus(work_dir, args, stream_archive=True)
+
+
+def write_sanntis_gffs(work_dir, args):
+    gff_dir = fresh_dir(work_dir / 'sanntis_gffs')
+    return [synthetic_data.write_sanntis_gff(gff_dir, f'ERZ{i + 1:07d}', args.gff_records, seed=i)
+            for i in range(args.gffs)]
+
+
+def benchmark_sanntis_gffs(work_dir, args):
+    from prepare_sanntis_gffs import prepare_gff
+
+    gff_paths = write_sanntis_gffs(work_dir, args)
+    out_dir = work_dir / 'prepared_sanntis_gffs'
+
+    def run():
+        for gff_path in gff_paths:
+            error = prepare_gff(str(gff_path), out_dir)[3]
+            if error:
+                raise RuntimeError(f'Could not prepare {gff_path}: {error}')
+
+    seconds = time_best_of(args.repeat, run, lambda: fresh_dir(out_dir))
+    return seconds, args.gffs * args.gff_records, 'records', sum(map(synthetic_data.get_size_on_disk, gff_paths))
+
+
+def benchmark_sanntis_crates(work_dir, args):
+    from package_sanntis_as_crates import create_sanntis_rocrate
+
+    gff_paths = write_sanntis_gffs(work_dir, args)
+    crate_dir = work_dir / 'sanntis_crates'
+
+    def run():
+        for gff_path in gff_paths:
+            if create_sanntis_rocrate(str(gff_path), str(crate_dir)) is None:
+                raise RuntimeError(f'Could not package {gff_path}')
+
+    seconds = time_best_of(args.repeat, run, lambda: fresh_dir(crate_dir))
+    return seconds, args.gffs, 'crates', sum(map(synthetic_data.get_size_on_disk, gff_paths))
+
+
+def benchmark_metapuf_crates(work_dir, args):
+    from package_metapuf_as_crates import create_metapuf_rocrate
+
+    gff_dir = fresh_dir(work_dir / 'metapuf_gffs')
+    gff_paths = [synthetic_data.write_metapuf_gff(gff_dir, f'ERZ{i + 1:07d}', 'PXD000001', args.gff_records, seed=i)
+                 for i in range(args.gffs)]
+    crate_dir = work_dir / 'metapuf_crates'
+
+    def run():
+        for gff_path in gff_paths:
+            result = create_metapuf_rocrate(str(gff_path), 'PXD000001', str(crate_dir))
+            if result.status != 'packaged':
+                raise RuntimeError(f'Could not package {gff_path}: {result.reason}')
+
+    seconds = time_best_of(args.repeat, run, lambda: fresh_dir(crate_dir))
+    return seconds, args.gffs, 'crates', sum(map(synthetic_data.get_size_on_disk, gff_paths))
+
+
+def benchmark_eez_abs(work_dir, args):
+    from prepare_eez_abs_data import EezAbsMapper
+
+    eez_dir = fresh_dir(work_dir / 'eez')
+    shapefile_path, abs_csv_path = synthetic_data.write_eez_shapefile(eez_dir, args.eez_zones, args.eez_vertices)
+
+    def run():
+        mapper = EezAbsMapper()
+        mapper.accept_input_parameters(str(shapefile_path), str(abs_csv_path), str(eez_dir / 'eez_abs.json'))
+        mapper.load_eez_data_from_shape_file()
+        mapper.load_abs_data_from_csv()
+        mapper.append_abs_status_to_eez_data()
+        mapper.output_results_to_json_file()
+        mapper.output_geometry_with_abs_status(str(eez_dir / 'eez_abs.geojson'))
+
+    seconds = time_best_of(args.repeat, run)
+    return seconds, args.eez_zones, 'zones', synthetic_data.get_size_on_disk(eez_dir)
+
+
+BENCHMARKS = {
+    'motus': benchmark_motus,
+    'motus_streaming': benchmark_motus_streaming,
+    'sanntis_gffs': benchmark_sanntis_gffs,
+    'sanntis_crates': benchmark_sanntis_crates,
+    'metapuf_crates': benchmark_metapuf_crates,
+    'eez_abs': benchmark_eez_abs,
+}
+
+
+def compare_with_baseline(results, baseline_path, max_slowdown):
+    """Print how each benchmark compares with a previous --output, and return the names of those that regressed."""
+    with open(baseline_path, 'r') as f:
+        baseline = {result['name']: result for result in json.load(f)['results']}
+    regressed = []
+    for result in results:
+        previous = baseline.get(result['name'])
+        if previous is None:
+            continue
+        slowdown = result['seconds'] / previous['seconds']
+        flag = ''
+        if slowdown > max_slowdown:
+            regressed.append(result['name'])
+            flag = '  REGRESSED'
+        print(f"{result['name']:<16} {previous['seconds']:8.3f}s -> {result['seconds']:8.3f}s  x{slowdown:5.2f}{flag}")
+    return regressed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Time the crate and GFF preparation scripts end to end on synthetic '
+                                                 'data, with no network access')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS),
+                        help='Benchmarks to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs, of which the best is reported')
+    parser.add_argument('--workers', type=int, default=1, help='Workers for the mOTUs crate preparer')
+    parser.add_argument('--motus_runs', type=int, default=10, help='Number of mOTUs tarballs to serve')
+    parser.add_argument('--motus_files', type=int, default=20, help='Taxonomy tables in each mOTUs tarball')
+    parser.add_argument('--motus_file_size', type=int, default=64 * 1024,
+                        help='Approximate size in bytes of each file in the mOTUs tarballs')
+    parser.add_argument('--gffs', type=int, default=20, help='Number of SanntiS and MetaPUF GFFs')
+    parser.add_argument('--gff_records', type=int, default=5000, help='Records in each GFF')
+    parser.add_argument('--eez_zones', type=int, default=250, help='Number of EEZs in the shapefile')
+    parser.add_argument('--eez_vertices', type=int, default=256, help='Vertices of each EEZ polygon')
+    parser.add_argument('--work_dir', default=None,
+                        help='Where to write the synthetic data and outputs (default: a temporary directory)')
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this path')
+    parser.add_argument('--baseline', default=None, help='Results JSON of an earlier run to compare against')
+    parser.add_argument('--max_slowdown', type=float, default=1.2,
+                        help='Exit with an error if a benchmark is this many times slower than the baseline')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # Per-run progress and log lines would swamp the results
+    logging.disable(logging.INFO)
+    os.environ.setdefault('TQDM_DISABLE', '1')
+
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix='mgnify_benchmarks_'))
+    results = []
+    try:
+        for name in args.only:
+            seconds, items, unit, input_bytes = BENCHMARKS[name](fresh_dir(work_dir / name), args)
+            results.append({'name': name, 'seconds': round(seconds, 6), 'items': items, 'unit': unit,
+                            'input_bytes': input_bytes})
+            print(f'{name:<16} {seconds:8.3f}s  {items / seconds:10,.1f} {unit}/s  '
+                  f'{input_bytes / seconds / 1e6:8.1f} MB/s of input')
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'arguments': {key: value for key, value in vars(args).items()
+                                     if key not in ('output', 'baseline', 'work_dir')},
+                       'results': results}, f, indent=2)
+    if args.baseline:
+        regressed = compare_with_baseline(results, args.baseline, args.max_slowdown)
+        if regressed:
+            print(f"Slower than the baseline: {', '.join(regressed)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
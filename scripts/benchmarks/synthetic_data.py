@@ -0,0 +1,164 @@
+import io
+import math
+import os
+import random
+import tarfile
+from pathlib import Path
+
+MIBIG_CLASSES = ('Polyketide', 'NRP', 'Terpene', 'RiPP', 'Saccharide', 'Alkaloid', 'Other')
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+SOVEREIGNS = ('Algeria', 'Angola', 'Benin', 'Botswana', 'Brazil', 'Chile', 'Denmark', 'Fiji', 'Ghana', 'Kenya',
+              'Mexico', 'Norway', 'Peru', 'Samoa', 'Tonga', 'Uruguay')
+
+
+def make_motus_tarball(srr_value, taxonomy_files=20, file_size=64 * 1024, seed=0):
+    """
+    A .tar.gz laid out like a mOTUs pipeline output folder: a MultiQC report, a Krona chart and a taxonomy table
+    for each of LSU and SSU, and `taxonomy_files` more tables of about `file_size` bytes each.
+    """
+    rng = random.Random(seed)
+    members = {
+        f'{srr_value}/qc/multiqc/multiqc_report.html': make_html(rng, 'MultiQC report', file_size),
+        f'{srr_value}/taxonomy/LSU/krona.html': make_html(rng, 'LSU Krona', file_size),
+        f'{srr_value}/taxonomy/SSU/krona.html': make_html(rng, 'SSU Krona', file_size),
+    }
+    for i in range(taxonomy_files):
+        subunit = ('LSU', 'SSU')[i % 2]
+        members[f'{srr_value}/taxonomy/{subunit}/{srr_value}_{i}.tsv'] = make_taxonomy_table(rng, file_size)
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for name, content in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def make_html(rng, title, size):
+    rows = []
+    length = 0
+    while length < size:
+        row = f'<tr><td>taxon_{rng.randrange(10 ** 6)}</td><td>{rng.random():.6f}</td></tr>\n'
+        rows.append(row)
+        length += len(row)
+    return f'<!DOCTYPE html><html><head><title>{title}</title></head><body><table>\n{"".join(rows)}</table>' \
+           f'</body></html>'.encode()
+
+
+def make_taxonomy_table(rng, size):
+    rows = ['#OTU ID\ttaxonomy\tcount\n']
+    length = len(rows[0])
+    while length < size:
+        row = f'{rng.randrange(10 ** 6)}\tsk__Bacteria;p__Phylum_{rng.randrange(100)};' \
+              f'c__Class_{rng.randrange(1000)}\t{rng.randrange(1, 10 ** 4)}\n'
+        rows.append(row)
+        length += len(row)
+    return ''.join(rows).encode()
+
+
+def write_motus_tree(served_folder, runs, taxonomy_files=20, file_size=64 * 1024):
+    """
+    Lay `runs` tarballs out the way the mOTUs FTP does, half of them in SRRnnn/SRRnnnnnnn/ subfolders.
+    Returns the SRR accessions written.
+    """
+    srr_values = []
+    for i in range(runs):
+        srr_value = f'SRR{i + 1:07d}'
+        folder = Path(served_folder)
+        if i % 2:
+            folder = folder / srr_value[:6] / srr_value
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / f'{srr_value}.tar.gz').write_bytes(make_motus_tarball(srr_value, taxonomy_files, file_size, seed=i))
+        srr_values.append(srr_value)
+    return srr_values
+
+
+def write_sanntis_gff(out_dir, assembly, records, seed=0):
+    """A SanntiS (EMERALD) GFF of `records` clusters, about a third of them shorter than the default 3000bp cutoff."""
+    rng = random.Random(seed)
+    path = Path(out_dir) / f'{assembly}.fasta.gz.fna.FILTER.fna.emerald.full.gff'
+    with open(path, 'w') as gff:
+        gff.write('##gff-version 3\n')
+        for i in range(records):
+            contig_length = rng.randrange(1000, 100000)
+            contig = f'NODE_{i + 1}_length_{contig_length}_cov_{rng.uniform(1, 50):.6f}'
+            start = rng.randrange(1, contig_length)
+            end = min(contig_length, start + rng.randrange(500, 20000))
+            gff.write(f'{contig}\tEMERALDv0.2.3\tCLUSTER\t{start}\t{end}\t.\t.\t.\tID={contig}_emrld_1;'
+                      f'nearest_MiBIG=BGC{rng.randrange(10 ** 7):07d};'
+                      f'nearest_MiBIG_class={rng.choice(MIBIG_CLASSES)};'
+                      f'nearest_MiBIG_jaccardDistance={rng.random():.3f};'
+                      f'partial={rng.randrange(2)}{rng.randrange(2)}\n')
+    return path
+
+
+def write_metapuf_gff(out_dir, assembly, pride_id, records, seed=0):
+    """A MetaPUF GFF of `records` proteins, each with a few peptides."""
+    rng = random.Random(seed)
+    path = Path(out_dir) / f'{assembly}_unique_peptides.gff'
+    with open(path, 'w') as gff:
+        gff.write('##gff-version 3\n##max_spectrum_count_value_in_study=nan\n')
+        for i in range(records):
+            contig_length = rng.randrange(300, 100000)
+            start = rng.randrange(1, contig_length)
+            end = min(contig_length, start + rng.randrange(100, 3000))
+            peptides = ','.join(f'{"".join(rng.choices(AMINO_ACIDS, k=rng.randrange(8, 20)))} '
+                                f'[PSMs:{rng.randrange(1, 6)}]' for _ in range(rng.randrange(1, 8)))
+            gff.write(f'{assembly}.{i}-NODE-{i}-length-{contig_length}-cov-{rng.uniform(1, 50):.6f}\tPeptideShaker'
+                      f'\tCDS\t{start}\t{end}\t.\t{rng.choice("+-")}\t.\tID={rng.getrandbits(256):064x};type=Protein;'
+                      f'Unique_peptide_to_protein_mapping=None;Ambiguous_peptide_to_protein_mapping=True;'
+                      f'ambiguous_sequences={peptides};pride_id={pride_id};'
+                      f'semiquantitative_expression_spectrum_count=None\n')
+    return path
+
+
+def write_eez_shapefile(out_dir, zones, vertices_per_zone=64, seed=0):
+    """
+    A shapefile of `zones` EEZs in a grid, with the attribute columns of the Marine Regions EEZ shapefile that
+    the mapper reads, and an ABS CSV listing most of their sovereigns.
+    Each EEZ is a jagged ring of `vertices_per_zone` points, so that the geometry is not trivially simple.
+    Returns (shapefile path, ABS CSV path).
+    """
+    import geopandas as gpd
+    import pandas as pd
+    from shapely.geometry import Polygon
+
+    rng = random.Random(seed)
+    columns = max(1, int(zones ** 0.5))
+    cell_size = min(360 / columns, 180 / -(-zones // columns))
+    geometries = []
+    for i in range(zones):
+        centre_x = -180 + (i % columns + 0.5) * cell_size
+        centre_y = -90 + (i // columns + 0.5) * cell_size
+        ring = []
+        for vertex in range(vertices_per_zone):
+            angle = 2 * math.pi * vertex / vertices_per_zone
+            radius = cell_size / 2 * rng.uniform(0.6, 0.95)
+            ring.append((centre_x + radius * math.cos(angle), centre_y + radius * math.sin(angle)))
+        geometries.append(Polygon(ring))
+
+    eez = gpd.GeoDataFrame({
+        'MRGID': list(range(1, zones + 1)),
+        'GEONAME': [f'Synthetic EEZ {i + 1}' for i in range(zones)],
+        'SOVEREIGN1': [SOVEREIGNS[i % len(SOVEREIGNS)] for i in range(zones)],
+        'SOVEREIGN2': [SOVEREIGNS[(i * 7) % len(SOVEREIGNS)] if i % 5 == 0 else None for i in range(zones)],
+        'UN_TER1': [float(i) if i % 3 else float('nan') for i in range(zones)],
+    }, geometry=geometries, crs='EPSG:4326')
+    shapefile_path = Path(out_dir) / 'eez_synthetic.shp'
+    eez.to_file(shapefile_path)
+
+    # The last sovereign is left out, so that some EEZs have no ABS status
+    abs_csv_path = Path(out_dir) / 'abs_info.csv'
+    pd.DataFrame({
+        'Country': SOVEREIGNS[:-1],
+        'Status': [i % 3 + 1 for i in range(len(SOVEREIGNS) - 1)],
+        'Description': ['ABS laws'] * (len(SOVEREIGNS) - 1),
+    }).to_csv(abs_csv_path, index=False)
+    return shapefile_path, abs_csv_path
+
+
+def get_size_on_disk(path):
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
@@ -0,0 +1,4 @@
+from .crate_template import CrateTemplate, is_plain_file_name
+from .preview import MGnifyPreview
+from .jsonlines_manifest import JsonLinesManifest
+from .packaging_manifest import PackagingManifest
@@ -0,0 +1,71 @@
+import argparse
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+import zipfile
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SCRIPTS_DIR))
+sys.path.insert(0, str(SCRIPTS_DIR / 'prepare_metapuf_crates'))
+sys.path.insert(0, str(SCRIPTS_DIR / 'prepare_sanntis_crates'))
+
+from package_metapuf_as_crates import build_metapuf_rocrate, create_metapuf_rocrate, get_metapuf_crate_template  # noqa: E402
+from package_sanntis_as_crates import build_sanntis_rocrate, create_sanntis_rocrate, get_sanntis_crate_template  # noqa: E402
+
+EXAMPLE_METAPUF_GFF = SCRIPTS_DIR / 'prepare_metapuf_crates' / 'examples' / 'ERZ1669337_unique_peptides.gff'
+EXAMPLE_SANNTIS_GFF = (SCRIPTS_DIR / 'prepare_sanntis_gffs' / 'test_data' /
+                       'ERZ1022742.fasta.gz.fna.FILTER.fna.emerald.full.gff')
+
+
+def read_zip_members(zip_path):
+    with zipfile.ZipFile(zip_path) as archive:
+        return [(info.filename, archive.read(info)) for info in archive.infolist()]
+
+
+def check_same_files(out_dir, gff_path, build_crate, crate_template, **values):
+    """Fill in the template and build through rocrate with the same values, and check the zips hold the same bytes."""
+    values = dict(values, gff_name=gff_path.name, run_id='0' * 32, end_time='2023-01-01T00:00:00',
+                  date_published='2023-01-02T00:00:00+00:00')
+    rocrate_zip = build_crate(str(gff_path), **values).write_zip(Path(out_dir) / 'rocrate_model.zip')
+    template_zip = crate_template.write_zip(Path(out_dir) / 'template.zip', [gff_path], **values)
+    if read_zip_members(rocrate_zip) != read_zip_members(template_zip):
+        raise AssertionError(f'Crates of {gff_path.name} differ between the rocrate model and the template')
+
+
+def time_per_crate(create_crate, crates):
+    start = time.perf_counter()
+    for _ in range(crates):
+        create_crate()
+    return (time.perf_counter() - start) / crates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the per-crate cost of the rocrate model and crate templates')
+    parser.add_argument('--crates', type=int, default=200, help='Number of crates to time each way')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        check_same_files(out_dir, EXAMPLE_METAPUF_GFF, build_metapuf_rocrate, get_metapuf_crate_template(),
+                         assembly='ERZ1669337', pride_id='PXD005780')
+        check_same_files(out_dir, EXAMPLE_SANNTIS_GFF, build_sanntis_rocrate, get_sanntis_crate_template(),
+                         assembly='ERZ1022742')
+        print('Crate files are identical either way')
+
+        for name, gff_path, create_crate in (
+                ('MetaPUF', EXAMPLE_METAPUF_GFF,
+                 lambda use_rocrate_model: create_metapuf_rocrate(str(EXAMPLE_METAPUF_GFF), 'PXD005780', out_dir,
+                                                                  use_rocrate_model)),
+                ('SanntiS', EXAMPLE_SANNTIS_GFF,
+                 lambda use_rocrate_model: create_sanntis_rocrate(str(EXAMPLE_SANNTIS_GFF), out_dir,
+                                                                  use_rocrate_model)),
+        ):
+            print(f'{name} ({os.path.getsize(gff_path) / 1024:.0f} KiB GFF), {args.crates} crates:')
+            for method, use_rocrate_model in (('rocrate model', True), ('template', False)):
+                seconds = time_per_crate(lambda: create_crate(use_rocrate_model), args.crates)
+                print(f'  {method:<14} {seconds * 1000:7.2f} ms/crate  {1 / seconds:8.1f} crates/s')
+
+
+if __name__ == '__main__':
+    main()
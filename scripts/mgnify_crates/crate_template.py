@@ -0,0 +1,114 @@
+from datetime import datetime
+import json
+import re
+import shutil
+import zipfile
+from urllib.parse import quote
+
+from rocrate.model.metadata import Metadata
+from rocrate.model.preview import Preview
+
+# Only characters that rocrate leaves unquoted in file @ids
+PLACEHOLDER_PATTERN = re.compile(r'__MGNIFY_CRATE_([A-Z]+(?:_[A-Z]+)*)__')
+# Date fields are parsed by rocrate, so the template is built with these unlikely dates in their place instead
+PLACEHOLDER_DATE_FORMAT = '1001-01-{:02d}T01:01:01+00:00'
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def get_placeholder(field):
+    return f'__MGNIFY_CRATE_{field.upper()}__'
+
+
+def is_plain_file_name(name):
+    """Whether a file's @id is its name as is. Others are percent-encoded by rocrate, so are left to it."""
+    return quote(name) == name
+
+
+class RenderedText:
+    """
+    A text split once around its placeholders, so that it can be filled in with a single join.
+    """
+
+    def __init__(self, text, format_value):
+        self.format_value = format_value
+        self.parts = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(text):
+            self.parts.append((False, text[position:match.start()]))
+            self.parts.append((True, match.group(1).lower()))
+            position = match.end()
+        self.parts.append((False, text[position:]))
+        self.fields = {part for is_field, part in self.parts if is_field}
+
+    def render(self, values):
+        formatted_values = {field: self.format_value(field, values[field]) for field in self.fields}
+        return ''.join(formatted_values[part] if is_field else part for is_field, part in self.parts)
+
+
+def format_json_string(field, value):
+    return json.dumps(value, ensure_ascii=False)[1:-1]
+
+
+def format_as_is(field, value):
+    return value
+
+
+class CrateTemplate:
+    """
+    A crate built once through the rocrate object model with a placeholder for each per-crate value,
+    kept as the text of its ro-crate-metadata.json and preview.
+    Later crates of the same shape are written by filling those in and streaming their data files into the zip,
+    which gives the same files that rocrate's write_zip would, without rebuilding the model for every crate.
+    """
+
+    def __init__(self, build_crate, fields, date_fields=()):
+        """
+        :param build_crate: builds the crate through rocrate, given a value for each of `fields` as keyword arguments
+        :param fields: names of the values that differ between crates, like the assembly accession
+        :param date_fields: those of `fields` holding ISO dates that rocrate parses, like datePublished,
+            which the preview shows as Python formats them
+        """
+        self.fields = tuple(fields)
+        self.date_fields = tuple(date_fields)
+        placeholder_dates = {field: PLACEHOLDER_DATE_FORMAT.format(i + 1) for i, field in enumerate(self.date_fields)}
+        crate = build_crate(**{field: placeholder_dates.get(field, get_placeholder(field)) for field in self.fields})
+
+        self.data_entity_ids = [RenderedText(entity.id, format_as_is) for entity in crate.data_entities]
+        # The files rocrate writes after the data entities, in the same order
+        self.default_files = []
+        for entity in crate.default_entities:
+            if isinstance(entity, Metadata):
+                metadata = b''.join(chunk for _, chunk in entity.stream()).decode('utf-8')
+                for field, date in placeholder_dates.items():
+                    metadata = metadata.replace(date, get_placeholder(field))
+                self.default_files.append((entity.id, RenderedText(metadata, format_json_string)))
+            elif isinstance(entity, Preview):
+                preview = entity.generate_html()
+                for field, date in placeholder_dates.items():
+                    preview = preview.replace(str(datetime.fromisoformat(date)), get_placeholder(field))
+                self.default_files.append((entity.id, RenderedText(preview, self.format_preview_value)))
+
+    def format_preview_value(self, field, value):
+        if field in self.date_fields:
+            return str(datetime.fromisoformat(value))
+        return value
+
+    def render_files(self, **values):
+        return {name: text.render(values).encode('utf-8') for name, text in self.default_files}
+
+    def write_zip(self, zip_path, data_sources, **values):
+        """
+        Write the crate for `values` to zip_path.
+        :param data_sources: source file path of each data entity, in the order they were added to the crate
+        """
+        if len(data_sources) != len(self.data_entity_ids):
+            raise ValueError(f'Expected {len(self.data_entity_ids)} data files, got {len(data_sources)}')
+        with zipfile.ZipFile(zip_path, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for entity_id, source in zip(self.data_entity_ids, data_sources):
+                with open(source, 'rb') as source_file, \
+                        archive.open(entity_id.render(values), mode='w', force_zip64=True) as archived_file:
+                    shutil.copyfileobj(source_file, archived_file, COPY_CHUNK_SIZE)
+            for name, content in self.render_files(**values).items():
+                with archive.open(name, mode='w', force_zip64=True) as archived_file:
+                    archived_file.write(content)
+        return zip_path
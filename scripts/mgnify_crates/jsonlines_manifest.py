@@ -0,0 +1,54 @@
+import datetime
+import json
+import logging
+import os
+
+
+class JsonLinesManifest:
+    """
+    Append-only JSON-lines record of one entry per key, like a crate zip or a source URL.
+    The last line written for a key wins, so concurrent workers can append without coordinating.
+    Subclasses set `key_field`, the field of each entry that holds its key.
+    """
+    key_field = None
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        self.entries = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A run killed mid-write leaves a truncated last line behind
+                    logging.warning(f"Ignoring malformed line in manifest {self.path}")
+                    continue
+                self.entries[entry[self.key_field]] = entry
+
+    def get(self, key):
+        return self.entries.get(str(key), {})
+
+    def record(self, key, **fields):
+        entry = {**fields, self.key_field: str(key), 'updated': datetime.datetime.now().isoformat(timespec='seconds')}
+        self.entries[str(key)] = entry
+        line = (json.dumps(entry) + '\n').encode()
+        # A single O_APPEND write keeps lines from different worker processes intact
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def compact(self):
+        self.load()
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + '\n')
+        os.replace(temp_path, self.path)
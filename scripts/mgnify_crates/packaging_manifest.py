@@ -0,0 +1,45 @@
+import hashlib
+import os
+
+from .jsonlines_manifest import JsonLinesManifest
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def sha256_of_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class PackagingManifest(JsonLinesManifest):
+    """
+    Record of what each crate zip was last packaged from: its source file's content hash, and inputs like the tool
+    version. Crates whose source and inputs are unchanged, and whose zip is still there, need not be packaged again.
+    """
+    key_field = 'crate'
+
+    def get_source_fingerprint(self, crate, source_path):
+        """
+        The size, mtime and sha256 of a crate's source file.
+        The hash recorded for the crate is reused if the same file's size and mtime have not changed since.
+        """
+        entry = self.get(crate)
+        stat = os.stat(source_path)
+        fingerprint = {'source': str(source_path), 'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+        if all(entry.get(key) == value for key, value in fingerprint.items()) and entry.get('source_sha256'):
+            fingerprint['source_sha256'] = entry['source_sha256']
+        else:
+            fingerprint['source_sha256'] = sha256_of_file(source_path)
+        return fingerprint
+
+    def is_up_to_date(self, crate, source_fingerprint, **inputs):
+        entry = self.get(crate)
+        return (
+            bool(entry)
+            and os.path.exists(crate)
+            and entry.get('source_sha256') == source_fingerprint['source_sha256']
+            and all(entry.get(key) == value for key, value in inputs.items())
+        )
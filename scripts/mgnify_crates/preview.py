@@ -0,0 +1,58 @@
+from functools import lru_cache
+from pathlib import Path
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from rocrate.model.preview import Preview
+
+PREVIEW_TEMPLATE_DIR = Path(__file__).resolve().parent
+PREVIEW_TEMPLATE_NAME = 'mgnify-rocrate-preview-template.html.j2'
+
+
+def stringify(a):
+    if type(a) is list:
+        return ', '.join([stringify(aa) for aa in a])
+    elif type(a) is str:
+        return a
+    elif hasattr(a, '_jsonld') and a._jsonld.get('name'):
+            return a._jsonld['name']
+    elif type(a) is dict:
+        return stringify(list(a.values()))
+    else:
+        return a
+
+
+def is_object_list(a):
+    if type(a) is list:
+        for obj in a:
+            if obj is not str:
+                return True
+    else:
+        return False
+
+
+def details(a):
+    if type(a) is dict:
+        return {k: v for k, v in a.items() if k not in ['@id', '@type']}
+
+
+@lru_cache(maxsize=None)
+def get_preview_template():
+    """
+    Compile the preview template once per process.
+    The compiled bytecode is also cached on disk, so pool workers and later runs skip compiling it.
+    """
+    environment = Environment(loader=FileSystemLoader(PREVIEW_TEMPLATE_DIR), bytecode_cache=FileSystemBytecodeCache())
+    environment.globals.update(stringify=stringify, is_object_list=is_object_list, details=details)
+    return environment.get_template(PREVIEW_TEMPLATE_NAME)
+
+
+class MGnifyPreview(Preview):
+    def generate_html(self):
+        context_entities = []
+        data_entities = []
+        for entity in self.crate.contextual_entities:
+            context_entities.append(entity._jsonld)
+        for entity in self.crate.data_entities:
+            data_entities.append(entity._jsonld)
+        out_html = get_preview_template().render(crate=self.crate, context=context_entities, data=data_entities)
+        return out_html
@@ -0,0 +1,114 @@
+import argparse
+import logging
+import pickle
+
+import numpy as np
+import pandas as pd
+import shapely
+
+logger = logging.getLogger(__name__)
+
+LOOKUP_COLUMNS = ['MRGID', 'GEONAME', 'SOVEREIGN1', 'SOVEREIGN2', 'SOVEREIGN1_ABS_STATUS', 'SOVEREIGN2_ABS_STATUS']
+
+
+class EezAbsLookup:
+    """
+    Finds which EEZ, and so which ABS status, applies to sample coordinates, using an STRtree over the
+    EEZ polygons. Built from an EezAbsMapper that has appended ABS statuses, or loaded from an index file
+    saved by an earlier build, so bulk lookups do not need the shapefile.
+    """
+    INDEX_FORMAT_VERSION = 1
+
+    def __init__(self, geometries, attributes):
+        self.geometries = np.asarray(geometries)
+        self.attributes = attributes.reset_index(drop=True)
+        # Points matching no EEZ are given this extra all-null row. Nullable dtypes keep integer columns,
+        # like the ABS statuses, from turning into floats once the nulls are added
+        self.attributes_with_no_match = (
+            self.attributes.convert_dtypes().reindex(range(len(self.attributes) + 1)).astype(object)
+        )
+        self.attributes_with_no_match = self.attributes_with_no_match.where(
+            self.attributes_with_no_match.notna(), None
+        )
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    @classmethod
+    def from_mapper(cls, mapper, columns=None):
+        geometry = mapper.eez_shapefile_data.geometry
+        if geometry.crs is not None and not geometry.crs.equals('EPSG:4326'):
+            geometry = geometry.to_crs('EPSG:4326')
+        attributes = pd.DataFrame(mapper.eez_with_abs_json_data).reindex(columns=columns or LOOKUP_COLUMNS)
+        return cls(geometry.values, attributes)
+
+    def save(self, index_path):
+        logger.info(f"Saving EEZ lookup index to '{index_path}'...")
+        with open(index_path, 'wb') as index_file:
+            pickle.dump({
+                'version': self.INDEX_FORMAT_VERSION,
+                'geometries': shapely.to_wkb(self.geometries),
+                'attributes': self.attributes.to_dict('list'),
+            }, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, index_path):
+        logger.info(f"Loading EEZ lookup index from '{index_path}'...")
+        with open(index_path, 'rb') as index_file:
+            index = pickle.load(index_file)
+        if index['version'] != cls.INDEX_FORMAT_VERSION:
+            raise ValueError(f"{index_path} is a version {index['version']} index, "
+                             f"expected version {cls.INDEX_FORMAT_VERSION}.")
+        return cls(shapely.from_wkb(index['geometries']), pd.DataFrame(index['attributes']))
+
+    def lookup(self, lats, lons, batch_size=1_000_000):
+        """
+        Return one row of EEZ attributes per coordinate, with nulls for coordinates in no EEZ.
+        Where EEZs overlap, or a point lies on a shared border, the EEZ listed first in the shapefile is used.
+        """
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        if lats.shape != lons.shape:
+            raise ValueError(f"Got {lats.size} latitudes but {lons.size} longitudes.")
+
+        eez_indices = np.full(lats.size, len(self.attributes), dtype=np.intp)
+        for start in range(0, lats.size, batch_size):
+            points = shapely.points(lons[start:start + batch_size], lats[start:start + batch_size])
+            point_indices, tree_indices = self.tree.query(points, predicate='intersects')
+            order = np.lexsort((tree_indices, point_indices))
+            matched_points, first_matches = np.unique(point_indices[order], return_index=True)
+            eez_indices[start + matched_points] = tree_indices[order][first_matches]
+
+        return self.attributes_with_no_match.iloc[eez_indices].reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    from prepare_eez_abs_data import EezAbsMapper
+
+    parser = argparse.ArgumentParser(description='Build, or look up sample coordinates in, an EEZ ABS status index.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='Build the index from an EEZ shapefile and ABS CSV.')
+    build_parser.add_argument('shapefile_path', help='Path to the EEZ shapefile.')
+    build_parser.add_argument('abs_csv_file', help='Path to the ABS status CSV file.')
+    build_parser.add_argument('index_path', help='Path to save the index to.')
+    lookup_parser = subparsers.add_parser('lookup', help='Look up the EEZ of each coordinate in a CSV.')
+    lookup_parser.add_argument('index_path', help='Path to an index saved by the build command.')
+    lookup_parser.add_argument('samples_csv_file', help='CSV file with latitude and longitude columns.')
+    lookup_parser.add_argument('output_csv_file', help='Path to write the samples, with EEZ columns added, to.')
+    lookup_parser.add_argument('--lat_column', default='latitude', help='Name of the latitude column.')
+    lookup_parser.add_argument('--lon_column', default='longitude', help='Name of the longitude column.')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        mapper = EezAbsMapper()
+        mapper.accept_input_parameters(args.shapefile_path, args.abs_csv_file, output_json_file='')
+        mapper.load_eez_data_from_shape_file()
+        mapper.load_abs_data_from_csv()
+        mapper.append_abs_status_to_eez_data()
+        EezAbsLookup.from_mapper(mapper).save(args.index_path)
+    else:
+        eez_lookup = EezAbsLookup.load(args.index_path)
+        samples = pd.read_csv(args.samples_csv_file)
+        logger.info(f"Looking up {len(samples)} samples...")
+        eezs = eez_lookup.lookup(samples[args.lat_column], samples[args.lon_column])
+        pd.concat([samples, eezs], axis=1).to_csv(args.output_csv_file, index=False)
+        logger.info(f"Samples with EEZs saved to {args.output_csv_file}")
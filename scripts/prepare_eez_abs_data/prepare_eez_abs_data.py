@@ -1,14 +1,34 @@
+import argparse
 import geopandas as gpd
 import json
 import logging
+import numpy as np
+import os
 import pandas as pd
+import shapely
+from shapely.geometry import mapping
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import topojson
+except ImportError:
+    topojson = None
 
 logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
 class EezAbsMapper:
-    def __init__(self):
+    JSON_BACKENDS = ('json', 'orjson')
+    GEOMETRY_FORMATS = ('geojson', 'topojson')
+
+    def __init__(self, compact_json=False, json_backend='json'):
+        self.compact_json = compact_json
+        self.json_backend = json_backend
         self.shapefile_path = None
         self.abs_csv_file = None
         self.output_json_file = None
@@ -35,27 +55,9 @@ class EezAbsMapper:
             logger.error(f"{self.abs_csv_file = } not found.")
             self.abs_csv_data = None
 
-    def get_eez_sovereigns_abs_status(self, row):
-        sovereigns_abs_status_mapping = {}
-
-        for i in range(1, 3):
-            sovereign_col = f'SOVEREIGN{i}'
-            sovereign_name = row[sovereign_col]
-
-            if pd.isna(sovereign_name):
-                continue
-
-            match = self.abs_csv_data[self.abs_csv_data['Country'] == sovereign_name]
-            if match.empty:
-                continue
-            abs_status_col = f'SOVEREIGN{i}_ABS_STATUS'
-            abs_status_value = match['Status'].values[0]
-
-            abs_status_value = int(abs_status_value)
-
-            sovereigns_abs_status_mapping[abs_status_col] = abs_status_value
-
-        return sovereigns_abs_status_mapping
+    def get_abs_status_by_country(self):
+        # The first row listed for a country is the one that applies
+        return self.abs_csv_data.drop_duplicates('Country').set_index('Country')['Status']
 
     def append_abs_status_to_eez_data(self):
         if self.eez_shapefile_data is None or self.abs_csv_data is None:
@@ -64,18 +66,24 @@ class EezAbsMapper:
 
         logger.info("Processing data to get sovereigns' ABS status...")
 
-        for _, row in self.eez_shapefile_data.iterrows():
-            row_data = row.drop('geometry').to_dict()
-
-            sovereigns_abs_status = self.get_eez_sovereigns_abs_status(row)
+        abs_status_by_country = self.get_abs_status_by_country()
+        eez_data = pd.DataFrame(self.eez_shapefile_data.drop(columns='geometry'))
 
-            for key, value in sovereigns_abs_status.items():
-                if pd.isna(value):
-                    sovereigns_abs_status[key] = None
+        unmatched_rows = {}
+        for i in range(1, 3):
+            sovereigns = eez_data[f'SOVEREIGN{i}']
+            abs_status_col = f'SOVEREIGN{i}_ABS_STATUS'
+            eez_data[abs_status_col] = sovereigns.map(abs_status_by_country).astype('Int64')
+            unmatched_rows[abs_status_col] = (~sovereigns.isin(abs_status_by_country.index)).to_numpy().nonzero()[0]
 
-            row_data.update(sovereigns_abs_status)
+        # NaN is not a valid JSON value, so every missing value is replaced with null, column by column
+        eez_data = eez_data.astype(object).where(eez_data.notna(), None)
+        self.eez_with_abs_json_data = eez_data.to_dict('records')
 
-            self.eez_with_abs_json_data.append(row_data)
+        # EEZs whose sovereign has no ABS status listed do not get the ABS status key at all
+        for abs_status_col, rows in unmatched_rows.items():
+            for row in rows:
+                del self.eez_with_abs_json_data[row][abs_status_col]
 
     def output_results_to_json_file(self):
         if not self.eez_with_abs_json_data:
@@ -84,22 +92,142 @@ class EezAbsMapper:
 
         logger.info(f"Saving JSON data to '{self.output_json_file}'...")
 
-        # Replace NaN values with null in the entire JSON data, as NaN is not a valid JSON value
-        for i, entry in enumerate(self.eez_with_abs_json_data):
-            for key, value in entry.items():
-                if pd.isna(value):
-                    self.eez_with_abs_json_data[i][key] = None
-
-        with open(self.output_json_file, 'w') as json_file:
-            json.dump(self.eez_with_abs_json_data, json_file, indent=2)
+        with open(self.output_json_file, 'wb') as json_file:
+            json_file.write(self.serialise_json(self.eez_with_abs_json_data))
 
         logger.info(f"JSON data saved to {self.output_json_file}")
 
+    @staticmethod
+    def get_zoom_level_tolerance(zoom_level):
+        """
+        Simplification tolerance, in degrees, of roughly one pixel of a 256px web map tile at `zoom_level`.
+        """
+        return 360 / (256 * 2 ** zoom_level)
+
+    def get_simplified_geometry(self, simplify_tolerance=0.0, coordinate_precision=None):
+        geometry = self.eez_shapefile_data.geometry
+        if geometry.crs is not None and not geometry.crs.equals('EPSG:4326'):
+            geometry = geometry.to_crs('EPSG:4326')
+        geometry = geometry.values
+        if simplify_tolerance:
+            geometry = self.simplify_geometry(geometry, simplify_tolerance)
+        if coordinate_precision is not None:
+            # Snap to the grid first, so that polygons stay valid, then round away float noise from the output
+            geometry = shapely.set_precision(geometry, 10 ** -coordinate_precision)
+            geometry = shapely.transform(geometry, lambda coordinates: np.round(coordinates, coordinate_precision))
+        return geometry
+
+    @staticmethod
+    def simplify_geometry(geometry, simplify_tolerance):
+        """
+        Simplify the polygons through a topology if topojson is installed, so that each border shared by neighbouring
+        EEZs is simplified once and they stay seamless. Otherwise each polygon is simplified on its own, which keeps
+        it valid, but lets shared borders drift apart into slivers and overlaps.
+        """
+        if topojson is None:
+            return shapely.simplify(geometry, simplify_tolerance, preserve_topology=True)
+        topology = topojson.Topology(gpd.GeoDataFrame(geometry=geometry), prequantize=False,
+                                     toposimplify=simplify_tolerance)
+        return topology.to_gdf().geometry.values
+
+    def output_geometry_with_abs_status(self, output_path, geometry_format='geojson', simplify_tolerance=0.0,
+                                        coordinate_precision=None, zoom_levels=None):
+        """
+        Write the EEZ polygons with their ABS status as GeoJSON or TopoJSON, so that the map layer can be loaded
+        from a single pre-joined file. With `zoom_levels`, one file per zoom level is written instead, each
+        simplified to about a pixel at that zoom, named like <output_path stem>_z<zoom level><extension>.
+        """
+        if not self.eez_with_abs_json_data:
+            logger.error("No data to save. Run 'append_abs_status_to_eez_data' first.")
+            return
+        if geometry_format == 'topojson' and topojson is None:
+            raise ImportError("TopoJSON output was requested but the topojson package is not installed.")
+        if (simplify_tolerance or zoom_levels) and topojson is None:
+            logger.warning("topojson is not installed, so each polygon is simplified on its own, "
+                           "and borders shared by neighbouring EEZs may no longer line up.")
+
+        if not zoom_levels:
+            outputs = [(output_path, simplify_tolerance)]
+        else:
+            output_stem, output_extension = os.path.splitext(output_path)
+            outputs = [(f"{output_stem}_z{zoom_level}{output_extension}", self.get_zoom_level_tolerance(zoom_level))
+                       for zoom_level in zoom_levels]
+
+        for path, tolerance in outputs:
+            logger.info(f"Saving {geometry_format} data simplified to {tolerance} degrees to '{path}'...")
+            if geometry_format == 'topojson':
+                content = self.serialise_topojson(tolerance, coordinate_precision)
+            else:
+                geometry = self.get_simplified_geometry(tolerance, coordinate_precision)
+                content = self.serialise_json({
+                    "type": "FeatureCollection",
+                    "features": [
+                        {"type": "Feature", "properties": properties, "geometry": mapping(polygon)}
+                        for properties, polygon in zip(self.eez_with_abs_json_data, geometry)
+                    ],
+                })
+            with open(path, 'wb') as geometry_file:
+                geometry_file.write(content)
+
+    def serialise_topojson(self, simplify_tolerance=0.0, coordinate_precision=None):
+        # Built as objects, so that ABS statuses of a column with missing values stay integers rather than floats
+        properties = pd.DataFrame(self.eez_with_abs_json_data, dtype=object)
+        properties = properties.where(properties.notna(), None)
+        geometry = self.get_simplified_geometry(coordinate_precision=coordinate_precision)
+        eez_data = gpd.GeoDataFrame(properties, geometry=geometry, crs='EPSG:4326')
+        # Shared borders are stored once as arcs, so simplifying them keeps neighbouring EEZs seamless
+        topology = topojson.Topology(eez_data, prequantize=self.get_topojson_transform(geometry, coordinate_precision),
+                                     toposimplify=simplify_tolerance or False)
+        return topology.to_json().encode()
+
+    @staticmethod
+    def get_topojson_transform(geometry, coordinate_precision=None):
+        """
+        A TopoJSON transform whose grid steps are `coordinate_precision` decimal places of a degree, whatever the
+        extent of the geometry, so that the quantised coordinates are those of the already snapped geometry.
+        """
+        if coordinate_precision is None:
+            return False
+        step = 10 ** -coordinate_precision
+        min_x, min_y, _, _ = shapely.total_bounds(geometry)
+        return {"scale": [step, step], "translate": [round(min_x, coordinate_precision),
+                                                     round(min_y, coordinate_precision)]}
+
+    def serialise_json(self, data):
+        if self.json_backend == 'orjson':
+            if orjson is None:
+                raise ImportError("The orjson JSON backend was requested but orjson is not installed.")
+            return orjson.dumps(data, option=0 if self.compact_json else orjson.OPT_INDENT_2)
+        if self.compact_json:
+            return json.dumps(data, separators=(',', ':')).encode()
+        return json.dumps(data, indent=2).encode()
+
 
 if __name__ == "__main__":
-    mapper = EezAbsMapper()
-    mapper.accept_input_parameters()
+    parser = argparse.ArgumentParser(description='Map the sovereigns of Exclusive Economic Zones to their ABS status.')
+    parser.add_argument('shapefile_path', nargs='?', help='Path to the EEZ shapefile. Prompted for if omitted.')
+    parser.add_argument('abs_csv_file', nargs='?', help='Path to the ABS status CSV file. Prompted for if omitted.')
+    parser.add_argument('output_json_file', nargs='?', help='Path to the output JSON file. Prompted for if omitted.')
+    parser.add_argument('--compact', action='store_true', help='Write the JSON without indentation or spaces.')
+    parser.add_argument('--json_backend', choices=EezAbsMapper.JSON_BACKENDS, default='json',
+                        help='JSON encoder to use. orjson is faster but must be installed separately.')
+    parser.add_argument('--geometry_output', help='Also write the EEZ polygons with their ABS status to this path.')
+    parser.add_argument('--geometry_format', choices=EezAbsMapper.GEOMETRY_FORMATS, default='geojson',
+                        help='Format of the geometry output. topojson must be installed separately.')
+    parser.add_argument('--simplify_tolerance', type=float, default=0.0,
+                        help='Tolerance, in degrees, of the topology-preserving simplification of the polygons.')
+    parser.add_argument('--coordinate_precision', type=int, default=None,
+                        help='Number of decimal places the polygon coordinates are quantised to.')
+    parser.add_argument('--zoom_levels', type=int, nargs='+', default=None,
+                        help='Write one geometry file per web map zoom level, simplified to suit each level.')
+    args = parser.parse_args()
+
+    mapper = EezAbsMapper(args.compact, args.json_backend)
+    mapper.accept_input_parameters(args.shapefile_path, args.abs_csv_file, args.output_json_file)
     mapper.load_eez_data_from_shape_file()
     mapper.load_abs_data_from_csv()
     mapper.append_abs_status_to_eez_data()
     mapper.output_results_to_json_file()
+    if args.geometry_output:
+        mapper.output_geometry_with_abs_status(args.geometry_output, args.geometry_format, args.simplify_tolerance,
+                                               args.coordinate_precision, args.zoom_levels)
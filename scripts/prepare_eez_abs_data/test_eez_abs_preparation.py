@@ -1,6 +1,17 @@
+import json
+import shutil
+import tempfile
 import unittest
 import os
-from prepare_eez_abs_data import EezAbsMapper  # Replace 'mymodule' with the actual module name
+from unittest import mock
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import Point, Polygon, box, shape
+import prepare_eez_abs_data
+from eez_abs_lookup import EezAbsLookup
+from prepare_eez_abs_data import EezAbsMapper, orjson, topojson  # Replace 'mymodule' with the actual module name
 
 
 class TestEezAbsMapper(unittest.TestCase):
@@ -27,5 +38,169 @@ class TestEezAbsMapper(unittest.TestCase):
         self.assertTrue(os.path.isfile(output_json_path))
 
 
+def make_synthetic_mapper():
+    """An EezAbsMapper with ABS statuses appended to three small, made-up EEZs side by side."""
+    mapper = EezAbsMapper()
+    mapper.eez_shapefile_data = gpd.GeoDataFrame({
+        'MRGID': [1, 2, 3],
+        'GEONAME': ['Algerian EEZ', 'Joint regime area Angola / Benin', 'Overlapping claim'],
+        'SOVEREIGN1': ['Algeria', 'Angola', 'Atlantis'],
+        'SOVEREIGN2': [None, 'Benin', 'Algeria'],
+        'UN_TER1': [12.0, float('nan'), 24.0],
+    }, geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1), box(2, 0, 3, 1)], crs='EPSG:4326')
+    mapper.abs_csv_data = pd.DataFrame({
+        'Country': ['Algeria', 'Angola', 'Benin', 'Algeria'],
+        'Status': [1, 2, 1, 3],
+        'Description': ['ABS laws', 'ABS laws coming', 'ABS laws', 'Duplicate'],
+    })
+    mapper.append_abs_status_to_eez_data()
+    return mapper
+
+
+class TestEezAbsMapperSynthetic(unittest.TestCase):
+    def setUp(self):
+        self.mapper = make_synthetic_mapper()
+
+    def test_abs_status_is_joined_by_sovereign(self):
+        algeria, angola_benin, overlapping = self.mapper.eez_with_abs_json_data
+        self.assertEqual(algeria['SOVEREIGN1_ABS_STATUS'], 1)
+        self.assertNotIn('SOVEREIGN2_ABS_STATUS', algeria)
+        self.assertEqual(angola_benin['SOVEREIGN1_ABS_STATUS'], 2)
+        self.assertEqual(angola_benin['SOVEREIGN2_ABS_STATUS'], 1)
+        self.assertNotIn('SOVEREIGN1_ABS_STATUS', overlapping)
+        self.assertEqual(overlapping['SOVEREIGN2_ABS_STATUS'], 1)
+        self.assertNotIn('geometry', algeria)
+
+    def test_missing_values_are_null(self):
+        algeria, angola_benin, _ = self.mapper.eez_with_abs_json_data
+        self.assertIsNone(algeria['SOVEREIGN2'])
+        self.assertIsNone(angola_benin['UN_TER1'])
+        self.assertEqual(algeria['UN_TER1'], 12.0)
+
+    def test_compact_output(self):
+        indented = self.mapper.serialise_json(self.mapper.eez_with_abs_json_data)
+        self.mapper.compact_json = True
+        compact = self.mapper.serialise_json(self.mapper.eez_with_abs_json_data)
+        self.assertLess(len(compact), len(indented))
+        self.assertEqual(json.loads(compact), json.loads(indented))
+
+    def test_geometry_output_per_zoom_level(self):
+        self.mapper.eez_shapefile_data.geometry = [Point(x, 0).buffer(1, quad_segs=64) for x in range(3)]
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+
+        self.mapper.output_geometry_with_abs_status(os.path.join(output_dir, 'eez.geojson'), coordinate_precision=3,
+                                                    zoom_levels=[2, 8])
+        with open(os.path.join(output_dir, 'eez_z2.geojson')) as f:
+            low_zoom = json.load(f)
+        with open(os.path.join(output_dir, 'eez_z8.geojson')) as f:
+            high_zoom = json.load(f)
+
+        self.assertEqual([feature['properties'] for feature in low_zoom['features']],
+                         self.mapper.eez_with_abs_json_data)
+        low_zoom_ring = low_zoom['features'][0]['geometry']['coordinates'][0]
+        high_zoom_ring = high_zoom['features'][0]['geometry']['coordinates'][0]
+        self.assertLess(len(low_zoom_ring), len(high_zoom_ring))
+        self.assertTrue(all(round(x, 3) == x and round(y, 3) == y for x, y in high_zoom_ring))
+
+    def set_wiggly_borders(self):
+        # Neighbouring EEZs whose shared borders wiggle, which simplification straightens
+        ys = np.linspace(0, 1, 200)
+        borders = [list(zip(x + 0.05 * np.sin(ys * 40), ys)) for x in (1, 2)]
+        self.mapper.eez_shapefile_data.geometry = [
+            Polygon([(0, 0), *borders[0], (0, 1)]),
+            Polygon([*borders[0], *borders[1][::-1]]),
+            Polygon([*borders[1], (3, 1), (3, 0)]),
+        ]
+
+    def write_simplified_geojson(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        output_path = os.path.join(output_dir, 'eez.geojson')
+        self.mapper.output_geometry_with_abs_status(output_path, simplify_tolerance=0.03, coordinate_precision=4)
+        with open(output_path) as f:
+            return json.load(f)
+
+    @unittest.skipIf(topojson is None, 'topojson is not installed')
+    def test_simplified_geojson_keeps_shared_borders(self):
+        self.set_wiggly_borders()
+        features = self.write_simplified_geojson()['features']
+
+        self.assertEqual([feature['properties'] for feature in features], self.mapper.eez_with_abs_json_data)
+        polygons = [shape(feature['geometry']) for feature in features]
+        self.assertLess(len(shapely.get_coordinates(polygons[1])), 100)
+        # Neighbours neither overlap nor leave slivers between them
+        for left, right in zip(polygons, polygons[1:]):
+            self.assertAlmostEqual(shapely.intersection(left, right).area, 0, places=9)
+        self.assertAlmostEqual(shapely.union_all(polygons).area, sum(polygon.area for polygon in polygons), places=9)
+        self.assertAlmostEqual(shapely.union_all(polygons).area, 3, places=9)
+
+    def test_simplified_geojson_without_topojson_warns_of_drifting_borders(self):
+        self.set_wiggly_borders()
+        with mock.patch.object(prepare_eez_abs_data, 'topojson', None), self.assertLogs(level='WARNING') as logs:
+            features = self.write_simplified_geojson()['features']
+        self.assertEqual(len(features), 3)
+        self.assertIn('may no longer line up', logs.output[0])
+
+    @unittest.skipIf(topojson is None, 'topojson is not installed')
+    def test_topojson_output(self):
+        self.mapper.eez_shapefile_data.geometry = [Point(x * 2 + 0.123456, 0.654321).buffer(1, quad_segs=16)
+                                                   for x in range(3)]
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        output_path = os.path.join(output_dir, 'eez.topojson')
+
+        self.mapper.output_geometry_with_abs_status(output_path, 'topojson', coordinate_precision=2)
+        with open(output_path) as f:
+            topology = json.load(f)
+
+        geometries = next(iter(topology['objects'].values()))['geometries']
+        self.assertEqual([geometry['properties'] for geometry in geometries],
+                         [{**{'SOVEREIGN1_ABS_STATUS': None, 'SOVEREIGN2_ABS_STATUS': None}, **properties}
+                          for properties in self.mapper.eez_with_abs_json_data])
+        self.assertIsInstance(geometries[1]['properties']['SOVEREIGN1_ABS_STATUS'], int)
+
+        (scale_x, scale_y), (translate_x, translate_y) = topology['transform'].values()
+        self.assertEqual((scale_x, scale_y), (0.01, 0.01))
+        for arc in topology['arcs']:
+            x, y = 0, 0
+            for delta_x, delta_y in arc:
+                x, y = x + delta_x, y + delta_y
+                self.assertAlmostEqual(translate_x + x * scale_x, round(translate_x + x * scale_x, 2), places=9)
+                self.assertAlmostEqual(translate_y + y * scale_y, round(translate_y + y * scale_y, 2), places=9)
+        self.assertEqual((translate_x, translate_y), (round(translate_x, 2), round(translate_y, 2)))
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_orjson_backend_matches_json_backend(self):
+        expected = json.loads(self.mapper.serialise_json(self.mapper.eez_with_abs_json_data))
+        for compact_json in (False, True):
+            self.mapper.json_backend = 'orjson'
+            self.mapper.compact_json = compact_json
+            self.assertEqual(json.loads(self.mapper.serialise_json(self.mapper.eez_with_abs_json_data)), expected)
+
+
+class TestEezAbsLookup(unittest.TestCase):
+    def setUp(self):
+        self.mapper = make_synthetic_mapper()
+
+    def test_lookup(self):
+        eez_lookup = EezAbsLookup.from_mapper(self.mapper)
+        eezs = eez_lookup.lookup(lats=[0.5, 0.5, 0.5, 5.0], lons=[0.5, 1.5, 2.5, 0.5])
+
+        self.assertEqual(list(eezs['MRGID']), [1, 2, 3, None])
+        self.assertEqual(list(eezs['SOVEREIGN1_ABS_STATUS']), [1, 2, None, None])
+        self.assertEqual(list(eezs['SOVEREIGN2_ABS_STATUS']), [None, 1, 1, None])
+
+    def test_saved_index_gives_same_lookups(self):
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        index_path = os.path.join(index_dir, 'eez.index')
+        EezAbsLookup.from_mapper(self.mapper).save(index_path)
+
+        lats, lons = [0.5, 0.5, -3.0], [0.5, 2.5, 1.0]
+        pd.testing.assert_frame_equal(EezAbsLookup.load(index_path).lookup(lats, lons),
+                                      EezAbsLookup.from_mapper(self.mapper).lookup(lats, lons))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,72 +1,68 @@
 import argparse
+from dataclasses import asdict, dataclass
 from datetime import datetime
+from functools import lru_cache, partial
 import glob
+import json
 import os
 from pathlib import Path
 import re
+import sys
 from uuid import uuid4
 
-from jinja2 import Template
 from rocrate.rocrate import ROCrate
-from rocrate.model.preview import Preview
 from rocrate.model.contextentity import ContextEntity
+from rocrate.utils import iso_now
 
+if __name__ == '__main__' and not __package__:
+    # Run as a script, so the scripts folder holding the shared mgnify_crates package is found from this file
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from mgnify_crates import CrateTemplate, MGnifyPreview, PackagingManifest, is_plain_file_name  # noqa: E402
 
-class MGnifyPreview(Preview):
-    def generate_html(self):
-        template = open('mgnify-rocrate-preview-template.html.j2')
-        src = Template(template.read())
-
-        def template_function(func):
-            src.globals[func.__name__] = func
-            return func
-
-        @template_function
-        def stringify(a):
-            if type(a) is list:
-                return ', '.join([stringify(aa) for aa in a])
-            elif type(a) is str:
-                return a
-            elif hasattr(a, '_jsonld') and a._jsonld.get('name'):
-                    return a._jsonld['name']
-            elif type(a) is dict:
-                return stringify(list(a.values()))
-            else:
-                return a
-
-        @template_function
-        def is_object_list(a):
-            if type(a) is list:
-                for obj in a:
-                    if obj is not str:
-                        return True
-            else:
-                return False
-
-        @template_function
-        def details(a):
-            if type(a) is dict:
-                return {k: v for k, v in a.items() if k not in ['@id', '@type']}
-
-        template.close()
-        context_entities = []
-        data_entities = []
-        for entity in self.crate.contextual_entities:
-            context_entities.append(entity._jsonld)
-        for entity in self.crate.data_entities:
-            data_entities.append(entity._jsonld)
-        out_html = src.render(crate=self.crate, context=context_entities, data=data_entities)
-        return out_html
-
-def create_metapuf_rocrate(gff_path: str, pride_id: str, crate_path: str):
-    try:
-        assembly = re.findall(r"ERZ[\d]*", gff_path)[0]
-    except KeyError:
-        print(f'Could not determine assembly accession from path {gff_path}')
+# The values that differ between MetaPUF crates
+METAPUF_CRATE_FIELDS = ('gff_name', 'assembly', 'pride_id', 'run_id', 'end_time', 'date_published')
+METAPUF_VERSION = "1.0.0"
+ERZ_ACCESSION_PATTERN = re.compile(r"ERZ\d+")
+
+
+@dataclass
+class PackagingResult:
+    gff_path: str
+    status: str  # 'packaged', 'unchanged' or 'skipped'
+    crate: str = None
+    reason: str = None
+
+
+def get_assembly_accession(gff_path):
+    """The ERZ accession in the GFF's file name, or failing that, anywhere in its path."""
+    match = ERZ_ACCESSION_PATTERN.search(os.path.basename(gff_path)) or ERZ_ACCESSION_PATTERN.search(gff_path)
+    return match.group() if match else None
+
+
+def iter_gff_paths(gff_paths, from_list=False):
+    """
+    Lazily yield GFF paths from a glob pattern or, with from_list, a text file of paths (- for stdin),
+    so that packaging starts without listing every path first.
+    """
+    if not from_list:
+        yield from glob.iglob(gff_paths)
         return
+    list_file = sys.stdin if gff_paths == '-' else open(gff_paths, 'r')
+    try:
+        for line in list_file:
+            path = line.strip()
+            if path:
+                yield path
+    finally:
+        if list_file is not sys.stdin:
+            list_file.close()
 
+
+def build_metapuf_rocrate(gff_path, gff_name, assembly, pride_id, run_id, end_time, date_published=None):
     crate = ROCrate(gen_preview=False)
     crate.add(MGnifyPreview(crate))
+    if date_published:
+        crate.root_dataset["datePublished"] = date_published
 
     # Conform to the WFRUN profile
     PC_PROFILE_ID = "https://w3id.org/ro/wfrun/process/0.3"
@@ -88,7 +84,7 @@ def create_metapuf_rocrate(gff_path: str, pride_id: str, crate_path: str):
         "name": "MetaPUF",
         "url": "https://github.com/PRIDE-reanalysis/MetaPUF",
         "codeRepository": "https://github.com/PRIDE-reanalysis/MetaPUF",
-        "version": "1.0.0",
+        "version": METAPUF_VERSION,
     }))
     fnr = crate.add(ContextEntity(crate, "https://ror.org/039z13y21", properties={
         "@type": "Organization",
@@ -126,11 +122,10 @@ def create_metapuf_rocrate(gff_path: str, pride_id: str, crate_path: str):
     }))
     crate.creator = agent
 
-    fin = os.path.getctime(gff_path)
-
     ## Add GFF output file
     gff = crate.add_file(
         gff_path,
+        dest_path=gff_name,
         properties={
             "name": "annotations gff",
             "encodingFormat": "text/x-gff3"
@@ -138,11 +133,10 @@ def create_metapuf_rocrate(gff_path: str, pride_id: str, crate_path: str):
     )
 
     ## Add link
-    run_id = uuid4().hex
     run = crate.add(ContextEntity(crate, run_id, properties={
         "@type": "CreateAction",
         "name": f"MetaPUF annotations for {assembly}",
-        "endTime": datetime.fromtimestamp(fin).isoformat(),
+        "endTime": end_time,
         "description": "",
     }))
     run.append_to("result", gff)
@@ -162,22 +156,103 @@ def create_metapuf_rocrate(gff_path: str, pride_id: str, crate_path: str):
     for col in gff_cols:
         crate.root_dataset.append_to("variableMeasured", col)
 
-    crate.write_zip(Path(crate_path) / Path(f"metapuf_{sourcecode['version']}_{assembly}.zip"))
+    return crate
+
+
+@lru_cache(maxsize=None)
+def get_metapuf_crate_template():
+    return CrateTemplate(partial(build_metapuf_rocrate, None), METAPUF_CRATE_FIELDS,
+                         date_fields=['date_published'])
+
+
+def create_metapuf_rocrate(gff_path: str, pride_id: str, crate_path: str, use_rocrate_model: bool = False,
+                           manifest: PackagingManifest = None):
+    """
+    Package a MetaPUF GFF as a crate in crate_path.
+    Crates are filled in from a template built once through rocrate, unless use_rocrate_model is set,
+    in which case each one is built through the full rocrate object model; both give the same files.
+    With a manifest, the crate is only packaged if the GFF's content, the PRIDE ID or the MetaPUF version
+    differ from those it was last packaged with.
+    GFFs that cannot be packaged give a 'skipped' result with the reason, rather than raising.
+    """
+    assembly = get_assembly_accession(gff_path)
+    if assembly is None:
+        return PackagingResult(gff_path, 'skipped', reason='Could not determine assembly accession from path')
+    try:
+        return package_metapuf_rocrate(gff_path, assembly, pride_id, crate_path, use_rocrate_model, manifest)
+    except OSError as e:
+        return PackagingResult(gff_path, 'skipped', reason=str(e))
+
+
+def package_metapuf_rocrate(gff_path, assembly, pride_id, crate_path, use_rocrate_model, manifest):
+    zip_path = Path(crate_path) / Path(f"metapuf_{METAPUF_VERSION}_{assembly}.zip")
+    if manifest is not None:
+        gff_fingerprint = manifest.get_source_fingerprint(zip_path, gff_path)
+        inputs = {'pride_id': pride_id, 'metapuf_version': METAPUF_VERSION}
+        if manifest.is_up_to_date(zip_path, gff_fingerprint, **inputs):
+            if any(manifest.get(zip_path).get(key) != value for key, value in gff_fingerprint.items()):
+                # Same content, but touched or moved: record where it is now so it is not hashed again
+                manifest.record(zip_path, **gff_fingerprint, **inputs)
+            return PackagingResult(gff_path, 'unchanged', crate=str(zip_path))
+
+    values = {
+        'gff_name': os.path.basename(gff_path),
+        'assembly': assembly,
+        'pride_id': pride_id,
+        'run_id': uuid4().hex,
+        'end_time': datetime.fromtimestamp(os.path.getctime(gff_path)).isoformat(),
+        'date_published': iso_now(),
+    }
+    if use_rocrate_model or not is_plain_file_name(values['gff_name']):
+        build_metapuf_rocrate(gff_path, **values).write_zip(zip_path)
+    else:
+        get_metapuf_crate_template().write_zip(zip_path, [gff_path], **values)
+    if manifest is not None:
+        manifest.record(zip_path, **gff_fingerprint, **inputs)
+    return PackagingResult(gff_path, 'packaged', crate=str(zip_path))
 
 
 def main():
     parser = argparse.ArgumentParser(description="Take MetaPUF-generated GFF files and create RO-Crates for each one.")
-    parser.add_argument("gff_paths", type=str, help="Glob pattern for GFF files")
+    parser.add_argument("gff_paths", type=str,
+                        help="Glob pattern for GFF files, or with --from_list a text file of GFF paths (- for stdin)")
     parser.add_argument("pride_id", type=str, help="PRIDE ID for all assemblies")
     parser.add_argument("--output_dir", type=str, help="Output directory for the crates", default="./crates")
+    parser.add_argument("--from_list", action="store_true",
+                        help="Read GFF paths, one per line, from the file (or stdin) given as gff_paths")
+    parser.add_argument("--skip_report", type=str, default=None,
+                        help="JSON-lines file to record the GFFs that could not be packaged, and why, in")
+    parser.add_argument("--use_rocrate_model", action="store_true",
+                        help="Build every crate through the rocrate object model, rather than from a template")
+    parser.add_argument("--manifest", type=str, default=None,
+                        help="JSON-lines manifest of what each crate was packaged from. If given, crates whose GFF, "
+                             "PRIDE ID and MetaPUF version are unchanged since they were last packaged are skipped")
 
     args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest = PackagingManifest(args.manifest) if args.manifest else None
 
-    gff_files = glob.glob(args.gff_paths)
+    counts = {'packaged': 0, 'unchanged': 0, 'skipped': 0}
+    skip_report = open(args.skip_report, 'w') if args.skip_report else None
+    try:
+        for gff_file in iter_gff_paths(args.gff_paths, args.from_list):
+            print(f"Processing {gff_file}")
+            result = create_metapuf_rocrate(gff_file, args.pride_id, args.output_dir, args.use_rocrate_model,
+                                            manifest)
+            counts[result.status] += 1
+            if result.status == 'unchanged':
+                print(f"Skipping {gff_file}, which is unchanged since {result.crate} was packaged")
+            elif result.status == 'skipped':
+                print(f"Skipping {gff_file}: {result.reason}")
+                if skip_report:
+                    skip_report.write(json.dumps(asdict(result)) + '\n')
+    finally:
+        if skip_report:
+            skip_report.close()
 
-    for gff_file in gff_files:
-        print(f"Processing {gff_file}")
-        create_metapuf_rocrate(gff_file, args.pride_id, args.output_dir)
+    if manifest:
+        manifest.compact()
+    print(f"Packaged {counts['packaged']} crates, {counts['unchanged']} unchanged, {counts['skipped']} skipped")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,206 @@
+import contextlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+from importlib.metadata import version
+from unittest import mock
+
+from mgnify_crates import PackagingManifest
+from package_metapuf_as_crates import METAPUF_VERSION, create_metapuf_rocrate, iter_gff_paths, main
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE_GFF = os.path.join(SCRIPT_DIR, 'examples', 'ERZ1669337_unique_peptides.gff')
+PRIDE_ID = 'PXD005780'
+
+# The values that differ between two crates of the same GFF: the run's id, and the publication date
+# as an ISO date in the metadata and as Python prints it in the preview
+UUID_PATTERN = re.compile(rb'[0-9a-f]{32}')
+DATE_PATTERN = re.compile(rb'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d+)?([+-]\d{2}:\d{2})?')
+
+
+def read_normalised_zip(zip_path):
+    with zipfile.ZipFile(zip_path) as archive:
+        return {
+            name: DATE_PATTERN.sub(b'<date>', UUID_PATTERN.sub(b'<uuid>', archive.read(name)))
+            for name in archive.namelist()
+        }
+
+
+class TestMetapufCratePackaging(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.gff_path = shutil.copy(EXAMPLE_GFF, self.temp_dir)
+        self.crates_dir = os.path.join(self.temp_dir, 'crates')
+        os.makedirs(self.crates_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def assert_same_crate_both_ways(self, gff_path):
+        model_dir = os.path.join(self.temp_dir, 'model')
+        os.makedirs(model_dir)
+        template_result = create_metapuf_rocrate(gff_path, PRIDE_ID, self.crates_dir)
+        model_result = create_metapuf_rocrate(gff_path, PRIDE_ID, model_dir, use_rocrate_model=True)
+        self.assertEqual(template_result.status, 'packaged')
+        self.assertEqual(model_result.status, 'packaged')
+        self.assertEqual(os.path.basename(template_result.crate), os.path.basename(model_result.crate))
+        template_files = read_normalised_zip(template_result.crate)
+        self.assertEqual(template_files, read_normalised_zip(model_result.crate))
+        return template_files
+
+    def test_rocrate_is_the_pinned_version(self):
+        with open(os.path.join(SCRIPT_DIR, 'requirements.txt')) as requirements:
+            pins = dict(line.strip().split('==') for line in requirements if '==' in line)
+        self.assertEqual(version('rocrate'), pins['rocrate'])
+
+    def test_template_matches_rocrate_model(self):
+        files = self.assert_same_crate_both_ways(self.gff_path)
+        self.assertIn(os.path.basename(self.gff_path), files)
+        self.assertIn(PRIDE_ID.encode(), files['ro-crate-metadata.json'])
+
+    def test_file_name_rocrate_encodes_matches_rocrate_model(self):
+        gff_path = os.path.join(self.temp_dir, 'ERZ1669337 unique peptides #1.gff')
+        shutil.move(self.gff_path, gff_path)
+        files = self.assert_same_crate_both_ways(gff_path)
+        self.assertIn(os.path.basename(gff_path), files)
+        self.assertIn(b'ERZ1669337%20unique%20peptides%20%231.gff', files['ro-crate-metadata.json'])
+
+
+class TestMetapufPackagingManifest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.gff_path = shutil.copy(EXAMPLE_GFF, self.temp_dir)
+        self.crates_dir = os.path.join(self.temp_dir, 'crates')
+        os.makedirs(self.crates_dir)
+        self.manifest_path = os.path.join(self.temp_dir, 'manifest.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def package(self, pride_id=PRIDE_ID):
+        # A fresh manifest each time, as each run of the packager loads it anew
+        return create_metapuf_rocrate(self.gff_path, pride_id, self.crates_dir,
+                                      manifest=PackagingManifest(self.manifest_path))
+
+    def test_unchanged_gff_is_skipped(self):
+        first = self.package()
+        self.assertEqual(first.status, 'packaged')
+        entry = PackagingManifest(self.manifest_path).get(first.crate)
+        self.assertEqual(entry['pride_id'], PRIDE_ID)
+        self.assertEqual(entry['metapuf_version'], METAPUF_VERSION)
+
+        second = self.package()
+        self.assertEqual(second.status, 'unchanged')
+        self.assertEqual(second.crate, first.crate)
+
+    def test_touched_gff_with_the_same_content_is_skipped(self):
+        crate = self.package().crate
+        stat = os.stat(self.gff_path)
+        os.utime(self.gff_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        self.assertEqual(self.package().status, 'unchanged')
+        # The new mtime is recorded, so the GFF is not hashed again next time
+        entry = PackagingManifest(self.manifest_path).get(crate)
+        self.assertEqual(entry['source_mtime_ns'], stat.st_mtime_ns + 10 ** 9)
+
+    def test_changed_gff_is_packaged_again(self):
+        self.package()
+        with open(self.gff_path, 'a') as gff:
+            gff.write('##extra line\n')
+        self.assertEqual(self.package().status, 'packaged')
+
+    def test_changed_pride_id_is_packaged_again(self):
+        self.package()
+        self.assertEqual(self.package(pride_id='PXD000001').status, 'packaged')
+
+    def test_changed_metapuf_version_is_packaged_again(self):
+        crate = self.package().crate
+        manifest = PackagingManifest(self.manifest_path)
+        manifest.record(crate, **{**manifest.get(crate), 'metapuf_version': '0.9.0'})
+        self.assertEqual(self.package().status, 'packaged')
+
+    def test_missing_zip_is_packaged_again(self):
+        os.remove(self.package().crate)
+        self.assertEqual(self.package().status, 'packaged')
+
+    def test_truncated_last_line_is_ignored(self):
+        crate = self.package().crate
+        with open(self.manifest_path, 'a') as manifest:
+            manifest.write('{"crate": "trunc')
+        manifest = PackagingManifest(self.manifest_path)
+        self.assertEqual(list(manifest.entries), [crate])
+
+        manifest.compact()
+        with open(self.manifest_path) as compacted:
+            self.assertEqual([json.loads(line)['crate'] for line in compacted], [crate])
+
+
+
+class TestMetapufInputs(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.gff_path = shutil.copy(EXAMPLE_GFF, self.temp_dir)
+        self.crates_dir = os.path.join(self.temp_dir, 'crates')
+        self.missing_gff_path = os.path.join(self.temp_dir, 'ERZ0000001_unique_peptides.gff')
+        self.unnamed_gff_path = shutil.copy(EXAMPLE_GFF, os.path.join(self.temp_dir, 'unique_peptides.gff'))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_list_file(self, *paths):
+        list_path = os.path.join(self.temp_dir, 'gff_paths.txt')
+        with open(list_path, 'w') as list_file:
+            list_file.write('\n'.join(paths) + '\n\n')
+        return list_path
+
+    def run_main(self, *args, stdin=None):
+        output = io.StringIO()
+        with mock.patch.object(sys, 'argv', ['package_metapuf_as_crates.py', *args]), \
+                mock.patch.object(sys, 'stdin', stdin or sys.stdin), contextlib.redirect_stdout(output):
+            main()
+        return output.getvalue()
+
+    def test_paths_are_read_from_a_glob(self):
+        self.assertEqual(sorted(iter_gff_paths(os.path.join(self.temp_dir, '*.gff'))),
+                         sorted([self.gff_path, self.unnamed_gff_path]))
+
+    def test_paths_are_read_from_a_list_file_without_blank_lines(self):
+        list_path = self.write_list_file(self.gff_path, f'  {self.missing_gff_path}  ')
+        self.assertEqual(list(iter_gff_paths(list_path, from_list=True)), [self.gff_path, self.missing_gff_path])
+
+    def test_paths_are_read_from_stdin(self):
+        with mock.patch.object(sys, 'stdin', io.StringIO(f'{self.gff_path}\n\n{self.missing_gff_path}\n')):
+            self.assertEqual(list(iter_gff_paths('-', from_list=True)), [self.gff_path, self.missing_gff_path])
+
+    def test_gffs_that_cannot_be_packaged_are_reported_and_skipped(self):
+        skip_report_path = os.path.join(self.temp_dir, 'skipped.jsonl')
+        stdin = io.StringIO('\n'.join([self.missing_gff_path, self.unnamed_gff_path, self.gff_path]) + '\n')
+        output = self.run_main('-', PRIDE_ID, '--from_list', '--output_dir', self.crates_dir,
+                               '--skip_report', skip_report_path, stdin=stdin)
+
+        self.assertIn('Packaged 1 crates, 0 unchanged, 2 skipped', output)
+        self.assertTrue(os.path.exists(os.path.join(self.crates_dir, f'metapuf_{METAPUF_VERSION}_ERZ1669337.zip')))
+        with open(skip_report_path) as skip_report:
+            skipped = [json.loads(line) for line in skip_report]
+        self.assertEqual([entry['gff_path'] for entry in skipped], [self.missing_gff_path, self.unnamed_gff_path])
+        self.assertEqual({entry['status'] for entry in skipped}, {'skipped'})
+        self.assertIn('No such file or directory', skipped[0]['reason'])
+        self.assertEqual(skipped[1]['reason'], 'Could not determine assembly accession from path')
+
+    def test_skip_report_is_empty_without_skips(self):
+        skip_report_path = os.path.join(self.temp_dir, 'skipped.jsonl')
+        output = self.run_main(self.write_list_file(self.gff_path), PRIDE_ID, '--from_list',
+                               '--output_dir', self.crates_dir, '--skip_report', skip_report_path)
+        self.assertIn('Packaged 1 crates, 0 unchanged, 0 skipped', output)
+        with open(skip_report_path) as skip_report:
+            self.assertEqual(skip_report.read(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import datetime
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+
+
+class ArchiveCache:
+    """
+    A directory of downloaded tarballs, shared by runs, worker processes and hosts, that can be used instead of
+    downloading a tarball again. Each is stored under a hash of its URL and of a validator of its content
+    (its MD5, or else its ETag), so a tarball that changes on the server is downloaded again, under a new key.
+    Processes coordinate with a lock file per key, which needs a filesystem that honours flock (e.g. local disk,
+    NFSv4 or Lustre mounted with flock). The least recently used tarballs are evicted once the cache is over max_size.
+    """
+    DATA_SUFFIX = '.tar.gz'
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(url, validator):
+        return hashlib.sha256(f"{url}\n{validator}".encode()).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}{self.DATA_SUFFIX}")
+
+    def get_info_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    @contextmanager
+    def lock(self, key, blocking=True):
+        """
+        Hold the lock of key: downloading a tarball into the cache, reading it and evicting it are done with it held.
+        Yields whether the lock was taken, which is always the case unless blocking is False.
+        """
+        with open(os.path.join(self.cache_dir, f"{key}.lock"), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, key):
+        """The recorded details of the cached tarball of key, or None if it is not cached. Call with its lock held."""
+        try:
+            with open(self.get_info_path(key), 'r') as f:
+                info = json.load(f)
+            # Its modification time is when it was last used, which eviction goes by
+            os.utime(self.get_path(key))
+        except (OSError, json.JSONDecodeError):
+            return None
+        return info
+
+    def put(self, key, **info):
+        """Record that the tarball of key has been written to get_path(key). Call with its lock held."""
+        info = {**info, 'key': key, 'cached': datetime.datetime.now().isoformat(timespec='seconds')}
+        info_path = self.get_info_path(key)
+        with open(f"{info_path}.tmp", 'w') as f:
+            json.dump(info, f)
+        os.replace(f"{info_path}.tmp", info_path)
+        return info
+
+    def link(self, key, path):
+        """
+        Put the cached tarball of key at path, as a hard link if path is on the same filesystem.
+        The link keeps the file for as long as path needs it, even if it is evicted in the meantime.
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        try:
+            os.link(self.get_path(key), path)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            shutil.copyfile(self.get_path(key), path)
+
+    def evict(self):
+        """Remove the least recently used tarballs, other than those locked by a process, until under max_size."""
+        if self.max_size is None:
+            return
+        with self.lock('evict', blocking=False) as locked:
+            if not locked:
+                # Another process is already evicting
+                return
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(self.DATA_SUFFIX):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name[:-len(self.DATA_SUFFIX)]))
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, key in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                with self.lock(key, blocking=False) as locked:
+                    if not locked:
+                        continue
+                    for path in (self.get_info_path(key), self.get_path(key)):
+                        try:
+                            os.remove(path)
+                        except FileNotFoundError:
+                            pass
+                    total_size -= size
+                    logging.info(f"Evicted {key} from the archive cache")
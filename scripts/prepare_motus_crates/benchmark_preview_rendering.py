@@ -0,0 +1,37 @@
+import argparse
+import time
+
+from ro_crate_ui_assets_provider import RoCrateUIAssetsProvider
+
+
+def make_metadata(parts):
+    return {'@graph': [
+        {'@id': 'ro-crate-metadata.json', '@type': 'CreativeWork', 'about': {'@id': './'}},
+        {'@id': './', '@type': 'Dataset', 'name': 'mOTUs run SRR0000001', 'datePublished': '2024-01-01',
+         'hasPart': [{'@id': f'krona_{i}.html', '@type': 'File', 'name': f'krona_{i}.html',
+                      'datePublished': '2024-01-01'} for i in range(parts)]},
+    ]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time rendering the preview of crates with many parts')
+    parser.add_argument('--parts', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Numbers of hasPart entries to render crates with')
+    args = parser.parse_args()
+
+    asset_provider = RoCrateUIAssetsProvider()
+    for parts in args.parts:
+        metadata = make_metadata(parts)
+        krona_subfolder_names = [str(i) for i in range(parts)]
+        start = time.perf_counter()
+        metadata_html = asset_provider.generate_metadata_html(metadata)
+        preview_html = asset_provider.generate_preview_html('SRR0000001', '.', metadata_html, include_krona_files=True,
+                                                            include_multiqc_report=True,
+                                                            krona_subfolder_names=krona_subfolder_names)
+        seconds = time.perf_counter() - start
+        print(f'{parts:>8} parts: {seconds * 1000:8.1f} ms, {seconds * 1e6 / parts:6.2f} us/part, '
+              f'{len(preview_html) / 1e6:6.1f} MB of HTML')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+from mgnify_crates.jsonlines_manifest import JsonLinesManifest
+
+
+class CrateManifest(JsonLinesManifest):
+    """
+    Record of how far each source tarball got through crate preparation, keyed by URL.
+    """
+    DOWNLOADED = 'downloaded'
+    EXTRACTED = 'extracted'
+    ZIPPED = 'zipped'
+
+    key_field = 'source'
+
+    def record(self, source, **fields):
+        # Fields of earlier stages are kept, so that e.g. the md5 of the download is still known once zipped
+        super().record(source, **{**self.get(source), **fields})
+
+    @staticmethod
+    def validators_match(entry, remote_info):
+        """
+        True if every validator (ETag, content-length) known both to the manifest and the server agrees.
+        """
+        for key in ('etag', 'content_length'):
+            if entry.get(key) is not None and remote_info.get(key) is not None and entry[key] != remote_info[key]:
+                return False
+        return True
@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import html
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from urllib.parse import urljoin
+
+import aiohttp
+
+HREF_PATTERN = re.compile(r'<a\s[^>]*?href\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE)
+
+
+def parse_listing_links(listing_url, listing_html):
+    """
+    Find the subdirectories and .tar.gz files linked from a directory listing page.
+    Only links below `listing_url` are kept, which drops the column sorting, parent directory and any
+    other navigation links of the listing wherever they appear on the page.
+    """
+    subdirectory_urls = []
+    tarball_urls = []
+    for href in HREF_PATTERN.findall(listing_html):
+        href = html.unescape(href)
+        if href.startswith(('?', '#')):
+            continue
+        url = urljoin(listing_url, href)
+        if url == listing_url or not url.startswith(listing_url):
+            continue
+        if url.endswith('/'):
+            subdirectory_urls.append(url)
+        elif url.endswith('.tar.gz'):
+            tarball_urls.append(url)
+    return subdirectory_urls, tarball_urls
+
+
+class DirectoryListingCrawler:
+    """
+    Walks a tree of HTTP directory listings (e.g. the motus_web FTP area), fetching up to `concurrency`
+    listings at a time over one pooled session, and hands over each .tar.gz URL as soon as it is found.
+    """
+
+    def __init__(self, concurrency=16, cache_dir=None, cache_max_age=24 * 60 * 60, timeout=60):
+        self.concurrency = concurrency
+        self.cache_dir = cache_dir
+        self.cache_max_age = cache_max_age
+        self.timeout = timeout
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_cache_path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+    def read_cached_listing(self, url):
+        if not self.cache_dir:
+            return None
+        cache_path = self.get_cache_path(url)
+        try:
+            if self.cache_max_age is not None and time.time() - os.path.getmtime(cache_path) > self.cache_max_age:
+                return None
+            with open(cache_path, 'r') as f:
+                cached = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        return cached['subdirectories'], cached['tarballs']
+
+    def write_cached_listing(self, url, subdirectory_urls, tarball_urls):
+        if not self.cache_dir:
+            return
+        cache_path = self.get_cache_path(url)
+        with open(f"{cache_path}.tmp", 'w') as f:
+            json.dump({'url': url, 'subdirectories': subdirectory_urls, 'tarballs': tarball_urls}, f)
+        os.replace(f"{cache_path}.tmp", cache_path)
+
+    async def fetch_listing(self, session, url):
+        cached = self.read_cached_listing(url)
+        if cached is not None:
+            return cached
+        async with session.get(url) as response:
+            if response.status != 200:
+                logging.warning(f"Failed to fetch {url}: HTTP {response.status}")
+                return [], []
+            listing_html = await response.text()
+        links = parse_listing_links(url, listing_html)
+        self.write_cached_listing(url, *links)
+        return links
+
+    async def crawl(self, root_url, on_tarball_found):
+        if not root_url.endswith('/'):
+            root_url += '/'
+        directories = asyncio.Queue()
+        directories.put_nowait(root_url)
+        seen = {root_url}
+
+        async def crawl_directories(session):
+            while True:
+                url = await directories.get()
+                try:
+                    subdirectory_urls, tarball_urls = await self.fetch_listing(session, url)
+                    for tarball_url in tarball_urls:
+                        on_tarball_found(tarball_url)
+                    for subdirectory_url in subdirectory_urls:
+                        if subdirectory_url not in seen:
+                            seen.add(subdirectory_url)
+                            directories.put_nowait(subdirectory_url)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logging.warning(f"Failed to fetch {url}: {e}")
+                except Exception:
+                    # Any other error must not end the worker, or the listings left in the queue are never crawled
+                    logging.exception(f"Failed to crawl {url}")
+                finally:
+                    directories.task_done()
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            workers = [asyncio.create_task(crawl_directories(session)) for _ in range(self.concurrency)]
+            try:
+                await directories.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+    def iter_tarball_urls(self, root_url):
+        """
+        Crawl from `root_url` on a background event loop, yielding .tar.gz URLs while the crawl is still running.
+        """
+        found = queue.Queue()
+        done = object()
+        errors = []
+
+        def run_crawl():
+            try:
+                asyncio.run(self.crawl(root_url, found.put))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                found.put(done)
+
+        thread = threading.Thread(target=run_crawl, name='directory-listing-crawler', daemon=True)
+        thread.start()
+        while (url := found.get()) is not done:
+            yield url
+        thread.join()
+        if errors:
+            raise errors[0]
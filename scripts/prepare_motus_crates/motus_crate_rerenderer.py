@@ -0,0 +1,138 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+import shutil
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from motus_ro_crates_preparer import REPORT_COPY_CHUNK_SIZE, CratePreparationResult, MotusRoCratesPreparer
+from ro_crate_ui_assets_provider import RoCrateUIAssetsProvider
+from ro_crate_writers import ZipRoCrateWriter
+from tqdm import tqdm
+
+CRATE_ZIP_PATTERN = re.compile(r'^motus_(?P<srr_value>[^.]+)\.zip$')
+KRONA_REPORT_PATTERN = re.compile(r'^krona_(?P<subfolder_name>[^/]+)\.html$')
+MULTIQC_REPORT_NAME = 'multiqc_report.html'
+# The home button script and styling prepended to each report when its crate was prepared
+HOME_BUTTON_PREFIX_PATTERN = re.compile(rb'\A<script>.*?</script>\n<style>.*?</style>\n', re.DOTALL)
+MAX_HOME_BUTTON_PREFIX_SIZE = 1024 * 1024
+
+# Rerenderer used by a pool worker process, set once per worker by init_worker
+_worker_rerenderer = None
+
+
+def init_worker(rerenderer):
+    global _worker_rerenderer
+    _worker_rerenderer = rerenderer
+    MotusRoCratesPreparer.setup_logging()
+
+
+def rerender_crate_in_worker(zip_path):
+    return _worker_rerenderer.rerender_single_crate(zip_path)
+
+
+def get_published_date(metadata):
+    for entity in metadata.get('@graph', []):
+        if entity.get('@id') == './':
+            return entity.get('datePublished')
+    return None
+
+
+class MotusCrateRerenderer:
+    """
+    Rebuilds the HTML of existing mOTUs crates with the current assets and templates, without their tarballs:
+    the home button of each report, and the preview with its rendering of the metadata.
+    ro-crate-metadata.json and any other files are copied as they are, and each crate's zip is replaced once its
+    new version is complete.
+    """
+
+    def __init__(self, crates_folder_path, workers=1, minify_assets=False, zip_compression_level=6):
+        self.crates_folder_path = crates_folder_path
+        self.workers = max(1, workers)
+        self.zip_compression_level = zip_compression_level
+        self.ro_crate_asset_provider = RoCrateUIAssetsProvider(minify_assets)
+
+    def iter_crate_zips(self):
+        for zip_path in sorted(glob.glob(os.path.join(self.crates_folder_path, 'motus_*.zip'))):
+            if CRATE_ZIP_PATTERN.match(os.path.basename(zip_path)):
+                yield zip_path
+
+    def rerender_crates(self):
+        MotusRoCratesPreparer.setup_logging()
+        zip_paths = list(self.iter_crate_zips())
+        if self.workers > 1:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=(self,)) as executor:
+                results = list(tqdm(executor.map(rerender_crate_in_worker, zip_paths, chunksize=16),
+                                    total=len(zip_paths), desc="Re-rendering RO crates"))
+        else:
+            results = [self.rerender_single_crate(zip_path)
+                       for zip_path in tqdm(zip_paths, desc="Re-rendering RO crates")]
+        MotusRoCratesPreparer.log_results_summary(results)
+        return results
+
+    def rerender_single_crate(self, zip_path):
+        """Re-render one crate, reporting failure as a result instead of raising, so the batch carries on."""
+        srr_value = CRATE_ZIP_PATTERN.match(os.path.basename(zip_path)).group('srr_value')
+        try:
+            self.rerender_crate(zip_path, srr_value)
+        except Exception as e:
+            logging.error(f"Failed to re-render RO crate {zip_path}: {e}")
+            return CratePreparationResult(zip_path, srr_value, 'failed', str(e))
+        return CratePreparationResult(zip_path, srr_value, 'succeeded')
+
+    def rerender_crate(self, zip_path, srr_value):
+        writer = ZipRoCrateWriter(zip_path, self.zip_compression_level)
+        try:
+            with zipfile.ZipFile(zip_path) as crate:
+                names = [name for name in crate.namelist() if not name.endswith('/')]
+                metadata = json.loads(crate.read('ro-crate-metadata.json'))
+                for name in names:
+                    if name == 'ro-crate-preview.html':
+                        continue
+                    with crate.open(name) as source, writer.open(name) as dest:
+                        if self.is_report(name):
+                            self.copy_report_with_home_button_navigation(source, dest)
+                        else:
+                            shutil.copyfileobj(source, dest, REPORT_COPY_CHUNK_SIZE)
+
+            krona_subfolder_names = sorted(match.group('subfolder_name') for match in map(KRONA_REPORT_PATTERN.match,
+                                                                                          names) if match)
+            metadata_html = self.ro_crate_asset_provider.generate_metadata_html(metadata)
+            preview_content = self.ro_crate_asset_provider.generate_preview_html(
+                srr_value, self.crates_folder_path, metadata_html, bool(krona_subfolder_names),
+                MULTIQC_REPORT_NAME in names, krona_subfolder_names, get_published_date(metadata))
+            writer.write_text('ro-crate-preview.html', preview_content)
+        except BaseException:
+            writer.discard()
+            raise
+        writer.close()
+
+    @staticmethod
+    def is_report(name):
+        return name == MULTIQC_REPORT_NAME or KRONA_REPORT_PATTERN.match(name) is not None
+
+    def copy_report_with_home_button_navigation(self, source, dest):
+        """Copy a report with the current home button in place of the one it was prepared with."""
+        head = source.read(MAX_HOME_BUTTON_PREFIX_SIZE)
+        match = HOME_BUTTON_PREFIX_PATTERN.match(head)
+        dest.write(self.ro_crate_asset_provider.home_button_navigation_prefix)
+        dest.write(head[match.end():] if match else head)
+        shutil.copyfileobj(source, dest, REPORT_COPY_CHUNK_SIZE)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Re-render the HTML of existing mOTUs crates with the current '
+                                                 'assets, without downloading their tarballs again.')
+    parser.add_argument('crates_folder', type=str, help='Folder of motus_<SRR>.zip crates, which are replaced.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of crates to re-render concurrently, each '
+                                                               'in its own worker process.')
+    parser.add_argument('--minify_assets', action='store_true', help='Strip indentation, blank lines and comments '
+                                                                     'from the CSS, JS and SVG in each crate.')
+    parser.add_argument('--zip_compression_level', type=int, default=6, help='Deflate level (0-9) of the '
+                                                                              'rewritten zips.')
+    args = parser.parse_args()
+    MotusCrateRerenderer(args.crates_folder, args.workers, args.minify_assets,
+                         args.zip_compression_level).rerender_crates()
@@ -1,64 +1,240 @@
 import argparse
+import cProfile
 import datetime
 import glob
+import hashlib
+import io
 import json
 import logging
 import os
-from urllib.parse import urljoin
+from pathlib import Path
+import sys
 from uuid import uuid4
 
 import requests
 import shutil
 import tarfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+
+if __name__ == '__main__' and not __package__:
+    # Run as a script, so the scripts folder holding the shared mgnify_crates package is found from this file
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from archive_cache import ArchiveCache  # noqa: E402
+from crate_manifest import CrateManifest  # noqa: E402
+from directory_listing_crawler import DirectoryListingCrawler
 from ro_crate_ui_assets_provider import RoCrateUIAssetsProvider
+from ro_crate_writers import FolderRoCrateWriter, ZipRoCrateWriter
+from stage_metrics import StageMetricsRecorder, log_stage_metrics_summary, write_stage_metrics_report
+from tarball_downloader import DEFAULT_CHUNK_SIZE, DownloadResult, HashingStream, TarballDownloader
 from tqdm import tqdm
-from bs4 import BeautifulSoup
 from arcp import arcp_location
 
 
+@dataclass
+class CratePreparationResult:
+    source: str
+    srr_value: str
+    status: str
+    error: str = None
+    stage_metrics: list = field(default_factory=list)
+
+    @property
+    def succeeded(self):
+        return self.status == 'succeeded'
+
+
+REPORT_COPY_CHUNK_SIZE = 1024 * 1024
+
+# Preparer used by a pool worker process, set once per worker by init_worker
+_worker_preparer = None
+
+
+def init_worker(preparer):
+    global _worker_preparer
+    _worker_preparer = preparer
+    preparer.setup_logging()
+
+
+def prepare_ro_crate_in_worker(source):
+    return _worker_preparer.prepare_single_ro_crate(source)
+
+
 class MotusRoCratesPreparer:
-    def __init__(self, original_ro_crate_path, destination_folder_path, extract_multiple=False):
+    def __init__(self, original_ro_crate_path, destination_folder_path, extract_multiple=False, workers=1,
+                 manifest_path=None, stream_archive=False, crawl_concurrency=16, listing_cache_dir=None,
+                 direct_zip=False, zip_compression_level=6, minify_assets=False, metrics_report_path=None,
+                 profile_dir=None, download_segments=1, download_chunk_size=DEFAULT_CHUNK_SIZE, verify_md5=True,
+                 archive_cache_dir=None, archive_cache_max_size=None):
         self.extract_multiple = extract_multiple
+        self.stream_archive = stream_archive
+        self.direct_zip = direct_zip
+        self.zip_compression_level = zip_compression_level
+        self.workers = max(1, workers)
+        self.manifest = CrateManifest(manifest_path) if manifest_path else None
+        self.metrics_report_path = metrics_report_path
+        self.stage_metrics = StageMetricsRecorder() if metrics_report_path else None
+        self.profile_dir = profile_dir
+        # Interleaved tqdm bars from several workers are unreadable, so only the batch bar is shown then
+        self.show_progress = self.workers == 1
         self.original_ro_crate_zip_url = None if extract_multiple else original_ro_crate_path
         self.list_of_links_to_return = []
+        self.directory_listing_crawler = DirectoryListingCrawler(crawl_concurrency, listing_cache_dir)
+        self.downloader = TarballDownloader(download_chunk_size, download_segments, verify_md5=verify_md5)
+        self.archive_cache = ArchiveCache(archive_cache_dir, archive_cache_max_size) if archive_cache_dir else None
         self.original_ro_crate_path = original_ro_crate_path
         self.destination_folder_path = destination_folder_path
         self.srr_value = None
         self.downloaded_ro_crate_zip_temp_dir = None
         self.downloaded_ro_crate_zip_file_path = None
+        self.remote_file_info = {}
+        # md5s of downloaded tarballs by (path, size, mtime), so that each is hashed at most once per run
+        self.downloaded_file_md5s = {}
         self.multiqc_path = None
         self.krona_files = None
+        # Only set when streaming: archive-relative paths of every file, and the content of the reports we need
+        self.archive_member_names = None
+        self.streamed_archive_members = {}
         self.ro_crate_output_folder_name = None
+        self.ro_crate_writer = None
         self.raw_ro_crate_metadata = None
         self.ro_crate_metadata_html = None
-        self.ro_crate_asset_provider = RoCrateUIAssetsProvider()
+        # Loaded here, once, so that pool workers inherit the assets rather than reading them again
+        self.ro_crate_asset_provider = RoCrateUIAssetsProvider(minify_assets)
 
     def prepare_motus_ro_crate(self):
         logging.info("Starting the script.")
+        self.setup_logging()
+
+        if not self.extract_multiple:
+            try:
+                status = self.run_profiled_ro_crate_stages(self.original_ro_crate_path)
+            except Exception as e:
+                logging.error(str(e))
+                raise
+            finally:
+                self.remove_empty_temp_root()
+                self.report_stage_metrics(self.pop_stage_metrics())
+            return [CratePreparationResult(self.original_ro_crate_path, self.srr_value, status)]
+
+        # Runs are prepared as the crawler finds them, rather than after the whole tree has been listed
+        sources = self.iter_ro_crate_sources()
+        if self.workers > 1:
+            results = self.prepare_ro_crates_in_parallel(sources)
+        else:
+            results = [self.prepare_single_ro_crate(source) for source in sources]
+        self.remove_empty_temp_root()
+        if self.manifest:
+            self.manifest.compact()
+        self.log_results_summary(results)
+        self.report_stage_metrics([metrics for result in results for metrics in result.stage_metrics])
+        return results
+
+    def prepare_ro_crates_in_parallel(self, sources):
+        results = []
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=(self,)) as executor:
+            # The first submission forks every worker: do it before the crawler thread starts,
+            # as forking a process while another thread is running is unsafe
+            executor.submit(os.getpid).result()
+            futures = [executor.submit(prepare_ro_crate_in_worker, source) for source in sources]
+            with tqdm(total=len(futures), desc="Preparing RO crates") as pbar:
+                for future in as_completed(futures):
+                    results.append(future.result())
+                    pbar.update(1)
+        return results
 
+    def prepare_single_ro_crate(self, source):
+        """
+        Run every stage for one source tarball, reporting failure as a result instead of raising,
+        so that one bad run does not abort the rest of the batch.
+        """
         try:
-            self.setup_logging()
-            self.extract_files_from_subdirectories(self.original_ro_crate_path)
-            for source in self.list_of_links_to_return:
-                self.original_ro_crate_zip_url = source
-                self.create_ro_crate_temp_dir()
-                self.get_srr_value()
-                self.download_ro_crate_zip_file()
-                self.extract_downloaded_ro_crate_zip_file()
+            status = self.run_profiled_ro_crate_stages(source)
+        except Exception as e:
+            logging.error(f"Failed to prepare RO crate from {source}: {e}")
+            return CratePreparationResult(source, self.srr_value, 'failed', str(e), self.pop_stage_metrics())
+        logging.info(f"Prepared RO crate for {self.srr_value}" if status == 'succeeded'
+                     else f"RO crate for {self.srr_value} is up to date, skipped")
+        return CratePreparationResult(source, self.srr_value, status, stage_metrics=self.pop_stage_metrics())
+
+    def run_profiled_ro_crate_stages(self, source):
+        """Run the stages for a source, dumping a cProfile of them to {profile_dir}/{SRR}.prof if profiling."""
+        if not self.profile_dir:
+            return self.run_ro_crate_stages(source)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return self.run_ro_crate_stages(source)
+        finally:
+            profile.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            run_name = self.srr_value or os.path.basename(source).split('.')[0]
+            profile.dump_stats(os.path.join(self.profile_dir, f"{run_name}.prof"))
+
+    def run_ro_crate_stages(self, source):
+        self.original_ro_crate_zip_url = source
+        self.get_srr_value()
+        with self.measure_stage('check'):
+            self.fetch_remote_file_info()
+            if self.is_ro_crate_up_to_date():
+                return 'skipped'
+        self.create_ro_crate_temp_dir()
+        if self.stream_archive:
+            with self.measure_stage('stream'):
+                self.stream_ro_crate_archive()
+        else:
+            if not self.has_completed_stage(CrateManifest.DOWNLOADED):
+                with self.measure_stage('download'):
+                    self.download_ro_crate_zip_file()
+            if not self.has_completed_stage(CrateManifest.EXTRACTED):
+                with self.measure_stage('extract'):
+                    self.extract_downloaded_ro_crate_zip_file()
+            with self.measure_stage('find'):
                 self.find_multiqc_report()
                 self.find_krona_files()
-                self.create_ro_crate_output_folder()
-                self.copy_files_to_ro_crate_output_folder()
+        self.create_ro_crate_output_folder()
+        try:
+            with self.measure_stage('inject'):
                 self.add_home_button_navigation_to_multiqc_report()
                 self.add_home_button_navigation_to_krona_files()
+            with self.measure_stage('metadata'):
                 self.create_ro_crate_metadata()
                 self.create_html_from_ro_crate_metadata()
+            with self.measure_stage('preview'):
                 self.create_ro_crate_preview_html()
+            with self.measure_stage('zip'):
                 self.zip_ro_crate_output_folder()
-                self.clean_up()
-        except Exception as e:
-            logging.error(str(e))
+        except BaseException:
+            self.discard_ro_crate_output()
             raise
+        with self.measure_stage('cleanup'):
+            self.clean_up()
+        return 'succeeded'
+
+    def measure_stage(self, stage):
+        if not self.stage_metrics:
+            return nullcontext()
+        return self.stage_metrics.measure(self.srr_value, stage)
+
+    def pop_stage_metrics(self):
+        return self.stage_metrics.pop_records() if self.stage_metrics else []
+
+    def report_stage_metrics(self, stage_metrics):
+        if not self.metrics_report_path:
+            return
+        write_stage_metrics_report(stage_metrics, self.metrics_report_path)
+        log_stage_metrics_summary(stage_metrics)
+        logging.info(f"Stage metrics written to {self.metrics_report_path}")
+
+    @staticmethod
+    def log_results_summary(results):
+        failed = [result for result in results if result.status == 'failed']
+        skipped = [result for result in results if result.status == 'skipped']
+        logging.info(f"Prepared {len(results) - len(failed) - len(skipped)} of {len(results)} RO crates "
+                     f"({len(skipped)} up to date).")
+        for result in failed:
+            logging.error(f"{result.srr_value or result.source}: {result.error}")
 
     @staticmethod
     def setup_logging():
@@ -68,8 +244,15 @@ class MotusRoCratesPreparer:
             datefmt='%Y-%m-%d %H:%M:%S',
         )
 
+    def get_temp_root_path(self):
+        return f"{self.destination_folder_path}_temp"
+
     def create_ro_crate_temp_dir(self):
-        self.downloaded_ro_crate_zip_temp_dir = f"{self.destination_folder_path}_temp"
+        self.downloaded_ro_crate_zip_file_path = None
+        self.archive_member_names = None
+        self.streamed_archive_members = {}
+        # Each run gets its own workspace so that runs can be prepared concurrently
+        self.downloaded_ro_crate_zip_temp_dir = os.path.join(self.get_temp_root_path(), self.srr_value)
         os.makedirs(self.downloaded_ro_crate_zip_temp_dir, exist_ok=True)
 
     def get_srr_value(self):
@@ -79,32 +262,256 @@ class MotusRoCratesPreparer:
     def get_srr_folder_path(self):
         return os.path.join(self.downloaded_ro_crate_zip_temp_dir, self.srr_value)
 
-    def download_ro_crate_zip_file(self):
-        try:
-            response = requests.get(self.original_ro_crate_zip_url, stream=True)
-            response.raise_for_status()  # Raises an HTTPError if the response status is not OK (200)
+    def get_ro_crate_zip_path(self):
+        return os.path.join(self.destination_folder_path, f"motus_{self.srr_value}.zip")
+
+    def get_downloaded_file_path(self):
+        return os.path.join(self.downloaded_ro_crate_zip_temp_dir, os.path.basename(self.original_ro_crate_zip_url))
+
+    @staticmethod
+    def get_validators_from_headers(headers):
+        content_length = headers.get('content-length')
+        return {
+            'etag': headers.get('etag'),
+            'content_length': int(content_length) if content_length is not None else None,
+        }
 
-            zip_file_path = os.path.join(self.downloaded_ro_crate_zip_temp_dir,
-                                         os.path.basename(self.original_ro_crate_zip_url))
-            total_size = int(response.headers.get('content-length', 0))
+    def fetch_remote_file_info(self):
+        self.remote_file_info = {}
+        if not self.manifest:
+            return
+        try:
+            self.remote_file_info = self.get_validators_from_headers(
+                self.downloader.head(self.original_ro_crate_zip_url))
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"Could not check {self.original_ro_crate_zip_url} for changes: {e}")
+
+    def is_ro_crate_up_to_date(self):
+        if not self.manifest:
+            return False
+        entry = self.manifest.get(self.original_ro_crate_zip_url)
+        zip_path = self.get_ro_crate_zip_path()
+        return (entry.get('stage') == CrateManifest.ZIPPED
+                and CrateManifest.validators_match(entry, self.remote_file_info)
+                and os.path.isfile(zip_path)
+                and os.path.getsize(zip_path) == entry.get('zip_size'))
+
+    def has_completed_stage(self, stage):
+        """
+        True if a previous, interrupted run of this source already got through `stage` and left
+        a usable workspace behind, so that the stage can be skipped.
+        """
+        if not self.manifest:
+            return False
+        entry = self.manifest.get(self.original_ro_crate_zip_url)
+        stages = (CrateManifest.DOWNLOADED, CrateManifest.EXTRACTED)
+        if entry.get('stage') not in stages or stages.index(entry['stage']) < stages.index(stage):
+            return False
+        if not CrateManifest.validators_match(entry, self.remote_file_info):
+            return False
+
+        downloaded_file_path = self.get_downloaded_file_path()
+        if not os.path.isfile(downloaded_file_path) or self.get_downloaded_file_md5(entry) != entry.get('md5'):
+            return False
+        self.downloaded_ro_crate_zip_file_path = downloaded_file_path
+        if stage == CrateManifest.EXTRACTED:
+            return os.path.isdir(self.get_srr_folder_path())
+        return True
+
+    def record_stage(self, stage, **fields):
+        if self.manifest:
+            self.manifest.record(self.original_ro_crate_zip_url, stage=stage, srr_value=self.srr_value, **fields)
+
+    def get_downloaded_file_md5(self, entry):
+        """
+        The md5 of the downloaded tarball, without reading it if it has the size and mtime recorded when it was
+        downloaded, or if it was already hashed at the same size and mtime in this run.
+        """
+        downloaded_file_path = self.get_downloaded_file_path()
+        stat = os.stat(downloaded_file_path)
+        if entry.get('content_length') is not None and stat.st_size != entry['content_length']:
+            return None
+        if stat.st_size == entry.get('content_length') and stat.st_mtime_ns == entry.get('downloaded_mtime_ns'):
+            return entry.get('md5')
+        key = (downloaded_file_path, stat.st_size, stat.st_mtime_ns)
+        if key not in self.downloaded_file_md5s:
+            self.downloaded_file_md5s[key] = self.md5_of_file(downloaded_file_path)
+        return self.downloaded_file_md5s[key]
 
-            with open(zip_file_path, 'wb') as f, tqdm(total=total_size, unit='B', unit_scale=True,
-                                                      desc="Downloading") as pbar:
-                for data in response.iter_content(chunk_size=8192):
-                    f.write(data)
-                    pbar.update(len(data))
+    @staticmethod
+    def md5_of_file(path):
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                md5.update(chunk)
+        return md5.hexdigest()
 
-            self.downloaded_ro_crate_zip_file_path = zip_file_path
+    def download_ro_crate_zip_file(self):
+        zip_file_path = self.get_downloaded_file_path()
+        try:
+            expected_md5 = self.downloader.fetch_expected_md5(self.original_ro_crate_zip_url)
+            cache_key = self.get_archive_cache_key(expected_md5)
+            if cache_key:
+                download = self.download_through_archive_cache(cache_key, expected_md5, zip_file_path)
+            else:
+                with tqdm(unit='B', unit_scale=True, desc="Downloading", disable=not self.show_progress) as pbar:
+                    download = self.downloader.download(self.original_ro_crate_zip_url, zip_file_path, pbar,
+                                                        expected_md5)
         except requests.exceptions.RequestException as e:
             raise ValueError(f"Failed to download the zip file from {self.original_ro_crate_zip_url}: {e}")
 
+        self.downloaded_ro_crate_zip_file_path = zip_file_path
+        self.record_stage(CrateManifest.DOWNLOADED, md5=download.md5, etag=download.etag,
+                          content_length=download.size, downloaded_mtime_ns=os.stat(zip_file_path).st_mtime_ns)
+
+    def get_archive_cache_key(self, expected_md5):
+        """
+        The archive cache key of the tarball, from its URL and its MD5, or if it has no .md5 file its ETag, or its
+        last modified time and size. None if there is no archive cache, or none of those are known.
+        """
+        if not self.archive_cache:
+            return None
+        if expected_md5:
+            return self.archive_cache.get_key(self.original_ro_crate_zip_url, f"md5:{expected_md5}")
+        headers = self.downloader.head(self.original_ro_crate_zip_url)
+        if headers.get('etag'):
+            return self.archive_cache.get_key(self.original_ro_crate_zip_url, f"etag:{headers['etag']}")
+        if headers.get('last-modified') and headers.get('content-length'):
+            return self.archive_cache.get_key(self.original_ro_crate_zip_url,
+                                              f"modified:{headers['last-modified']}:{headers['content-length']}")
+        logging.warning(f"Cannot tell which version of {self.original_ro_crate_zip_url} the server has, "
+                        f"so it is not cached")
+        return None
+
+    def download_through_archive_cache(self, cache_key, expected_md5, zip_file_path):
+        with self.archive_cache.lock(cache_key):
+            info = self.archive_cache.get(cache_key)
+            if info is None:
+                with tqdm(unit='B', unit_scale=True, desc="Downloading", disable=not self.show_progress) as pbar:
+                    download = self.downloader.download(self.original_ro_crate_zip_url,
+                                                        self.archive_cache.get_path(cache_key), pbar, expected_md5)
+                info = self.archive_cache.put(cache_key, url=self.original_ro_crate_zip_url, md5=download.md5,
+                                              etag=download.etag, size=download.size)
+            else:
+                logging.info(f"Using the cached download of {self.original_ro_crate_zip_url}")
+            self.archive_cache.link(cache_key, zip_file_path)
+        self.archive_cache.evict()
+        return DownloadResult(zip_file_path, info['size'], info['md5'], info['etag'])
+
     def extract_downloaded_ro_crate_zip_file(self):
         with tarfile.open(self.downloaded_ro_crate_zip_file_path, 'r:gz') as tar:
             members = tar.getmembers()
-            with tqdm(total=len(members), desc="Extracting files") as pbar:  # Add tqdm here
+            with tqdm(total=len(members), desc="Extracting files", disable=not self.show_progress) as pbar:  # Add tqdm here
                 for member in members:
                     tar.extract(member, path=self.downloaded_ro_crate_zip_temp_dir)
                     pbar.update(1)
+        self.record_stage(CrateManifest.EXTRACTED)
+
+    def stream_ro_crate_archive(self):
+        """
+        Read the tarball once, front to back, without extracting it: collect the names of its files for the
+        metadata and keep only the reports that are copied into the crate in memory.
+        Reads the download of an interrupted earlier run if one is available, else the archive cache's copy if there
+        is one, or the HTTP response otherwise.
+        """
+        if self.has_completed_stage(CrateManifest.DOWNLOADED):
+            with open(self.downloaded_ro_crate_zip_file_path, 'rb') as f:
+                self.read_archive_stream(f)
+            return
+
+        try:
+            expected_md5 = self.downloader.fetch_expected_md5(self.original_ro_crate_zip_url)
+            cache_key = self.get_archive_cache_key(expected_md5)
+            if cache_key:
+                download = self.stream_through_archive_cache(cache_key, expected_md5)
+            else:
+                download = self.stream_remote_archive(expected_md5)
+            self.remote_file_info = {'etag': download.etag, 'content_length': download.size}
+        except requests.exceptions.RequestException as e:
+            raise ValueError(f"Failed to download the zip file from {self.original_ro_crate_zip_url}: {e}")
+
+    def stream_remote_archive(self, expected_md5, sink=None):
+        stream = HashingStream(self.downloader, self.original_ro_crate_zip_url, sink)
+        try:
+            self.read_archive_stream(stream)
+            stream.read_to_end()
+        finally:
+            stream.close()
+        md5 = stream.md5.hexdigest()
+        self.downloader.check_md5(self.original_ro_crate_zip_url, md5, expected_md5)
+        return DownloadResult(None, stream.position, md5, stream.etag)
+
+    def stream_through_archive_cache(self, cache_key, expected_md5):
+        """Stream the cached tarball, or stream the remote one while writing it into the cache."""
+        cache_path = self.archive_cache.get_path(cache_key)
+        with self.archive_cache.lock(cache_key):
+            info = self.archive_cache.get(cache_key)
+            if info is not None:
+                logging.info(f"Using the cached download of {self.original_ro_crate_zip_url}")
+                with open(cache_path, 'rb') as f:
+                    self.read_archive_stream(f)
+            else:
+                try:
+                    with open(f"{cache_path}.part", 'wb') as sink:
+                        download = self.stream_remote_archive(expected_md5, sink)
+                except BaseException:
+                    os.remove(f"{cache_path}.part")
+                    raise
+                os.replace(f"{cache_path}.part", cache_path)
+                info = self.archive_cache.put(cache_key, url=self.original_ro_crate_zip_url, md5=download.md5,
+                                              etag=download.etag, size=download.size)
+        self.archive_cache.evict()
+        return DownloadResult(cache_path, info['size'], info['md5'], info['etag'])
+
+    def read_archive_stream(self, fileobj):
+        self.archive_member_names = []
+        self.multiqc_path = []
+        self.krona_files = []
+        multiqc_member_name = os.path.join(self.srr_value, 'qc', 'multiqc', 'multiqc_report.html')
+
+        with tarfile.open(fileobj=fileobj, mode='r|gz') as tar, \
+                tqdm(desc="Streaming archive", unit=' files', disable=not self.show_progress) as pbar:
+            for member in tar:
+                pbar.update(1)
+                if not member.isfile():
+                    continue
+                member_name = os.path.normpath(member.name)
+                self.archive_member_names.append(member_name)
+
+                parts = member_name.split(os.sep)
+                is_krona_file = (len(parts) == 4 and parts[0] == self.srr_value and parts[1] == 'taxonomy'
+                                 and parts[3] == 'krona.html' and not parts[2].startswith('.'))
+                if member_name != multiqc_member_name and not is_krona_file:
+                    continue
+
+                # Paths as they would be if extracted, so that later stages are agnostic of streaming
+                member_path = os.path.join(self.downloaded_ro_crate_zip_temp_dir, member_name)
+                self.streamed_archive_members[member_path] = tar.extractfile(member).read()
+                if is_krona_file:
+                    self.krona_files.append(member_path)
+                else:
+                    self.multiqc_path.append(member_path)
+
+    def open_archive_member(self, path):
+        if path in self.streamed_archive_members:
+            return io.BytesIO(self.streamed_archive_members[path])
+        return open(path, 'rb')
+
+    def list_archive_files(self):
+        """
+        Paths, relative to the run workspace, of every file in the run's workspace (or archive, when streaming).
+        """
+        if self.archive_member_names is not None:
+            files = list(self.archive_member_names)
+            if self.downloaded_ro_crate_zip_file_path:
+                files.append(os.path.basename(self.downloaded_ro_crate_zip_file_path))
+            return files
+
+        files = []
+        for root, _, filenames in os.walk(self.downloaded_ro_crate_zip_temp_dir):
+            for filename in filenames:
+                files.append(os.path.relpath(os.path.join(root, filename), self.downloaded_ro_crate_zip_temp_dir))
+        return files
 
     def find_multiqc_report(self):
         srr_folder_path = self.get_srr_folder_path()
@@ -117,49 +524,34 @@ class MotusRoCratesPreparer:
 
     def create_ro_crate_output_folder(self):
         self.ro_crate_output_folder_name = os.path.join(self.destination_folder_path, f"motus_{self.srr_value}")
-        os.makedirs(self.ro_crate_output_folder_name, exist_ok=True)
-
-    def copy_files_to_ro_crate_output_folder(self):
-        with tqdm(total=len(self.krona_files) + 1, desc="Copying files") as pbar:
-            if self.multiqc_path:
-                shutil.copy2(self.multiqc_path[0], os.path.join(self.ro_crate_output_folder_name, 'multiqc_report.html'))
-                pbar.update(1)
-
-            if self.krona_files:
-                for krona_file in self.krona_files:
-                    subfolder_name = os.path.basename(os.path.dirname(krona_file))
-                    krona_dest_path = os.path.join(self.ro_crate_output_folder_name, f'krona_{subfolder_name}.html')
-                    shutil.copy2(krona_file, krona_dest_path)
-                    pbar.update(1)
+        if self.direct_zip:
+            # Every file goes straight into the zip, so no staging folder is created
+            self.ro_crate_writer = ZipRoCrateWriter(self.get_ro_crate_zip_path(), self.zip_compression_level)
+        else:
+            self.ro_crate_writer = FolderRoCrateWriter(self.ro_crate_output_folder_name)
+
+    def write_report_with_home_button_navigation(self, report_path, crate_file_name):
+        """
+        Copy a report into the crate with the home button prepended, reading and writing it once in fixed-size chunks.
+        """
+        with self.open_archive_member(report_path) as source, self.ro_crate_writer.open(crate_file_name) as dest:
+            dest.write(self.ro_crate_asset_provider.home_button_navigation_prefix)
+            shutil.copyfileobj(source, dest, REPORT_COPY_CHUNK_SIZE)
 
     def add_home_button_navigation_to_multiqc_report(self):
         if not self.multiqc_path:
             return
-        multiqc_report_path = self.multiqc_path[0]
-
-        with open(multiqc_report_path, 'r') as f:
-            multiqc_content = f.read()
-
-        updated_multiqc_content = f"{self.ro_crate_asset_provider.home_button_navigation_script}\n{self.ro_crate_asset_provider.home_button_styling}\n{multiqc_content}"
-
-        new_multiqc_report_path = os.path.join(self.ro_crate_output_folder_name, 'multiqc_report.html')
-        with open(new_multiqc_report_path, 'w') as f:
-            f.write(updated_multiqc_content)
+        self.write_report_with_home_button_navigation(self.multiqc_path[0], 'multiqc_report.html')
 
     def add_home_button_navigation_to_krona_files(self):
         if not self.krona_files:
             return
         for krona_file in self.krona_files:
             subfolder_name = os.path.basename(os.path.dirname(krona_file))
-            krona_dest_path = os.path.join(self.ro_crate_output_folder_name, f'krona_{subfolder_name}.html')
-
-            with open(krona_file, 'r') as f:
-                krona_content = f.read()
+            self.write_report_with_home_button_navigation(krona_file, f'krona_{subfolder_name}.html')
 
-            updated_krona_content = f"{self.ro_crate_asset_provider.home_button_navigation_script}\n{self.ro_crate_asset_provider.home_button_styling}\n{krona_content}"
-
-            with open(krona_dest_path, 'w') as f:
-                f.write(updated_krona_content)
+    def get_krona_subfolder_names(self):
+        return sorted(os.path.basename(os.path.dirname(krona_file)) for krona_file in self.krona_files or [])
 
     def create_ro_crate_preview_html(self):
         include_krona_files = bool(self.krona_files)
@@ -168,10 +560,9 @@ class MotusRoCratesPreparer:
                                                                              self.downloaded_ro_crate_zip_temp_dir,
                                                                              self.ro_crate_metadata_html,
                                                                              include_krona_files,
-                                                                             include_multiqc_report)
-        preview_html_path = os.path.join(self.ro_crate_output_folder_name, 'ro-crate-preview.html')
-        with open(preview_html_path, 'w') as f:
-            f.write(preview_content)
+                                                                             include_multiqc_report,
+                                                                             self.get_krona_subfolder_names())
+        self.ro_crate_writer.write_text('ro-crate-preview.html', preview_content)
 
     def create_ro_crate_metadata(self):
         metadata = {
@@ -281,59 +672,50 @@ class MotusRoCratesPreparer:
             "hasPart": [],
         }
 
-        with tqdm(total=len(os.listdir(self.downloaded_ro_crate_zip_temp_dir)), desc="Creating metadata") as pbar:
-            for root, _, files in os.walk(self.downloaded_ro_crate_zip_temp_dir):
-                files = [filename for filename in files if not filename.endswith('.DS_Store')]
-
-                for filename in files:
-                    file_metadata = {
-                        "@id": parent_arcp + os.path.relpath(os.path.join(root, filename),
-                                                             self.downloaded_ro_crate_zip_temp_dir),
-                        "@type": "Dataset",
-                        "name": filename,
-                    }
-                    directory_metadata["hasPart"].append(file_metadata)
-                pbar.update(1)
-            metadata["@graph"].append(directory_metadata)
+        archive_files = [path for path in self.list_archive_files() if not path.endswith('.DS_Store')]
+        for relative_path in tqdm(archive_files, desc="Creating metadata", disable=not self.show_progress):
+            file_metadata = {
+                "@id": parent_arcp + relative_path,
+                "@type": "Dataset",
+                "name": os.path.basename(relative_path),
+            }
+            directory_metadata["hasPart"].append(file_metadata)
+        metadata["@graph"].append(directory_metadata)
 
-        ro_crate_metadata_path = os.path.join(self.ro_crate_output_folder_name, 'ro-crate-metadata.json')
         self.raw_ro_crate_metadata = metadata
-        with open(ro_crate_metadata_path, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        self.ro_crate_writer.write_text('ro-crate-metadata.json', json.dumps(metadata, indent=2))
 
     def create_html_from_ro_crate_metadata(self):
         self.ro_crate_metadata_html = self.ro_crate_asset_provider.generate_metadata_html(self.raw_ro_crate_metadata)
 
     def zip_ro_crate_output_folder(self):
-        shutil.make_archive(self.ro_crate_output_folder_name, 'zip', self.ro_crate_output_folder_name)
+        self.ro_crate_writer.close()
+        validators = {key: value for key, value in self.remote_file_info.items() if value is not None}
+        self.record_stage(CrateManifest.ZIPPED, zip_size=os.path.getsize(self.get_ro_crate_zip_path()), **validators)
+
+    def discard_ro_crate_output(self):
+        """Drop a crate that failed part way, so that no partial zip is left in the destination folder."""
+        if self.direct_zip:
+            self.ro_crate_writer.discard()
 
     def clean_up(self):
         shutil.rmtree(self.downloaded_ro_crate_zip_temp_dir)
 
-    def extract_files_from_subdirectories(self, url):
+    def remove_empty_temp_root(self):
+        try:
+            os.rmdir(self.get_temp_root_path())
+        except OSError:
+            # Missing, or still holding the workspaces of failed runs
+            pass
+
+    def iter_ro_crate_sources(self):
         if not self.extract_multiple:
-            self.list_of_links_to_return.append(url)
+            self.list_of_links_to_return.append(self.original_ro_crate_path)
+            yield self.original_ro_crate_path
             return
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f"Failed to fetch {url}")
-            return
-        soup = BeautifulSoup(response.text, 'html.parser')
-        links = soup.find_all('a')
-
-        links = links[5:]
-        for link in links:
-            href = link.get('href')
-            if href.endswith('.md5'):
-                continue
-            if href == '../' or not href.endswith('/'):
-                href = urljoin(url, href)
-                if not href.endswith('.tar.gz'):
-                    continue
-                self.list_of_links_to_return.append(href)
-                continue
-            subdir_url = urljoin(url, href)
-            self.extract_files_from_subdirectories(subdir_url)
+        for tarball_url in self.directory_listing_crawler.iter_tarball_urls(self.original_ro_crate_path):
+            self.list_of_links_to_return.append(tarball_url)
+            yield tarball_url
 
 
 if __name__ == "__main__":
@@ -342,6 +724,48 @@ if __name__ == "__main__":
     parser.add_argument('destination_folder', type=str, help='Destination folder path.')
     parser.add_argument('--extract_multiple', action='store_true', help='Prepare multiple RO crates from a list of '
                                                                         'directories.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of runs to prepare concurrently, each in its '
+                                                               'own worker process (with --extract_multiple).')
+    parser.add_argument('--stream_archive', action='store_true', help='Read each tarball once as a stream, keeping '
+                                                                      'only the needed reports, instead of downloading '
+                                                                      'and extracting it to disk.')
+    parser.add_argument('--crawl_concurrency', type=int, default=16, help='Maximum number of directory listings '
+                                                                          'fetched at once (with --extract_multiple).')
+    parser.add_argument('--listing_cache_dir', type=str, default=None, help='Directory to cache fetched directory '
+                                                                            'listings in, keyed by URL.')
+    parser.add_argument('--direct_zip', action='store_true', help='Write each crate straight into its zip, without '
+                                                                  'a staging folder.')
+    parser.add_argument('--zip_compression_level', type=int, default=6, help='Deflate level (0-9) used for HTML and '
+                                                                              'JSON files with --direct_zip.')
+    parser.add_argument('--manifest', type=str, default=None, help='JSON-lines manifest file recording the progress '
+                                                                   'of each run, used to skip up to date crates and '
+                                                                   'resume interrupted ones.')
+    parser.add_argument('--minify_assets', action='store_true', help='Strip indentation, blank lines and comments '
+                                                                     'from the CSS, JS and SVG in each crate.')
+    parser.add_argument('--metrics_report', type=str, default=None, help='File to write the wall/CPU time, I/O and '
+                                                                         'peak RSS of each stage of each run to, as '
+                                                                         'CSV if it ends in .csv, else JSON lines.')
+    parser.add_argument('--profile_dir', type=str, default=None, help='Directory to write a cProfile dump of each '
+                                                                      'run to, as <SRR>.prof.')
+    parser.add_argument('--download_segments', type=int, default=1, help='Number of connections to download each '
+                                                                         'large tarball over at once.')
+    parser.add_argument('--download_chunk_size', type=int, default=DEFAULT_CHUNK_SIZE, help='Size in bytes of the '
+                                                                                            'chunks tarballs are '
+                                                                                            'downloaded in.')
+    parser.add_argument('--skip_md5_check', action='store_true', help='Do not check downloaded tarballs against '
+                                                                      'the .md5 files beside them.')
+    parser.add_argument('--archive_cache_dir', type=str, default=None, help='Directory, possibly shared between '
+                                                                            'hosts, to keep downloaded tarballs in '
+                                                                            'and reuse them from.')
+    parser.add_argument('--archive_cache_max_gb', type=float, default=None, help='Size the archive cache is kept '
+                                                                                 'under, by evicting the least '
+                                                                                 'recently used tarballs.')
     args = parser.parse_args()
-    preparer = MotusRoCratesPreparer(args.original_crate_zip_url, args.destination_folder, args.extract_multiple)
+    preparer = MotusRoCratesPreparer(args.original_crate_zip_url, args.destination_folder, args.extract_multiple,
+                                     args.workers, args.manifest, args.stream_archive, args.crawl_concurrency,
+                                     args.listing_cache_dir, args.direct_zip, args.zip_compression_level,
+                                     args.minify_assets, args.metrics_report, args.profile_dir,
+                                     args.download_segments, args.download_chunk_size, not args.skip_md5_check,
+                                     args.archive_cache_dir,
+                                     args.archive_cache_max_gb * 1024 ** 3 if args.archive_cache_max_gb else None)
     preparer.prepare_motus_ro_crate()
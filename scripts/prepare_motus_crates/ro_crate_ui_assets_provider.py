@@ -1,130 +1,206 @@
 import os
 import datetime
+import functools
+import html
+import re
+
+# Assets are found relative to this module, so the preparer can be run from any directory
+ASSETS_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PREVIEW_HTML_TEMPLATE = (
+    "<!DOCTYPE html>\n"
+    "<html>\n"
+    "<head>\n"
+    "    <title>mOTUs details for run {srr_value}</title>\n"
+    "    <meta name=\"keywords\" content=\"RO Crate\">\n"
+    "    {preview_html_styling}\n"
+    "</head>\n"
+    "<body>\n"
+    "<div class=\"main\">\n"
+    "    {mgnify_logo}\n"
+    "    <h1>mOTUs details for run {srr_value}</h1>\n"
+    "    <p>Description</p>\n"
+    "    <dl>\n"
+    "        <dt>Creator</dt>\n"
+    "        <dd>EMBL-EBI</dd>\n"
+    "        <dt>Date published</dt>\n"
+    "        <dd>{published_date}</dd>\n"
+    "    </dl>\n"
+    "    <h2>Contents</h2>\n"
+    "    <div id=\"contents\">\n"
+    "        <div class=\"data-entity\">\n"
+    "            <ul>\n"
+    "{contents}"
+    "            </ul>\n"
+    "        </div>\n"
+    "    </div>\n"
+    "    <div id=\"variables\">\n"
+    "        {metadata_html}\n"
+    "    </div>\n"
+    "</div>\n"
+    "{ro_crate_preview_script}\n"
+    "</body>\n"
+    "</html>"
+)
+MULTIQC_REPORT_LIST_ELEMENT = (
+    "                <li><a href=\"multiqc_report.html\" id=\"multiqc_report.html\">multiqc_report.html</a></li>\n"
+)
+KRONA_FILE_LIST_ELEMENT_TEMPLATE = '<li><a href="{file_name}" id="{file_name}">{file_name}</a></li>'
+
+METADATA_ENTRY_START_TEMPLATE = (
+    '  <a id="{id_attribute}" />\n'
+    '  <div class="context-entity" id="">\n'
+    '    <strong>{type}</strong>\n\n'
+    '    <a class="data-entity-link" href="{id_attribute}">{id}</a>\n\n'
+    '    <p>\n'
+    '      <dl>\n'
+    '        <dt>name</dt>\n        <dd>{name}</dd>\n'
+    '        <dt>datePublished</dt>\n        <dd>{date_published}</dd>\n'
+    '      </dl>\n'
+)
+METADATA_ENTRY_END = (
+    '    </p>\n'
+    '  </div>\n'
+)
+
+
+# Most IDs and names need no escaping, and checking for that first is much cheaper than escaping them
+NEEDS_TEXT_ESCAPING = re.compile(r'[&<>]').search
+NEEDS_ATTRIBUTE_ESCAPING = re.compile(r'[&<>"\']').search
+
+
+def escape_text(value):
+    value = str(value)
+    return html.escape(value, quote=False) if NEEDS_TEXT_ESCAPING(value) else value
+
+
+def escape_attribute(value):
+    value = str(value)
+    return html.escape(value, quote=True) if NEEDS_ATTRIBUTE_ESCAPING(value) else value
+
+
+def escape_all_text(values):
+    """Escape a list of values, checking them all at once first as typically none need escaping."""
+    values = [str(value) for value in values]
+    if NEEDS_TEXT_ESCAPING('\0'.join(values)):
+        return [html.escape(value, quote=False) for value in values]
+    return values
+
+
+def minify_asset(path, content):
+    """
+    Conservatively shrink CSS, JS and SVG assets: indentation, blank lines and CSS comments are dropped,
+    but nothing that could change how a script or style is parsed.
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == '.css':
+        content = re.sub(r'/\*.*?\*/', '', content, flags=re.DOTALL)
+        content = re.sub(r'\s*([{};])\s*', r'\1', content)
+        content = re.sub(r'([:,])\s+', r'\1', content)
+    elif extension == '.js':
+        content = '\n'.join(line.strip() for line in content.splitlines()
+                            if line.strip() and not line.strip().startswith('//'))
+    elif extension == '.svg':
+        content = re.sub(r'>\s+<', '><', content)
+    return content.strip()
+
+
+@functools.lru_cache(maxsize=None)
+def load_asset(path, asset_tag=None, minify=False):
+    """
+    Read an asset, relative to this module unless absolute, optionally minified and wrapped in asset_tag.
+    Each asset is read once per process. Providers created before a pool is forked, or pickled to its workers,
+    carry the loaded assets with them, so workers do not read them again.
+    """
+    with open(os.path.join(ASSETS_BASE_DIR, path), 'r') as f:
+        content = f.read()
+    if minify:
+        content = minify_asset(path, content)
+    return f"<{asset_tag}>{content}</{asset_tag}>" if asset_tag else content
 
 
 class RoCrateUIAssetsProvider:
-    def __init__(self):
-        self.preview_html_styling = self.load_asset('assets/css/ro-crate-preview.css', 'style')
-        self.ro_crate_preview_script = self.load_asset('assets/js/ro-crate-preview.js', 'script')
-        self.home_button_navigation_script = self.load_asset('assets/js/home-button.js', 'script')
-        self.home_button_styling = self.load_asset('assets/css/home-button.css', 'style')
-        self.mgnify_logo = self.load_asset('assets/img/mgnify-logo.svg')
+    def __init__(self, minify_assets=False):
+        self.minify_assets = minify_assets
+        self.preview_html_styling = self.load_asset('assets/css/ro-crate-preview.css', 'style', minify_assets)
+        self.ro_crate_preview_script = self.load_asset('assets/js/ro-crate-preview.js', 'script', minify_assets)
+        self.home_button_navigation_script = self.load_asset('assets/js/home-button.js', 'script', minify_assets)
+        self.home_button_styling = self.load_asset('assets/css/home-button.css', 'style', minify_assets)
+        self.mgnify_logo = self.load_asset('assets/img/mgnify-logo.svg', minify=minify_assets)
+        # Prepended to the multiqc and krona reports, which are copied as bytes
+        self.home_button_navigation_prefix = (
+            f"{self.home_button_navigation_script}\n{self.home_button_styling}\n".encode()
+        )
 
     @staticmethod
-    def load_asset(path, asset_tag=None):
-        with open(path, 'r') as f:
-            content = f.read()
-            return f"<{asset_tag}>{content}</{asset_tag}>" if asset_tag else content
+    def load_asset(path, asset_tag=None, minify=False):
+        return load_asset(path, asset_tag, minify)
 
     @staticmethod
-    def generate_krona_files_list_elements(srr_folder_path):
+    def generate_krona_files_list_elements(srr_folder_path, subfolder_names=None):
+        if subfolder_names is None:
+            subfolder_names = os.listdir(os.path.join(srr_folder_path, 'taxonomy'))
         subfolder_links = [
-            (f'<li><a href="krona_{subfolder_name}.html" id="krona_{subfolder_name}.html">'
-             f'krona_{subfolder_name}.html</a></li>')
-            for subfolder_name in os.listdir(os.path.join(srr_folder_path, 'taxonomy'))
+            KRONA_FILE_LIST_ELEMENT_TEMPLATE.format(file_name=escape_attribute(f'krona_{subfolder_name}.html'))
+            for subfolder_name in subfolder_names
             if not subfolder_name.__contains__('DS_Store') and not subfolder_name.startswith('._')
         ]
         return '\n'.join(subfolder_links)
 
     def generate_preview_html(self, crate_srr_value, temp_zip_dir, metadata_html, include_krona_files=False,
-                              include_multiqc_report=False):
+                              include_multiqc_report=False, krona_subfolder_names=None, published_date=None):
         srr_folder_path = os.path.join(temp_zip_dir, crate_srr_value)
-        if include_krona_files:
-            krona_files_list = self.generate_krona_files_list_elements(srr_folder_path)
-        else:
-            krona_files_list = ''
-        published_date = datetime.datetime.now().strftime("%Y-%m-%d")
-
-        html = (
-            f"<!DOCTYPE html>\n"
-            f"<html>\n"
-            f"<head>\n"
-            f"    <title>mOTUs details for run {crate_srr_value}</title>\n"
-            f"    <meta name=\"keywords\" content=\"RO Crate\">\n"
-            f"    {self.preview_html_styling}\n"
-            f"</head>\n"
-            f"<body>\n"
-            f"<div class=\"main\">\n"
-            f"    {self.mgnify_logo}\n"
-            f"    <h1>mOTUs details for run {crate_srr_value}</h1>\n"
-            f"    <p>Description</p>\n"
-            f"    <dl>\n"
-            f"        <dt>Creator</dt>\n"
-            f"        <dd>EMBL-EBI</dd>\n"
-            f"        <dt>Date published</dt>\n"
-            f"        <dd>{published_date}</dd>\n"
-            f"    </dl>\n"
-            f"    <h2>Contents</h2>\n"
-            f"    <div id=\"contents\">\n"
-            f"        <div class=\"data-entity\">\n"
-            f"            <ul>\n"
-        )
-
+        contents = []
         if include_multiqc_report:
-            html += (
-                f"                <li><a href=\"multiqc_report.html\" id=\"multiqc_report.html\">"
-                f"multiqc_report.html</a></li>\n"
-            )
-
+            contents.append(MULTIQC_REPORT_LIST_ELEMENT)
         if include_krona_files:
-            html += f"                {krona_files_list}\n"
-
-        html += (
-            f"            </ul>\n"
-            f"        </div>\n"
-            f"    </div>\n"
-            f"    <div id=\"variables\">\n"
-            f"        {metadata_html}\n"
-            f"    </div>\n"
-            f"</div>\n"
-            f"{self.ro_crate_preview_script}\n"
-            f"</body>\n"
-            f"</html>"
+            contents.append(f"                "
+                            f"{self.generate_krona_files_list_elements(srr_folder_path, krona_subfolder_names)}\n")
+
+        return PREVIEW_HTML_TEMPLATE.format(
+            srr_value=escape_text(crate_srr_value),
+            preview_html_styling=self.preview_html_styling,
+            mgnify_logo=self.mgnify_logo,
+            published_date=escape_text(published_date or datetime.datetime.now().strftime("%Y-%m-%d")),
+            contents=''.join(contents),
+            metadata_html=metadata_html,
+            ro_crate_preview_script=self.ro_crate_preview_script,
         )
-        return html
 
     @staticmethod
     def generate_metadata_html(raw_metadata):
-        html_string = '<div id="metadata">\n'
-
+        """
+        Render the crate's @graph, and the hasPart list of each entity, with escaped values.
+        The parts are joined once at the end, so the cost is linear in the number of parts.
+        """
+        html_parts = ['<div id="metadata">\n']
         for entry in raw_metadata['@graph']:
-            entry_id = entry['@id']
-            entry_type = entry.get('@type', '')
-            entry_name = entry.get('name', '')
-            entry_date_published = entry.get('datePublished', '')
-            entry_has_part = entry.get('hasPart', [])
-
-            # Append the HTML for the current entry
-            html_string += f'  <a id="{entry_id}" />\n'
-            html_string += '  <div class="context-entity" id="">\n'
-            html_string += f'    <strong>{entry_type}</strong>\n\n'
-            html_string += f'    <a class="data-entity-link" href="{entry_id}">{entry_id}</a>\n\n'
-            html_string += '    <p>\n'
-
-            # Append key-value pairs for the current entry
-            html_string += '      <dl>\n'
-            html_string += f'        <dt>name</dt>\n        <dd>{entry_name}</dd>\n'
-            html_string += f'        <dt>datePublished</dt>\n        <dd>{entry_date_published}</dd>\n'
-            html_string += '      </dl>\n'
-
-            # Append key-value pairs for the hasPart elements of the current entry
-            for has_part_entry in entry_has_part:
-                has_part_id = has_part_entry.get('@id', '')
-                has_part_type = has_part_entry.get('@type', '')
-                has_part_name = has_part_entry.get('name', '')
-                has_part_date_published = has_part_entry.get('datePublished', '')
-
-                html_string += '      <dl>\n'
-                html_string += f'        <dt>@id</dt>\n        <dd>{has_part_id}</dd>\n'
-                html_string += f'        <dt>@type</dt>\n        <dd>{has_part_type}</dd>\n'
-                html_string += f'        <dt>name</dt>\n        <dd>{has_part_name}</dd>\n'
-                html_string += f'        <dt>datePublished</dt>\n        <dd>{has_part_date_published}</dd>\n'
-                html_string += '      </dl>\n'
-
-            html_string += '    </p>\n'
-            html_string += '  </div>\n'
-
-        # Close the div tag
-        html_string += '</div>\n'
-
-        return html_string
+            html_parts.append(METADATA_ENTRY_START_TEMPLATE.format(
+                id_attribute=escape_attribute(entry['@id']),
+                id=escape_text(entry['@id']),
+                type=escape_text(entry.get('@type', '')),
+                name=escape_text(entry.get('name', '')),
+                date_published=escape_text(entry.get('datePublished', '')),
+            ))
+            html_parts.append(RoCrateUIAssetsProvider.generate_has_part_html(entry.get('hasPart', [])))
+            html_parts.append(METADATA_ENTRY_END)
+        html_parts.append('</div>\n')
+        return ''.join(html_parts)
+
+    @staticmethod
+    def generate_has_part_html(has_part):
+        # Crates can have many thousands of parts, so their fields are escaped in one go and rendered by f-strings
+        fields = iter(escape_all_text([
+            field for has_part_entry in has_part
+            for field in (has_part_entry.get('@id', ''), has_part_entry.get('@type', ''),
+                          has_part_entry.get('name', ''), has_part_entry.get('datePublished', ''))
+        ]))
+        return ''.join([
+            f'      <dl>\n'
+            f'        <dt>@id</dt>\n        <dd>{part_id}</dd>\n'
+            f'        <dt>@type</dt>\n        <dd>{part_type}</dd>\n'
+            f'        <dt>name</dt>\n        <dd>{part_name}</dd>\n'
+            f'        <dt>datePublished</dt>\n        <dd>{part_date_published}</dd>\n'
+            f'      </dl>\n'
+            for part_id, part_type, part_name, part_date_published in zip(fields, fields, fields, fields)
+        ])
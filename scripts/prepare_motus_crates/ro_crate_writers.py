@@ -0,0 +1,63 @@
+import os
+import shutil
+import time
+import zipfile
+
+# Deflating these again costs CPU for no gain, so they are stored as they are
+ALREADY_COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.xz', '.zip', '.png', '.jpg', '.jpeg', '.gif', '.pdf')
+
+
+class FolderRoCrateWriter:
+    """
+    Writes the crate's files into a staging folder, which is zipped alongside itself once complete.
+    """
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.zip_path = f"{folder_path}.zip"
+        os.makedirs(folder_path, exist_ok=True)
+
+    def open(self, name):
+        return open(os.path.join(self.folder_path, name), 'wb')
+
+    def write_text(self, name, text):
+        with open(os.path.join(self.folder_path, name), 'w') as f:
+            f.write(text)
+
+    def close(self):
+        shutil.make_archive(self.folder_path, 'zip', self.folder_path)
+
+
+class ZipRoCrateWriter:
+    """
+    Streams the crate's files straight into its zip, without a staging folder.
+    The zip is written under a temporary name and only moved into place once complete.
+    """
+
+    def __init__(self, zip_path, compression_level=6):
+        self.zip_path = zip_path
+        self.partial_zip_path = f"{zip_path}.part"
+        self.zip_file = zipfile.ZipFile(self.partial_zip_path, 'w', compression=zipfile.ZIP_DEFLATED,
+                                        compresslevel=compression_level)
+
+    def open(self, name):
+        if name.lower().endswith(ALREADY_COMPRESSED_EXTENSIONS):
+            # ZipInfo otherwise dates the entry to 1980 and gives it no permissions when extracted
+            stored_info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            stored_info.compress_type = zipfile.ZIP_STORED
+            stored_info.external_attr = 0o644 << 16
+            return self.zip_file.open(stored_info, 'w', force_zip64=True)
+        return self.zip_file.open(name, 'w', force_zip64=True)
+
+    def write_text(self, name, text):
+        with self.open(name) as f:
+            f.write(text.encode())
+
+    def close(self):
+        self.zip_file.close()
+        os.replace(self.partial_zip_path, self.zip_path)
+
+    def discard(self):
+        """Give up on the zip, leaving any earlier one at zip_path as it was."""
+        self.zip_file.close()
+        os.remove(self.partial_zip_path)
@@ -0,0 +1,102 @@
+import csv
+import json
+import logging
+import os
+import resource
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, fields
+
+# Fields of /proc/self/io: bytes fetched from and sent to storage, and bytes passed through read/write calls of any
+# kind (files, pipes and sockets), so a stage with many chars but few bytes was mostly served from network or cache
+PROC_IO_FIELDS = {'read_bytes': 'read_bytes', 'write_bytes': 'write_bytes', 'rchar': 'read_chars',
+                  'wchar': 'written_chars'}
+
+
+@dataclass
+class StageMetrics:
+    srr_value: str
+    stage: str
+    status: str
+    wall_seconds: float
+    cpu_seconds: float
+    read_bytes: int = None
+    write_bytes: int = None
+    read_chars: int = None
+    written_chars: int = None
+    max_rss_kb: int = None
+    pid: int = None
+
+
+def read_process_io():
+    """The process's I/O counters, or an empty dict where /proc/self/io is not available."""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            counters = dict(line.split(':', 1) for line in f)
+    except OSError:
+        return {}
+    return {name: int(counters[key]) for key, name in PROC_IO_FIELDS.items() if key in counters}
+
+
+class StageMetricsRecorder:
+    """
+    Measures the wall and CPU time, I/O and peak RSS of each stage of preparing a crate.
+    Counters are per process, so with a single worker they also include the directory crawler's thread;
+    peak RSS is the process's highest so far, as of the end of the stage.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    @contextmanager
+    def measure(self, srr_value, stage):
+        io_before = read_process_io()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        status = 'failed'
+        try:
+            yield
+            status = 'succeeded'
+        finally:
+            io_after = read_process_io()
+            self.records.append(StageMetrics(
+                srr_value=srr_value,
+                stage=stage,
+                status=status,
+                wall_seconds=round(time.perf_counter() - wall_start, 6),
+                cpu_seconds=round(time.process_time() - cpu_start, 6),
+                max_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                pid=os.getpid(),
+                **{name: io_after[name] - io_before[name] for name in io_after if name in io_before},
+            ))
+
+    def pop_records(self):
+        records, self.records = self.records, []
+        return records
+
+
+def write_stage_metrics_report(records, report_path):
+    """Write stage metrics as CSV if report_path ends in .csv, or as JSON lines otherwise."""
+    with open(report_path, 'w', newline='') as f:
+        if report_path.endswith('.csv'):
+            writer = csv.DictWriter(f, fieldnames=[field.name for field in fields(StageMetrics)])
+            writer.writeheader()
+            writer.writerows(asdict(record) for record in records)
+        else:
+            for record in records:
+                f.write(json.dumps(asdict(record)) + '\n')
+
+
+def log_stage_metrics_summary(records):
+    """Log the totals per stage, to show where a batch spent its time and whether it was waiting or computing."""
+    totals = {}
+    for record in records:
+        stage_totals = totals.setdefault(record.stage, {'runs': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                                        'read_chars': 0, 'written_chars': 0})
+        stage_totals['runs'] += 1
+        for key in ('wall_seconds', 'cpu_seconds', 'read_chars', 'written_chars'):
+            stage_totals[key] += getattr(record, key) or 0
+    for stage, stage_totals in totals.items():
+        logging.info(f"Stage {stage}: {stage_totals['runs']} runs, {stage_totals['wall_seconds']:.2f}s wall, "
+                     f"{stage_totals['cpu_seconds']:.2f}s CPU, {stage_totals['read_chars'] / 1e6:.1f} MB read, "
+                     f"{stage_totals['written_chars'] / 1e6:.1f} MB written")
@@ -0,0 +1,361 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+MD5_PATTERN = re.compile(r'\b([0-9a-fA-F]{32})\b')
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Errors of a connection that dropped mid-transfer, after which a download picks up where it left off
+RESUMABLE_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout, urllib3.exceptions.ProtocolError, urllib3.exceptions.ReadTimeoutError)
+
+
+@dataclass
+class DownloadResult:
+    path: str
+    size: int
+    md5: str
+    etag: str = None
+
+
+class DownloadSegment:
+    """A byte range of a file being downloaded over its own connection, and how much of it has been written."""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.position = start
+        self.error = None
+
+
+class TarballDownloader:
+    """
+    Downloads tarballs over one pooled session per process, in large chunks, with timeouts and retries.
+    A download whose connection drops carries on from where it got to with an HTTP Range request, as does one left
+    behind as a .part file by an interrupted run, and large files can be fetched over several connections at once.
+    The MD5 is computed as the file arrives, to be checked against the `.md5` file the server has beside it, if any.
+    """
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, segments=1, segment_min_size=256 * 1024 * 1024,
+                 verify_md5=True, retries=5, backoff_factor=1.0, timeout=(10, 60)):
+        self.chunk_size = chunk_size
+        self.segments = max(1, segments)
+        self.segment_min_size = segment_min_size
+        self.verify_md5 = verify_md5
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.session = None
+        self.session_pid = None
+
+    def __getstate__(self):
+        # Sessions hold open sockets, so are never handed to another process
+        return {**self.__dict__, 'session': None, 'session_pid': None}
+
+    def get_session(self):
+        # A forked worker process gets its own session, rather than sharing the parent's connections
+        if self.session is None or self.session_pid != os.getpid():
+            retry = Retry(total=self.retries, backoff_factor=self.backoff_factor, status_forcelist=RETRY_STATUSES,
+                          allowed_methods=('HEAD', 'GET'), raise_on_status=False)
+            adapter = HTTPAdapter(pool_maxsize=max(10, self.segments), max_retries=retry)
+            self.session = requests.Session()
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+            self.session_pid = os.getpid()
+        return self.session
+
+    def head(self, url):
+        response = self.get_session().head(url, allow_redirects=True, timeout=self.timeout)
+        response.raise_for_status()
+        return response.headers
+
+    def get(self, url, headers=None):
+        response = self.get_session().get(url, stream=True, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def wait_before_retry(self, attempt):
+        time.sleep(self.backoff_factor * 2 ** (attempt - 1))
+
+    def fetch_expected_md5(self, url):
+        """The MD5 listed in the `.md5` file beside url, or None if there is none or it cannot be fetched."""
+        if not self.verify_md5:
+            return None
+        try:
+            response = self.get_session().get(f"{url}.md5", timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"Could not fetch the MD5 of {url}, so it will not be checked: {e}")
+            return None
+        if not response.ok:
+            if response.status_code != 404:
+                logging.warning(f"Could not fetch the MD5 of {url}, so it will not be checked: "
+                                f"HTTP {response.status_code}")
+            return None
+        match = MD5_PATTERN.search(response.text)
+        return match.group(1).lower() if match else None
+
+    @staticmethod
+    def check_md5(url, md5, expected_md5):
+        if expected_md5 is not None and md5 != expected_md5:
+            raise ValueError(f"MD5 of the download of {url} is {md5}, but its .md5 file lists {expected_md5}")
+
+    def download(self, url, path, progress=None, expected_md5=None):
+        """
+        Download url to path, through path.part so that a killed run can be resumed.
+        :param progress: a tqdm progress bar, reset to the size of the file and updated with each chunk written
+        :param expected_md5: the MD5 the download must have, as given by fetch_expected_md5
+        """
+        part_path = f"{path}.part"
+        if self.segments > 1:
+            headers = self.head(url)
+            size = int(headers.get('content-length', 0))
+            if size >= self.segment_min_size and headers.get('accept-ranges') == 'bytes':
+                result = self.download_segments(url, part_path, size, headers, progress)
+            else:
+                result = self.download_file(url, part_path, progress)
+        else:
+            result = self.download_file(url, part_path, progress)
+
+        try:
+            self.check_md5(url, result.md5, expected_md5)
+        except ValueError:
+            os.remove(part_path)
+            raise
+        os.replace(part_path, path)
+        self.remove_validator(part_path)
+        result.path = path
+        return result
+
+    @staticmethod
+    def get_validator(headers):
+        """What a range request can be made conditional on, so that it is only honoured if the file is unchanged."""
+        etag = headers.get('etag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return headers.get('last-modified')
+
+    @staticmethod
+    def read_validator(part_path):
+        try:
+            with open(f"{part_path}.validator", 'r') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    @staticmethod
+    def write_validator(part_path, validator):
+        with open(f"{part_path}.validator", 'w') as f:
+            f.write(validator or '')
+
+    @staticmethod
+    def remove_validator(part_path):
+        try:
+            os.remove(f"{part_path}.validator")
+        except OSError:
+            pass
+
+    def download_file(self, url, part_path, progress=None):
+        md5 = hashlib.md5()
+        position = 0
+        # A .part file of a killed run is only carried on from if the server can tell us whether it has changed
+        validator = self.read_validator(part_path)
+        if validator and os.path.isfile(part_path):
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                    md5.update(chunk)
+                    position += len(chunk)
+        etag = None
+        attempt = 0
+
+        with open(part_path, 'ab' if position else 'wb') as f:
+            while True:
+                headers = {}
+                if position:
+                    headers['Range'] = f'bytes={position}-'
+                    if validator:
+                        headers['If-Range'] = validator
+                try:
+                    with self.get(url, headers) as response:
+                        if position and response.status_code != 206:
+                            # Changed since, or ranges are not supported: start again from the beginning
+                            logging.info(f"Downloading {url} again from the start")
+                            f.seek(0)
+                            f.truncate()
+                            md5 = hashlib.md5()
+                            position = 0
+                        etag = response.headers.get('etag')
+                        validator = self.get_validator(response.headers)
+                        self.write_validator(part_path, validator)
+                        if progress is not None:
+                            content_length = response.headers.get('content-length')
+                            progress.reset(total=position + int(content_length) if content_length else None)
+                            progress.update(position)
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            f.write(chunk)
+                            md5.update(chunk)
+                            position += len(chunk)
+                            if progress is not None:
+                                progress.update(len(chunk))
+                    break
+                except requests.exceptions.HTTPError as e:
+                    if not position or e.response.status_code != 416:
+                        raise
+                    # A .part file the server has no more of, as can be left by a run killed before renaming it
+                    f.seek(0)
+                    f.truncate()
+                    md5 = hashlib.md5()
+                    position = 0
+                except RESUMABLE_ERRORS as e:
+                    attempt += 1
+                    if attempt > self.retries:
+                        raise
+                    logging.warning(f"Download of {url} interrupted after {position} bytes, resuming: {e}")
+                    f.flush()
+                    self.wait_before_retry(attempt)
+        return DownloadResult(part_path, position, md5.hexdigest(), etag)
+
+    def download_segments(self, url, part_path, size, headers, progress=None):
+        """
+        Download url over self.segments connections, each writing its own byte range into part_path.
+        The MD5 is computed alongside, in file order, over each part of the file once it has been written.
+        :param headers: the headers of a HEAD request for url, whose validator each range request is conditional on
+        """
+        etag = headers.get('etag')
+        validator = self.get_validator(headers)
+        if progress is not None:
+            progress.reset(total=size)
+        segment_size = -(-size // self.segments)
+        segments = [DownloadSegment(start, min(start + segment_size, size) - 1)
+                    for start in range(0, size, segment_size)]
+        written = threading.Condition()
+        cancelled = threading.Event()
+        fd = os.open(part_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            threads = [threading.Thread(target=self.download_segment,
+                                        args=(url, validator, fd, segment, written, cancelled, progress),
+                                        daemon=True)
+                       for segment in segments]
+            for thread in threads:
+                thread.start()
+            try:
+                md5 = self.hash_segments(fd, segments, written)
+            finally:
+                cancelled.set()
+                for thread in threads:
+                    thread.join()
+        finally:
+            os.close(fd)
+        return DownloadResult(part_path, size, md5, etag)
+
+    def hash_segments(self, fd, segments, written):
+        md5 = hashlib.md5()
+        hashed = 0
+        for segment in segments:
+            while hashed <= segment.end:
+                with written:
+                    written.wait_for(lambda: segment.position > hashed or segment.error is not None)
+                    if segment.error is not None:
+                        raise segment.error
+                    available = segment.position
+                while hashed < available:
+                    # Just written, so read back from the page cache rather than the disk
+                    chunk = os.pread(fd, min(self.chunk_size, available - hashed), hashed)
+                    md5.update(chunk)
+                    hashed += len(chunk)
+        return md5.hexdigest()
+
+    def download_segment(self, url, validator, fd, segment, written, cancelled, progress):
+        attempt = 0
+        try:
+            while segment.position <= segment.end and not cancelled.is_set():
+                headers = {'Range': f'bytes={segment.position}-{segment.end}'}
+                if validator:
+                    headers['If-Range'] = validator
+                try:
+                    with self.get(url, headers) as response:
+                        if response.status_code != 206:
+                            raise ValueError(f"{url} changed, or stopped honouring range requests, while downloading")
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            chunk = chunk[:segment.end + 1 - segment.position]
+                            os.pwrite(fd, chunk, segment.position)
+                            with written:
+                                segment.position += len(chunk)
+                                written.notify_all()
+                            if progress is not None:
+                                progress.update(len(chunk))
+                            if cancelled.is_set():
+                                return
+                except RESUMABLE_ERRORS as e:
+                    attempt += 1
+                    if attempt > self.retries:
+                        raise
+                    logging.warning(f"Download of bytes {segment.position}-{segment.end} of {url} interrupted, "
+                                    f"resuming: {e}")
+                    self.wait_before_retry(attempt)
+        except Exception as e:
+            with written:
+                segment.error = e
+                written.notify_all()
+
+
+class HashingStream:
+    """
+    A file-like view of an HTTP response body for reading it once as a stream, which computes the MD5 of what is
+    read, and carries on with a Range request from where it got to if the connection drops.
+    """
+
+    def __init__(self, downloader, url, sink=None):
+        """
+        :param sink: a file that everything read is also written to
+        """
+        self.downloader = downloader
+        self.url = url
+        self.sink = sink
+        self.md5 = hashlib.md5()
+        self.position = 0
+        self.attempt = 0
+        self.response = downloader.get(url)
+        self.response.raw.decode_content = True
+        self.etag = self.response.headers.get('etag')
+        self.validator = downloader.get_validator(self.response.headers)
+
+    def read(self, size=-1):
+        while True:
+            try:
+                data = self.response.raw.read(size)
+                break
+            except RESUMABLE_ERRORS as e:
+                self.attempt += 1
+                if self.attempt > self.downloader.retries or not self.validator:
+                    raise
+                logging.warning(f"Stream of {self.url} interrupted after {self.position} bytes, resuming: {e}")
+                self.response.close()
+                self.downloader.wait_before_retry(self.attempt)
+                self.response = self.downloader.get(self.url, {'Range': f'bytes={self.position}-',
+                                                               'If-Range': self.validator})
+                if self.response.status_code != 206:
+                    raise ValueError(f"{self.url} changed, or stopped honouring range requests, while streaming")
+                self.response.raw.decode_content = True
+        self.md5.update(data)
+        self.position += len(data)
+        if self.sink is not None:
+            self.sink.write(data)
+        return data
+
+    def read_to_end(self):
+        """Read whatever is left after the archive's end, so that the MD5 covers the whole file."""
+        while self.read(self.downloader.chunk_size):
+            pass
+
+    def close(self):
+        self.response.close()
@@ -1,9 +1,47 @@
+import asyncio
+import csv
+import functools
+import hashlib
+import http.server
+import io
+import json
+import tarfile
+import zipfile
 import unittest
 import httpretty
 import tempfile
 import shutil
 import os
+import threading
+from unittest import mock
+from prepare_motus_crates.archive_cache import ArchiveCache
+from prepare_motus_crates.directory_listing_crawler import DirectoryListingCrawler, parse_listing_links
+from prepare_motus_crates.motus_crate_rerenderer import MotusCrateRerenderer
 from prepare_motus_crates.motus_ro_crates_preparer import MotusRoCratesPreparer
+from prepare_motus_crates.ro_crate_ui_assets_provider import RoCrateUIAssetsProvider
+from prepare_motus_crates.ro_crate_writers import ZipRoCrateWriter
+from prepare_motus_crates.tarball_downloader import TarballDownloader
+
+
+def make_synthetic_motus_tarball(srr_value):
+    """Build an in-memory .tar.gz laid out like a mOTUs pipeline output folder."""
+    members = {
+        f'{srr_value}/qc/multiqc/multiqc_report.html': b'<!DOCTYPE html><html><body>multiqc</body></html>',
+        f'{srr_value}/taxonomy/LSU/krona.html': b'<html><body>LSU krona</body></html>',
+        f'{srr_value}/taxonomy/SSU/krona.html': b'<html><body>SSU krona</body></html>',
+        f'{srr_value}/taxonomy/SSU/{srr_value}.tsv': b'taxon\tcount\n',
+    }
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for name, content in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def register_missing_md5(tarball_url):
+    httpretty.register_uri(httpretty.GET, f"{tarball_url}.md5", status=404)
 
 
 class TestMotusCratePreparer(unittest.TestCase):
@@ -31,6 +69,7 @@ class TestMotusCratePreparer(unittest.TestCase):
             httpretty.GET, self.original_zip_url,
             body=gzip_file_content, status=200
         )
+        register_missing_md5(self.original_zip_url)
 
         # Create the MotusCratePreparer instance
         preparer = MotusRoCratesPreparer(self.original_zip_url, self.destination_folder)
@@ -50,5 +89,549 @@ class TestMotusCratePreparer(unittest.TestCase):
         # Add more assertions based on the expected outcomes of the integration
 
 
+class QuietHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class TestMotusCratePreparerBatch(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.destination_folder = os.path.join(self.temp_dir, 'crates')
+        self.served_folder = os.path.join(self.temp_dir, 'motus_web')
+        os.makedirs(self.destination_folder)
+        os.makedirs(os.path.join(self.served_folder, 'SRR000', 'SRR0000003'))
+
+        handler = functools.partial(QuietHTTPRequestHandler, directory=self.temp_dir)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/motus_web/"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def serve_file(self, path, content):
+        with open(os.path.join(self.served_folder, path), 'wb') as f:
+            f.write(content)
+
+    def test_bad_tarball_does_not_abort_batch(self):
+        tarball = make_synthetic_motus_tarball('SRR0000001')
+        self.serve_file('SRR0000001.tar.gz', tarball)
+        self.serve_file('SRR0000001.tar.gz.md5', f'{hashlib.md5(tarball).hexdigest()}  SRR0000001.tar.gz\n'.encode())
+        self.serve_file('SRR0000002.tar.gz', b'not a tarball')
+        self.serve_file(os.path.join('SRR000', 'SRR0000003', 'SRR0000003.tar.gz'),
+                        make_synthetic_motus_tarball('SRR0000003'))
+
+        preparer = MotusRoCratesPreparer(self.base_url, self.destination_folder, extract_multiple=True, workers=2)
+        results = {result.srr_value: result for result in preparer.prepare_motus_ro_crate()}
+
+        self.assertEqual(set(results), {'SRR0000001', 'SRR0000002', 'SRR0000003'})
+        self.assertTrue(results['SRR0000001'].succeeded)
+        self.assertFalse(results['SRR0000002'].succeeded)
+        self.assertTrue(results['SRR0000003'].succeeded)
+        for srr_value in ('SRR0000001', 'SRR0000003'):
+            self.assertTrue(os.path.isfile(os.path.join(self.destination_folder, f'motus_{srr_value}.zip')))
+            self.assertTrue(os.path.isfile(os.path.join(self.destination_folder, f'motus_{srr_value}',
+                                                        'krona_LSU.html')))
+        self.assertFalse(os.path.exists(os.path.join(self.destination_folder, 'motus_SRR0000002.zip')))
+
+    def test_stage_metrics_are_reported_from_workers(self):
+        self.serve_file('SRR0000001.tar.gz', make_synthetic_motus_tarball('SRR0000001'))
+        self.serve_file('SRR0000002.tar.gz', b'not a tarball')
+        metrics_report = os.path.join(self.temp_dir, 'stage_metrics.csv')
+        profile_dir = os.path.join(self.temp_dir, 'profiles')
+
+        preparer = MotusRoCratesPreparer(self.base_url, self.destination_folder, extract_multiple=True, workers=2,
+                                         metrics_report_path=metrics_report, profile_dir=profile_dir)
+        preparer.prepare_motus_ro_crate()
+
+        with open(metrics_report, newline='') as f:
+            rows = list(csv.DictReader(f))
+        stages = {(row['srr_value'], row['stage']): row for row in rows}
+        for stage in ('check', 'download', 'extract', 'find', 'inject', 'metadata', 'preview', 'zip', 'cleanup'):
+            self.assertEqual(stages[('SRR0000001', stage)]['status'], 'succeeded')
+            self.assertGreaterEqual(float(stages[('SRR0000001', stage)]['wall_seconds']), 0)
+        self.assertEqual(stages[('SRR0000002', 'extract')]['status'], 'failed')
+        self.assertNotIn(('SRR0000002', 'zip'), stages)
+        self.assertEqual(sorted(os.listdir(profile_dir)), ['SRR0000001.prof', 'SRR0000002.prof'])
+
+    def test_md5_mismatch_fails_run(self):
+        self.serve_file('SRR0000001.tar.gz', make_synthetic_motus_tarball('SRR0000001'))
+        self.serve_file('SRR0000001.tar.gz.md5', b'0' * 32)
+
+        for stream_archive in (False, True):
+            preparer = MotusRoCratesPreparer(self.base_url, self.destination_folder, extract_multiple=True,
+                                             stream_archive=stream_archive)
+            result, = preparer.prepare_motus_ro_crate()
+            self.assertFalse(result.succeeded)
+            self.assertIn('MD5', result.error)
+            self.assertFalse(os.path.exists(os.path.join(self.destination_folder, 'motus_SRR0000001.zip')))
+
+    def test_failed_direct_zip_leaves_no_partial_zip(self):
+        self.serve_file('SRR0000001.tar.gz', make_synthetic_motus_tarball('SRR0000001'))
+
+        preparer = MotusRoCratesPreparer(self.base_url, self.destination_folder, extract_multiple=True,
+                                         stream_archive=True, direct_zip=True)
+        with mock.patch.object(MotusRoCratesPreparer, 'create_ro_crate_preview_html',
+                               side_effect=RuntimeError('preview failed')):
+            result, = preparer.prepare_motus_ro_crate()
+
+        self.assertFalse(result.succeeded)
+        self.assertIn('preview failed', result.error)
+        self.assertEqual([name for name in os.listdir(self.destination_folder) if name.startswith('motus_')], [])
+
+    def test_archive_cache_is_used_once_tarball_is_gone(self):
+        cache_dir = os.path.join(self.temp_dir, 'archive_cache')
+        tarball = make_synthetic_motus_tarball('SRR0000001')
+        self.serve_file('SRR0000001.tar.gz', tarball)
+        self.serve_file('SRR0000001.tar.gz.md5', hashlib.md5(tarball).hexdigest().encode())
+
+        for stream_archive in (False, True):
+            preparer = MotusRoCratesPreparer(self.base_url, self.destination_folder, extract_multiple=True,
+                                             stream_archive=stream_archive, archive_cache_dir=cache_dir)
+            self.assertTrue(preparer.prepare_motus_ro_crate()[0].succeeded)
+        self.assertEqual(len([name for name in os.listdir(cache_dir) if name.endswith('.tar.gz')]), 1)
+
+        # Its MD5 is unchanged, so the cached tarball is used without fetching the tarball itself
+        self.serve_file('SRR0000001.tar.gz', b'')
+        with mock.patch('prepare_motus_crates.tarball_downloader.TarballDownloader.get', side_effect=AssertionError):
+            for stream_archive in (False, True):
+                preparer = MotusRoCratesPreparer(self.base_url, self.destination_folder, extract_multiple=True,
+                                                 stream_archive=stream_archive, archive_cache_dir=cache_dir)
+                result, = preparer.prepare_motus_ro_crate()
+                self.assertTrue(result.succeeded, result.error)
+
+
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves `content` at any path, and its MD5 beside it, honouring Range and If-Range requests.
+    As servers must, If-Range only matches a strong ETag or the Last-Modified date.
+    The first `drops` responses are cut off half way through.
+    """
+    content = b''
+    etag = '"v1"'
+    last_modified = 'Sun, 18 Oct 2026 10:00:00 GMT'
+    drops = 0
+    ranges = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_content_headers(self):
+        handler = type(self)
+        start, end = 0, len(handler.content) - 1
+        range_header = self.headers.get('Range')
+        handler.ranges.append(range_header)
+        if_range = self.headers.get('If-Range')
+        if range_header and (if_range is None or if_range in (handler.last_modified, handler.etag)
+                             and not if_range.startswith('W/')):
+            first, last = range_header.split('=')[1].split('-')
+            start, end = int(first), int(last) if last else end
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(handler.content)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end + 1 - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', handler.etag)
+        self.send_header('Last-Modified', handler.last_modified)
+        self.end_headers()
+        return handler.content[start:end + 1]
+
+    def do_HEAD(self):
+        self.send_content_headers()
+
+    def do_GET(self):
+        handler = type(self)
+        if self.path.endswith('.md5'):
+            body = hashlib.md5(handler.content).hexdigest().encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        body = self.send_content_headers()
+        if handler.drops:
+            handler.drops -= 1
+            body = body[:len(body) // 2]
+        self.wfile.write(body)
+
+
+class TestTarballDownloader(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'SRR0000001.tar.gz')
+        RangeRequestHandler.content = os.urandom(200 * 1024)
+        RangeRequestHandler.etag = '"v1"'
+        RangeRequestHandler.drops = 0
+        RangeRequestHandler.ranges = []
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/SRR0000001.tar.gz"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def assert_downloaded(self, result):
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), RangeRequestHandler.content)
+        self.assertEqual(result.md5, hashlib.md5(RangeRequestHandler.content).hexdigest())
+        self.assertEqual(result.size, len(RangeRequestHandler.content))
+        self.assertEqual(os.listdir(self.temp_dir), ['SRR0000001.tar.gz'])
+
+    def test_dropped_connection_is_resumed(self):
+        RangeRequestHandler.drops = 2
+        result = TarballDownloader(chunk_size=4096, backoff_factor=0).download(self.url, self.path)
+        self.assert_downloaded(result)
+        self.assertEqual(RangeRequestHandler.ranges[0], None)
+        self.assertEqual(len(RangeRequestHandler.ranges), 3)
+        self.assertTrue(all(range_header.startswith('bytes=') for range_header in RangeRequestHandler.ranges[1:]))
+
+    def test_part_file_of_killed_run_is_resumed(self):
+        with open(f"{self.path}.part", 'wb') as f:
+            f.write(RangeRequestHandler.content[:1000])
+        with open(f"{self.path}.part.validator", 'w') as f:
+            f.write(RangeRequestHandler.etag)
+        self.assert_downloaded(TarballDownloader().download(self.url, self.path))
+        self.assertEqual(RangeRequestHandler.ranges, ['bytes=1000-'])
+
+    def test_changed_file_is_downloaded_again(self):
+        with open(f"{self.path}.part", 'wb') as f:
+            f.write(b'stale')
+        with open(f"{self.path}.part.validator", 'w') as f:
+            f.write('"v0"')
+        self.assert_downloaded(TarballDownloader().download(self.url, self.path))
+
+    def test_segmented_download(self):
+        RangeRequestHandler.drops = 1
+        downloader = TarballDownloader(chunk_size=4096, segments=4, segment_min_size=0, backoff_factor=0)
+        self.assert_downloaded(downloader.download(self.url, self.path))
+        self.assertEqual(sum(range_header is not None for range_header in RangeRequestHandler.ranges), 5)
+
+    def test_segmented_download_with_weak_etag(self):
+        # A weak ETag never matches If-Range, so the segments are made conditional on Last-Modified instead
+        RangeRequestHandler.etag = 'W/"v1"'
+        downloader = TarballDownloader(chunk_size=4096, segments=4, segment_min_size=0, backoff_factor=0)
+        result = downloader.download(self.url, self.path)
+        self.assert_downloaded(result)
+        self.assertEqual(result.etag, 'W/"v1"')
+
+
+class TestArchiveCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = ArchiveCache(os.path.join(self.temp_dir, 'cache'), max_size=250)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def add(self, url, mtime):
+        key = self.cache.get_key(url, 'md5:0')
+        with self.cache.lock(key):
+            with open(self.cache.get_path(key), 'wb') as f:
+                f.write(b'x' * 100)
+            self.cache.put(key, url=url, size=100)
+        os.utime(self.cache.get_path(key), (mtime, mtime))
+        return key
+
+    def test_least_recently_used_is_evicted(self):
+        first, second, third = (self.add(f'http://example.org/SRR{i}.tar.gz', i) for i in range(3))
+        with self.cache.lock(first):
+            self.assertIsNotNone(self.cache.get(first))
+        self.cache.evict()
+        self.assertIsNotNone(self.cache.get(first))
+        self.assertIsNone(self.cache.get(second))
+        self.assertIsNotNone(self.cache.get(third))
+
+    def test_locked_tarball_is_not_evicted(self):
+        keys = [self.add(f'http://example.org/SRR{i}.tar.gz', i) for i in range(4)]
+        link_path = os.path.join(self.temp_dir, 'linked.tar.gz')
+        self.cache.link(keys[0], link_path)
+        with self.cache.lock(keys[0]):
+            pid = os.fork()
+            if pid == 0:
+                # flock locks are per open file, so another process is needed to be refused
+                self.cache.evict()
+                os._exit(0)
+            os.waitpid(pid, 0)
+        self.assertTrue(os.path.exists(self.cache.get_path(keys[0])))
+        self.assertEqual([os.path.exists(self.cache.get_path(key)) for key in keys[1:]], [False, False, True])
+        self.assertEqual(os.path.getsize(link_path), 100)
+
+
+class TestParseListingLinks(unittest.TestCase):
+    def test_apache_listing(self):
+        listing_url = 'http://ftp.example.org/motus_web/SRR578/'
+        listing_html = (
+            '<table><tr><th><a href="?C=N;O=D">Name</a></th><th><a href="?C=M;O=A">Last modified</a></th></tr>'
+            '<tr><td><a href="/motus_web/">Parent Directory</a></td></tr>'
+            '<tr><td><a href="SRR5787994/">SRR5787994/</a></td></tr>'
+            '<tr><td><a href="SRR5787995.tar.gz">SRR5787995.tar.gz</a></td></tr>'
+            '<tr><td><a href="SRR5787995.tar.gz.md5">SRR5787995.tar.gz.md5</a></td></tr>'
+            "<tr><td><A HREF='SRR5787996.tar.gz'>SRR5787996.tar.gz</A></td></tr></table>"
+        )
+        subdirectories, tarballs = parse_listing_links(listing_url, listing_html)
+        self.assertEqual(subdirectories, [listing_url + 'SRR5787994/'])
+        self.assertEqual(tarballs, [listing_url + 'SRR5787995.tar.gz', listing_url + 'SRR5787996.tar.gz'])
+
+
+class TestDirectoryListingCrawler(unittest.TestCase):
+    def test_listing_that_fails_does_not_stop_crawl(self):
+        root_url = 'http://ftp.example.org/motus_web/'
+        listings = {
+            root_url: ([root_url + 'SRR1/', root_url + 'SRR2/'], []),
+            root_url + 'SRR2/': ([], [root_url + 'SRR2/SRR2.tar.gz']),
+        }
+
+        async def fetch_listing(session, url):
+            if url not in listings:
+                raise ValueError(f'Unparseable listing at {url}')
+            return listings[url]
+
+        # A single worker, so that the crawl would never finish if the failed listing ended it
+        crawler = DirectoryListingCrawler(concurrency=1)
+        found = []
+        with mock.patch.object(crawler, 'fetch_listing', fetch_listing), self.assertLogs(level='ERROR') as logs:
+            asyncio.run(asyncio.wait_for(crawler.crawl(root_url, found.append), timeout=10))
+        self.assertEqual(found, [root_url + 'SRR2/SRR2.tar.gz'])
+        self.assertIn(root_url + 'SRR1/', logs.output[0])
+
+
+class TestMotusCratePreparerManifest(unittest.TestCase):
+    tarball_url = "http://ftp.example.org/motus_web/SRR0000001.tar.gz"
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.destination_folder = os.path.join(self.temp_dir, 'crates')
+        self.manifest_path = os.path.join(self.temp_dir, 'manifest.jsonl')
+        os.makedirs(self.destination_folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def register_head(self, etag=None):
+        # httpretty derives the Content-Length of the HEAD response from the body, which requests never reads
+        httpretty.register_uri(httpretty.HEAD, self.tarball_url, body=make_synthetic_motus_tarball('SRR0000001'),
+                               adding_headers={'ETag': etag} if etag else {}, status=200)
+
+    def prepare(self):
+        preparer = MotusRoCratesPreparer(self.tarball_url, self.destination_folder, manifest_path=self.manifest_path)
+        return preparer.prepare_motus_ro_crate()[0]
+
+    @httpretty.activate
+    def test_up_to_date_crate_is_skipped(self):
+        self.register_head('"v1"')
+        httpretty.register_uri(httpretty.GET, self.tarball_url, body=make_synthetic_motus_tarball('SRR0000001'),
+                               adding_headers={'ETag': '"v1"'}, status=200)
+        register_missing_md5(self.tarball_url)
+        self.assertEqual(self.prepare().status, 'succeeded')
+        self.assertEqual(self.prepare().status, 'skipped')
+        self.assertEqual(httpretty.last_request().method, 'HEAD')
+
+        # A new ETag on the server means the crate has to be rebuilt
+        self.register_head('"v2"')
+        self.assertEqual(self.prepare().status, 'succeeded')
+
+    @httpretty.activate
+    def test_interrupted_run_resumes_without_downloading_again(self):
+        self.register_head()
+        httpretty.register_uri(httpretty.GET, self.tarball_url, body=make_synthetic_motus_tarball('SRR0000001'),
+                               status=200)
+        register_missing_md5(self.tarball_url)
+        with mock.patch.object(MotusRoCratesPreparer, 'create_ro_crate_metadata', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                self.prepare()
+
+        httpretty.register_uri(httpretty.GET, self.tarball_url, status=500)
+        # The download has the size and mtime it was recorded with, so it is not hashed again
+        with mock.patch.object(MotusRoCratesPreparer, 'md5_of_file', side_effect=AssertionError('hashed')):
+            self.assertEqual(self.prepare().status, 'succeeded')
+        self.assertTrue(os.path.isfile(os.path.join(self.destination_folder, 'motus_SRR0000001.zip')))
+
+    @httpretty.activate
+    def test_touched_download_is_hashed_once_per_run(self):
+        self.register_head()
+        httpretty.register_uri(httpretty.GET, self.tarball_url, body=make_synthetic_motus_tarball('SRR0000001'),
+                               status=200)
+        register_missing_md5(self.tarball_url)
+        with mock.patch.object(MotusRoCratesPreparer, 'create_ro_crate_metadata', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                self.prepare()
+        downloaded_file_path = os.path.join(f'{self.destination_folder}_temp', 'SRR0000001', 'SRR0000001.tar.gz')
+        stat = os.stat(downloaded_file_path)
+        os.utime(downloaded_file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        httpretty.register_uri(httpretty.GET, self.tarball_url, status=500)
+        with mock.patch.object(MotusRoCratesPreparer, 'md5_of_file', wraps=MotusRoCratesPreparer.md5_of_file) as md5:
+            self.assertEqual(self.prepare().status, 'succeeded')
+        md5.assert_called_once_with(downloaded_file_path)
+
+    @httpretty.activate
+    def test_download_of_another_size_is_not_resumed(self):
+        self.register_head()
+        httpretty.register_uri(httpretty.GET, self.tarball_url, body=make_synthetic_motus_tarball('SRR0000001'),
+                               status=200)
+        register_missing_md5(self.tarball_url)
+        with mock.patch.object(MotusRoCratesPreparer, 'create_ro_crate_metadata', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                self.prepare()
+        downloaded_file_path = os.path.join(f'{self.destination_folder}_temp', 'SRR0000001', 'SRR0000001.tar.gz')
+        with open(downloaded_file_path, 'ab') as downloaded_file:
+            downloaded_file.write(b'\0')
+
+        with mock.patch.object(MotusRoCratesPreparer, 'md5_of_file', side_effect=AssertionError('hashed')):
+            self.assertEqual(self.prepare().status, 'succeeded')
+        self.assertEqual(httpretty.last_request().method, 'GET')
+
+
+class TestMotusCratePreparerStreaming(unittest.TestCase):
+    tarball_url = "http://ftp.example.org/motus_web/SRR0000001.tar.gz"
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def prepare(self, destination_folder, **kwargs):
+        os.makedirs(destination_folder)
+        MotusRoCratesPreparer(self.tarball_url, destination_folder, **kwargs).prepare_motus_ro_crate()
+        with zipfile.ZipFile(os.path.join(destination_folder, 'motus_SRR0000001.zip')) as crate:
+            metadata = json.loads(crate.read('ro-crate-metadata.json'))
+            contents = {name: crate.read(name) for name in crate.namelist() if name.endswith('.html')}
+        has_part = {part['@id'] for entity in metadata['@graph'] for part in entity.get('hasPart', [])}
+        return contents, has_part
+
+    @httpretty.activate
+    def test_streamed_crate_matches_extracted_crate(self):
+        httpretty.register_uri(httpretty.GET, self.tarball_url, body=make_synthetic_motus_tarball('SRR0000001'),
+                               status=200)
+        register_missing_md5(self.tarball_url)
+        extracted_contents, extracted_parts = self.prepare(os.path.join(self.temp_dir, 'extracted'))
+        streamed_contents, streamed_parts = self.prepare(os.path.join(self.temp_dir, 'streamed'), stream_archive=True)
+
+        self.assertEqual(extracted_contents.keys(), streamed_contents.keys())
+        for name in ('multiqc_report.html', 'krona_LSU.html', 'krona_SSU.html'):
+            self.assertEqual(extracted_contents[name], streamed_contents[name])
+        self.assertTrue(streamed_contents['krona_LSU.html'].startswith(b'<script>'))
+        self.assertTrue(streamed_contents['krona_LSU.html'].endswith(b'</style>\n<html><body>LSU krona</body></html>'))
+        # Only the extracted run has the downloaded tarball itself in its workspace
+        self.assertEqual({part for part in extracted_parts if not part.endswith('.tar.gz')}, streamed_parts)
+
+    @httpretty.activate
+    def test_direct_zip_matches_staged_crate(self):
+        httpretty.register_uri(httpretty.GET, self.tarball_url, body=make_synthetic_motus_tarball('SRR0000001'),
+                               status=200)
+        register_missing_md5(self.tarball_url)
+        staged_contents, staged_parts = self.prepare(os.path.join(self.temp_dir, 'staged'))
+        direct_folder = os.path.join(self.temp_dir, 'direct')
+        direct_contents, direct_parts = self.prepare(direct_folder, stream_archive=True, direct_zip=True)
+
+        self.assertEqual(os.listdir(direct_folder), ['motus_SRR0000001.zip'])
+        self.assertEqual(staged_contents.keys(), direct_contents.keys())
+        self.assertEqual(staged_contents['multiqc_report.html'], direct_contents['multiqc_report.html'])
+
+
+class TestZipRoCrateWriter(unittest.TestCase):
+    def test_stored_entries_are_dated_and_readable(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            zip_path = os.path.join(temp_dir, 'crate.zip')
+            writer = ZipRoCrateWriter(zip_path)
+            with writer.open('SRR0000001.tsv.gz') as f:
+                f.write(b'compressed already')
+            writer.write_text('ro-crate-metadata.json', '{}')
+            writer.close()
+            with zipfile.ZipFile(zip_path) as zip_file:
+                stored, deflated = zip_file.getinfo('SRR0000001.tsv.gz'), zip_file.getinfo('ro-crate-metadata.json')
+            self.assertEqual(stored.compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(deflated.compress_type, zipfile.ZIP_DEFLATED)
+            self.assertGreaterEqual(stored.date_time[0], 2024)
+            self.assertEqual(stored.external_attr >> 16 & 0o777, 0o644)
+
+
+class TestMotusCrateRerenderer(unittest.TestCase):
+    tarball_url = "http://ftp.example.org/motus_web/SRR0000001.tar.gz"
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.zip_path = os.path.join(self.temp_dir, 'motus_SRR0000001.zip')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def read_crate(self):
+        with zipfile.ZipFile(self.zip_path) as crate:
+            return {name: crate.read(name) for name in crate.namelist()}
+
+    @httpretty.activate
+    def test_rerendered_crate_matches_prepared_crate(self):
+        httpretty.register_uri(httpretty.GET, self.tarball_url, body=make_synthetic_motus_tarball('SRR0000001'),
+                               status=200)
+        register_missing_md5(self.tarball_url)
+        MotusRoCratesPreparer(self.tarball_url, self.temp_dir, stream_archive=True,
+                              direct_zip=True).prepare_motus_ro_crate()
+        prepared = self.read_crate()
+        with open(os.path.join(self.temp_dir, 'motus_SRR0000002.zip'), 'wb') as f:
+            f.write(b'not a zip')
+
+        results = {result.srr_value: result for result in MotusCrateRerenderer(self.temp_dir).rerender_crates()}
+        self.assertTrue(results['SRR0000001'].succeeded)
+        self.assertFalse(results['SRR0000002'].succeeded)
+        self.assertEqual(self.read_crate(), prepared)
+
+        # The home button is replaced, rather than prepended again, each time
+        MotusCrateRerenderer(self.temp_dir, minify_assets=True).rerender_crates()
+        minified = self.read_crate()
+        minified_prefix = RoCrateUIAssetsProvider(minify_assets=True).home_button_navigation_prefix
+        self.assertEqual(minified['krona_LSU.html'], minified_prefix + b'<html><body>LSU krona</body></html>')
+        self.assertEqual(minified['ro-crate-metadata.json'], prepared['ro-crate-metadata.json'])
+        self.assertLess(len(minified['ro-crate-preview.html']), len(prepared['ro-crate-preview.html']))
+        MotusCrateRerenderer(self.temp_dir, workers=2).rerender_crates()
+        self.assertEqual(self.read_crate(), prepared)
+
+
+class TestRoCrateUIAssetsProviderMetadataHtml(unittest.TestCase):
+    def test_ids_and_names_are_escaped(self):
+        metadata_html = RoCrateUIAssetsProvider.generate_metadata_html({'@graph': [{
+            '@id': './"><script>',
+            '@type': 'Dataset',
+            'name': 'Runs & <samples>',
+            'hasPart': [{'@id': 'krona_<LSU>.html', '@type': 'File'}, {'@id': 'multiqc_report.html'}],
+        }]})
+        self.assertNotIn('<script>', metadata_html)
+        self.assertIn('<a id="./&quot;&gt;&lt;script&gt;" />', metadata_html)
+        self.assertIn('<dd>Runs &amp; &lt;samples&gt;</dd>', metadata_html)
+        self.assertIn('<dd>krona_&lt;LSU&gt;.html</dd>', metadata_html)
+        self.assertIn('<dd>multiqc_report.html</dd>', metadata_html)
+
+    def test_every_part_is_rendered(self):
+        has_part = [{'@id': f'krona_{i}.html', '@type': 'File'} for i in range(10000)]
+        metadata_html = RoCrateUIAssetsProvider.generate_metadata_html({'@graph': [{'@id': './',
+                                                                                   'hasPart': has_part}]})
+        self.assertEqual(metadata_html.count('<dt>@id</dt>'), 10000)
+        self.assertIn('<dd>krona_9999.html</dd>', metadata_html)
+
+
+class TestRoCrateUIAssetsProviderAssets(unittest.TestCase):
+    def test_assets_load_from_any_directory_and_minify(self):
+        original_cwd = os.getcwd()
+        os.chdir(tempfile.gettempdir())
+        try:
+            asset_provider = RoCrateUIAssetsProvider()
+            minified_asset_provider = RoCrateUIAssetsProvider(minify_assets=True)
+        finally:
+            os.chdir(original_cwd)
+        self.assertTrue(asset_provider.preview_html_styling.startswith('<style>'))
+        self.assertIn('html{margin:0;padding:0;}', minified_asset_provider.preview_html_styling)
+        self.assertLess(len(minified_asset_provider.home_button_navigation_prefix),
+                        len(asset_provider.home_button_navigation_prefix))
+        self.assertIn('function goHome(event) {\nif (window.self === window.top) {',
+                      minified_asset_provider.home_button_navigation_script)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,75 +1,88 @@
-from rocrate.rocrate import ROCrate
-from rocrate.model.preview import Preview
-from rocrate.model.contextentity import ContextEntity
-from uuid import uuid4
-import os
+import argparse
 from datetime import datetime
-from jinja2 import Template
-
-
-class MGnifyPreview(Preview):
-    def generate_html(self):
-        template = open('mgnify-rocrate-preview-template.html.j2')
-        src = Template(template.read())
-
-        def template_function(func):
-            src.globals[func.__name__] = func
-            return func
-
-        @template_function
-        def stringify(a):
-            if type(a) is list:
-                return ', '.join([stringify(aa) for aa in a])
-            elif type(a) is str:
-                return a
-            elif hasattr(a, '_jsonld') and a._jsonld.get('name'):
-                    return a._jsonld['name']
-            elif type(a) is dict:
-                return stringify(list(a.values()))
-            else:
-                return a
-
-        @template_function
-        def is_object_list(a):
-            if type(a) is list:
-                for obj in a:
-                    if obj is not str:
-                        return True
-            else:
-                return False
-
-        @template_function
-        def details(a):
-            if type(a) is dict:
-                return {k: v for k, v in a.items() if k not in ['@id', '@type']}
-
-        template.close()
-        context_entities = []
-        data_entities = []
-        for entity in self.crate.contextual_entities:
-            context_entities.append(entity._jsonld)
-        for entity in self.crate.data_entities:
-            data_entities.append(entity._jsonld)
-        out_html = src.render(crate=self.crate, context=context_entities, data=data_entities)
-        return out_html
-
-def create_sanntis_rocrate(gff_path: str):
-    try:
-        assembly = 'ERZ' + gff_path.split('ERZ')[1].split('.')[0].split('_')[0]
-    except:
-        print(f'Could not determine assembly accession from path {gff_path}')
-        return
+import json
+from functools import lru_cache, partial
+from multiprocessing import Pool
+import os
+from pathlib import Path
+import sys
+from uuid import uuid4
 
+from rocrate.rocrate import ROCrate
+from rocrate.model.contextentity import ContextEntity
+from rocrate.utils import iso_now
+
+if __name__ == '__main__' and not __package__:
+    # Run as a script, so the scripts folder holding the shared mgnify_crates package is found from this file
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from mgnify_crates import CrateTemplate, MGnifyPreview, is_plain_file_name  # noqa: E402
+
+# The values that differ between SanntiS crates
+SANNTIS_CRATE_FIELDS = ('gff_name', 'assembly', 'run_id', 'end_time', 'date_published')
+
+# Context entities that are the same in every crate, as (@id, properties)
+PROCESS_RUN_CRATE_PROFILE = ("https://w3id.org/ro/wfrun/process/0.1", {
+    "@type": "CreativeWork",
+    "name": "Process Run Crate",
+    "version": "0.1"
+})
+SANNTIS_SOURCE_CODE = ("https://github.com/Finn-Lab/SanntiS", {
+    "@type": "SoftwareSourceCode",
+    "name": "SanntiS: SMBGC Annotation using Neural Networks Trained on Interpro Signatures",
+    "alternateName": "emeraldBGC",
+    "url": "https://github.com/Finn-Lab/SanntiS",
+    "codeRepository": "https://github.com/Finn-Lab/SanntiS",
+    "version": "0.9.3.1",
+})
+BBSRC = ("https://ror.org/00cwqg982", {
+    "@type": "Organization",
+    "name": "BBSRC",
+    "alternateName": "Biotechnology and Biological Sciences Research Council",
+    "url": "http://www.bbsrc.ac.uk/"
+})
+EMERALD_GRANT = ("BB/S009043/1", {
+    "@type": "Grant",
+    "name": "EMERALD - Enriching MEtagenomics Results using Artificial intelligence and Literature Data",
+    "url": "https://gtr.ukri.org/projects?ref=BB%2FS009043%2F1"
+})
+EMBL_EBI = ("https://ror.org/02catss52", {
+    "@type": "Organization",
+    "name": "EMBL-EBI",
+    "url": "https://www.ebi.ac.uk/metagenomics"
+})
+GFF_COLUMNS = [
+    ('gff_attribute_nearest_mibig', {
+        "@type": "PropertyValue",
+        "name": "Nearest MiBIG",
+        "url": "https://mibig.secondarymetabolites.org/repository",
+        "description": "The nearest_MiBIG attribute in the GFF column 9 is the closest predicted BGC from the MiBIG ontology.",
+        "value": "nearest_MiBIG",
+        "propertyId": "https://mibig.secondarymetabolites.org/repository/@value",
+    }),
+    ('gff_attribute_nearest_mibig_class', {
+        "@type": "PropertyValue",
+        "name": "Nearest MiBIG class",
+        "url": "https://mibig.secondarymetabolites.org",
+        "description": "The nearest_MiBIG_class attribute in the GFF column 9 is one of the 6 (or other) BGC types from the MiBIG ontology.",
+        "value": "nearest_MiBIG_class",
+        "propertyId": "https://mibig.secondarymetabolites.org/",
+    }),
+]
+
+
+def add_context_entity(crate, entity):
+    entity_id, properties = entity
+    return crate.add(ContextEntity(crate, entity_id, properties=properties))
+
+
+def build_sanntis_rocrate(gff_path, gff_name, assembly, run_id, end_time, date_published=None):
     crate = ROCrate(gen_preview=False)
     crate.add(MGnifyPreview(crate))
+    if date_published:
+        crate.root_dataset["datePublished"] = date_published
 
     # Conform to the WFRUN profile
-    PC_PROFILE_ID = "https://w3id.org/ro/wfrun/process/0.1"
-    pc_profile = crate.add(ContextEntity(crate, PC_PROFILE_ID, properties={
-        "@type": "CreativeWork",
-        "name": "Process Run Crate",
-        "version": "0.1"
-    }))
+    pc_profile = add_context_entity(crate, PROCESS_RUN_CRATE_PROFILE)
     crate.root_dataset["conformsTo"] = pc_profile
 
     crate.name = f'SANNTIS predictions for assembly {assembly}'
@@ -77,41 +90,20 @@ def create_sanntis_rocrate(gff_path: str):
 This is the output (a GFF feature file) of SanntiS being run on the MGnify assembly {assembly}."""
 
     # Workflow Provenance
-    sourcecode = crate.add(ContextEntity(crate, "https://github.com/Finn-Lab/SanntiS", properties={
-        "@type": "SoftwareSourceCode",
-        "name": "SanntiS: SMBGC Annotation using Neural Networks Trained on Interpro Signatures",
-        "alternateName": "emeraldBGC",
-        "url": "https://github.com/Finn-Lab/SanntiS",
-        "codeRepository": "https://github.com/Finn-Lab/SanntiS",
-        "version": "0.9.3.1",
-    }))
-    bbsrc = crate.add(ContextEntity(crate, "https://ror.org/00cwqg982", properties={
-        "@type": "Organization",
-        "name": "BBSRC",
-        "alternateName": "Biotechnology and Biological Sciences Research Council",
-        "url": "http://www.bbsrc.ac.uk/"
-    }))
-    emerald_grant = crate.add(ContextEntity(crate, "BB/S009043/1", properties={
-        "@type": "Grant",
-        "name": "EMERALD - Enriching MEtagenomics Results using Artificial intelligence and Literature Data",
-        "url": "https://gtr.ukri.org/projects?ref=BB%2FS009043%2F1"
-    }))
+    sourcecode = add_context_entity(crate, SANNTIS_SOURCE_CODE)
+    bbsrc = add_context_entity(crate, BBSRC)
+    emerald_grant = add_context_entity(crate, EMERALD_GRANT)
     emerald_grant.append_to("funder", bbsrc)
     sourcecode.append_to("funding", emerald_grant)
 
     # The run
-    agent = crate.add(ContextEntity(crate, "https://ror.org/02catss52", properties={
-        "@type": "Organization",
-        "name": "EMBL-EBI",
-        "url": "https://www.ebi.ac.uk/metagenomics"
-    }))
+    agent = add_context_entity(crate, EMBL_EBI)
     crate.creator = agent
 
-    fin = os.path.getctime(gff_path)
-
     ## Add GFF output file
     gff = crate.add_file(
         gff_path,
+        dest_path=gff_name,
         properties={
             "name": "annotations gff",
             "encodingFormat": "text/x-gff3"
@@ -119,11 +111,10 @@ This is the output (a GFF feature file) of SanntiS being run on the MGnify assem
     )
 
     ## Add link
-    run_id = uuid4().hex
     run = crate.add(ContextEntity(crate, run_id, properties={
         "@type": "CreateAction",
         "name": f"SanntiS run on {assembly}",
-        "endTime": datetime.fromtimestamp(fin).isoformat(),
+        "endTime": end_time,
         "description": "",
     }))
     run.append_to("result", gff)
@@ -131,31 +122,109 @@ This is the output (a GFF feature file) of SanntiS being run on the MGnify assem
     run.append_to("instrument", sourcecode)
 
     ## Describe the GFF columns of interest
-    gff_cols = [
-            crate.add(ContextEntity(crate, 'gff_attribute_nearest_mibig', properties={
-            "@type": "PropertyValue",
-            "name": "Nearest MiBIG",
-            "url": "https://mibig.secondarymetabolites.org/repository",
-            "description": "The nearest_MiBIG attribute in the GFF column 9 is the closest predicted BGC from the MiBIG ontology.",
-            "value": "nearest_MiBIG",
-            "propertyId": "https://mibig.secondarymetabolites.org/repository/@value",
-        })),
-        crate.add(ContextEntity(crate, 'gff_attribute_nearest_mibig_class', properties={
-            "@type": "PropertyValue",
-            "name": "Nearest MiBIG class",
-            "url": "https://mibig.secondarymetabolites.org",
-            "description": "The nearest_MiBIG_class attribute in the GFF column 9 is one of the 6 (or other) BGC types from the MiBIG ontology.",
-            "value": "nearest_MiBIG_class",
-            "propertyId": "https://mibig.secondarymetabolites.org/",
-        }))
-    ]
+    gff_cols = [add_context_entity(crate, gff_column) for gff_column in GFF_COLUMNS]
 
     for col in gff_cols:
         crate.root_dataset.append_to("variableMeasured", col)
 
-    crate.write_zip(f"./crates/sanntis_{sourcecode['version']}_{assembly}.zip")
+    return crate
+
+
+@lru_cache(maxsize=None)
+def get_sanntis_crate_template():
+    return CrateTemplate(partial(build_sanntis_rocrate, None), SANNTIS_CRATE_FIELDS,
+                         date_fields=['date_published'])
+
 
-with open('gffPaths3.txt', 'r') as paths:
-    for path in paths.readlines():
-        print(path)
-        create_sanntis_rocrate(path.strip())
+def create_sanntis_rocrate(gff_path: str, crate_path: str = './crates', use_rocrate_model: bool = False):
+    """
+    Package a SanntiS GFF as a crate in crate_path.
+    Crates are filled in from a template built once through rocrate, unless use_rocrate_model is set,
+    in which case each one is built through the full rocrate object model; both give the same files.
+    Returns None if the GFF's path holds no assembly accession.
+    """
+    try:
+        assembly = 'ERZ' + gff_path.split('ERZ')[1].split('.')[0].split('_')[0]
+    except IndexError:
+        return
+
+    values = {
+        'gff_name': os.path.basename(gff_path),
+        'assembly': assembly,
+        'run_id': uuid4().hex,
+        'end_time': datetime.fromtimestamp(os.path.getctime(gff_path)).isoformat(),
+        'date_published': iso_now(),
+    }
+    zip_path = Path(crate_path) / Path(f"sanntis_{SANNTIS_SOURCE_CODE[1]['version']}_{assembly}.zip")
+    if use_rocrate_model or not is_plain_file_name(values['gff_name']):
+        build_sanntis_rocrate(gff_path, **values).write_zip(zip_path)
+    else:
+        get_sanntis_crate_template().write_zip(zip_path, [gff_path], **values)
+    return zip_path
+
+
+def create_sanntis_rocrate_task(task):
+    """
+    Package one GFF, giving its crate, or None and the reason it was skipped, rather than raising,
+    so that one unreadable GFF does not stop the others.
+    """
+    gff_path, crate_path, use_rocrate_model = task
+    try:
+        zip_path = create_sanntis_rocrate(gff_path, crate_path, use_rocrate_model)
+    except OSError as e:
+        return gff_path, None, str(e)
+    if zip_path is None:
+        return gff_path, None, 'Could not determine assembly accession from path'
+    return gff_path, zip_path, None
+
+
+def read_gff_paths(gff_paths_file):
+    with open(gff_paths_file, 'r') as paths:
+        for path in paths:
+            path = path.strip()
+            if path:
+                yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Take SanntiS-generated GFF files and create RO-Crates for each one.")
+    parser.add_argument("gff_paths_file", type=str, help="A text file with a list of GFF paths")
+    parser.add_argument("--output_dir", type=str, help="Output directory for the crates", default="./crates")
+    parser.add_argument("--workers", type=int, help="Number of crates to write in parallel", default=1)
+    parser.add_argument("--use_rocrate_model", action="store_true",
+                        help="Build every crate through the rocrate object model, rather than from a template")
+    parser.add_argument("--skip_report", type=str, default=None,
+                        help="JSON-lines file to record the GFFs that could not be packaged, and why, in")
+
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    tasks = ((gff_path, args.output_dir, args.use_rocrate_model) for gff_path in read_gff_paths(args.gff_paths_file))
+    skip_report = open(args.skip_report, 'w') if args.skip_report else None
+    try:
+        if args.workers > 1:
+            with Pool(processes=args.workers) as pool:
+                report_results(pool.imap_unordered(create_sanntis_rocrate_task, tasks, chunksize=8), skip_report)
+        else:
+            report_results(map(create_sanntis_rocrate_task, tasks), skip_report)
+    finally:
+        if skip_report:
+            skip_report.close()
+
+
+def report_results(results, skip_report=None):
+    crates = skipped = 0
+    for gff_path, zip_path, reason in results:
+        if zip_path is None:
+            skipped += 1
+            print(f"Skipping {gff_path}: {reason}")
+            if skip_report:
+                skip_report.write(json.dumps({'gff_path': gff_path, 'status': 'skipped', 'reason': reason}) + '\n')
+            continue
+        crates += 1
+        print(f"Packaged {gff_path} as {zip_path}")
+    print(f"Created {crates} crates, skipped {skipped} GFFs")
+
+
+if __name__ == "__main__":
+    main()
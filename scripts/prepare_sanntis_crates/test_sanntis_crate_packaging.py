@@ -0,0 +1,120 @@
+import contextlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+from importlib.metadata import version
+from unittest import mock
+
+from package_sanntis_as_crates import SANNTIS_SOURCE_CODE, create_sanntis_rocrate, main
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE_GFF = os.path.join(SCRIPT_DIR, '..', 'prepare_sanntis_gffs', 'test_data',
+                           'ERZ1022742.fasta.gz.fna.FILTER.fna.emerald.full.gff')
+
+# The values that differ between two crates of the same GFF: the run's id, and the publication date
+# as an ISO date in the metadata and as Python prints it in the preview
+UUID_PATTERN = re.compile(rb'[0-9a-f]{32}')
+DATE_PATTERN = re.compile(rb'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d+)?([+-]\d{2}:\d{2})?')
+
+
+def read_normalised_zip(zip_path):
+    with zipfile.ZipFile(zip_path) as archive:
+        return {
+            name: DATE_PATTERN.sub(b'<date>', UUID_PATTERN.sub(b'<uuid>', archive.read(name)))
+            for name in archive.namelist()
+        }
+
+
+class TestSanntisCratePackaging(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.gff_path = shutil.copy(EXAMPLE_GFF, self.temp_dir)
+        self.template_dir = os.path.join(self.temp_dir, 'template')
+        self.model_dir = os.path.join(self.temp_dir, 'model')
+        os.makedirs(self.template_dir)
+        os.makedirs(self.model_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def assert_same_crate_both_ways(self, gff_path):
+        template_zip = create_sanntis_rocrate(gff_path, self.template_dir)
+        model_zip = create_sanntis_rocrate(gff_path, self.model_dir, use_rocrate_model=True)
+        self.assertEqual(os.path.basename(template_zip), os.path.basename(model_zip))
+        template_files = read_normalised_zip(template_zip)
+        self.assertEqual(template_files, read_normalised_zip(model_zip))
+        return template_files
+
+    def test_rocrate_is_the_pinned_version(self):
+        with open(os.path.join(SCRIPT_DIR, 'requirements.txt')) as requirements:
+            pins = dict(line.strip().split('==') for line in requirements if '==' in line)
+        self.assertEqual(version('rocrate'), pins['rocrate'])
+
+    def test_template_matches_rocrate_model(self):
+        files = self.assert_same_crate_both_ways(self.gff_path)
+        self.assertIn(os.path.basename(self.gff_path), files)
+        self.assertIn('ro-crate-metadata.json', files)
+        self.assertIn('ro-crate-preview.html', files)
+
+    def test_file_name_rocrate_encodes_matches_rocrate_model(self):
+        gff_path = os.path.join(self.temp_dir, 'ERZ1022742 emerald #1.gff')
+        shutil.move(self.gff_path, gff_path)
+        files = self.assert_same_crate_both_ways(gff_path)
+        self.assertIn(os.path.basename(gff_path), files)
+        self.assertIn(b'ERZ1022742%20emerald%20%231.gff', files['ro-crate-metadata.json'])
+
+
+class TestSanntisCratePackagingCli(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.gff_path = shutil.copy(EXAMPLE_GFF, self.temp_dir)
+        self.crates_dir = os.path.join(self.temp_dir, 'crates')
+        self.skip_report_path = os.path.join(self.temp_dir, 'skipped.jsonl')
+        self.missing_gff_path = os.path.join(self.temp_dir, 'ERZ0000001.emerald.full.gff')
+        self.unnamed_gff_path = shutil.copy(EXAMPLE_GFF, os.path.join(self.temp_dir, 'emerald.full.gff'))
+        self.list_path = os.path.join(self.temp_dir, 'gff_paths.txt')
+        with open(self.list_path, 'w') as list_file:
+            list_file.write('\n'.join([self.missing_gff_path, self.unnamed_gff_path, self.gff_path]) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def run_main(self, *args):
+        output = io.StringIO()
+        with mock.patch.object(sys, 'argv', ['package_sanntis_as_crates.py', self.list_path, *args]), \
+                contextlib.redirect_stdout(output):
+            main()
+        return output.getvalue()
+
+    def assert_skips_reported(self, output):
+        self.assertIn('Created 1 crates, skipped 2 GFFs', output)
+        self.assertIn(f'Skipping {self.missing_gff_path}: ', output)
+        self.assertIn(f'Skipping {self.unnamed_gff_path}: Could not determine assembly accession from path', output)
+        zip_name = f"sanntis_{SANNTIS_SOURCE_CODE[1]['version']}_ERZ1022742.zip"
+        self.assertTrue(os.path.exists(os.path.join(self.crates_dir, zip_name)))
+
+        with open(self.skip_report_path) as skip_report:
+            skipped = sorted((json.loads(line) for line in skip_report), key=lambda entry: entry['gff_path'])
+        self.assertEqual([entry['gff_path'] for entry in skipped], [self.missing_gff_path, self.unnamed_gff_path])
+        self.assertEqual({entry['status'] for entry in skipped}, {'skipped'})
+        self.assertIn('No such file or directory', skipped[0]['reason'])
+        self.assertEqual(skipped[1]['reason'], 'Could not determine assembly accession from path')
+
+    def test_unreadable_gffs_are_skipped_and_reported(self):
+        output = self.run_main('--output_dir', self.crates_dir, '--skip_report', self.skip_report_path)
+        self.assert_skips_reported(output)
+
+    def test_unreadable_gffs_are_skipped_and_reported_by_workers(self):
+        output = self.run_main('--output_dir', self.crates_dir, '--skip_report', self.skip_report_path,
+                               '--workers', '2')
+        self.assert_skips_reported(output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import argparse
+import glob
+import io
+import timeit
+from pathlib import Path
+
+from gff_transform import GffTransform, contig_renamer, get_erz_accession, min_length_filter
+from prepare_sanntis_gffs import is_bgc_long_enough, rename_contig
+
+
+def filter_with_line_functions(lines, gff_path):
+    """The per-line path of prepare_sanntis_gffs before GffTransform: two splits and a stem per kept line."""
+    out = io.StringIO()
+    for annotation in lines:
+        if annotation.startswith('#'):
+            continue
+        if is_bgc_long_enough(annotation):
+            out.write(rename_contig(annotation, Path(gff_path).stem))
+    return out.getvalue()
+
+
+def filter_with_gff_transform(lines, gff_path):
+    gff_transform = GffTransform(filters=[min_length_filter()], rewrites=[contig_renamer(get_erz_accession(gff_path))])
+    out = io.StringIO()
+    out.writelines(gff_transform.transform_lines(lines))
+    return out.getvalue()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare the throughput of GffTransform with the line functions')
+    parser.add_argument('--gffs', default='test_data/*.gff', help='Glob of GFFs to benchmark on')
+    parser.add_argument('--copies', type=int, default=2000, help='Times to repeat each GFF, to get measurable runs')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs, of which the best is reported')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    for gff_path in sorted(glob.glob(args.gffs)):
+        with open(gff_path, 'r') as gff:
+            lines = gff.readlines() * args.copies
+        assert filter_with_line_functions(lines, gff_path) == filter_with_gff_transform(lines, gff_path)
+
+        print(f'{Path(gff_path).name}: {len(lines)} lines')
+        for name, implementation in (('line functions', filter_with_line_functions),
+                                     ('GffTransform', filter_with_gff_transform)):
+            seconds = min(timeit.repeat(lambda: implementation(lines, gff_path), number=1, repeat=args.repeat))
+            print(f'  {name:<15} {seconds * 1000:8.1f} ms  {len(lines) / seconds:12,.0f} lines/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import json
+import statistics
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+SUMMARY_FORMATS = ('npz', 'parquet')
+INTEGER_LENGTH_COLUMNS = ('bgc_count', 'total_length', 'min_length', 'max_length')
+FLOAT_LENGTH_COLUMNS = ('mean_length', 'median_length')
+LENGTH_COLUMNS = INTEGER_LENGTH_COLUMNS + FLOAT_LENGTH_COLUMNS
+
+
+class BgcSummary:
+    """
+    Counts and length statistics of the BGCs kept from one assembly's GFF, accumulated as they are prepared.
+    `add_record` passes records through unchanged, so it can be chained as a GffTransform rewrite.
+    """
+
+    def __init__(self, assembly, gff_name):
+        self.assembly = assembly
+        self.gff_name = gff_name
+        self.lengths = []
+        self.class_counts = {}
+
+    def add_record(self, record):
+        self.lengths.append(record.length)
+        mibig_class = record.get_attribute('nearest_MiBIG_class', 'Unknown')
+        self.class_counts[mibig_class] = self.class_counts.get(mibig_class, 0) + 1
+        return record
+
+    def get_length_stats(self):
+        if not self.lengths:
+            return {'bgc_count': 0, 'total_length': 0, 'min_length': 0, 'max_length': 0,
+                    'mean_length': 0.0, 'median_length': 0.0}
+        return {
+            'bgc_count': len(self.lengths),
+            'total_length': sum(self.lengths),
+            'min_length': min(self.lengths),
+            'max_length': max(self.lengths),
+            'mean_length': statistics.fmean(self.lengths),
+            'median_length': float(statistics.median(self.lengths)),
+        }
+
+
+def get_summary_columns(summaries):
+    """
+    One row per assembly: its accession, GFF name, length statistics and a count column per MiBIG class.
+    Hybrid classes, like "NRP Polyketide", are counted as classes of their own.
+    """
+    summaries = sorted(summaries, key=lambda summary: summary.assembly)
+    mibig_classes = sorted({mibig_class for summary in summaries for mibig_class in summary.class_counts})
+    stats = [summary.get_length_stats() for summary in summaries]
+    columns = {
+        'assembly': [summary.assembly for summary in summaries],
+        'gff_name': [summary.gff_name for summary in summaries],
+    }
+    for column in LENGTH_COLUMNS:
+        columns[column] = [assembly_stats[column] for assembly_stats in stats]
+    return columns, mibig_classes, [
+        [summary.class_counts.get(mibig_class, 0) for mibig_class in mibig_classes] for summary in summaries
+    ]
+
+
+def check_summary_format(summary_format):
+    """Fail before any GFFs are prepared if the summary could not be written at the end."""
+    if summary_format not in SUMMARY_FORMATS:
+        raise ValueError(f'Unknown summary format {summary_format}, expected one of {SUMMARY_FORMATS}')
+    if summary_format == 'npz' and np is None:
+        raise ImportError('numpy is needed to write npz summaries: pip install numpy')
+    if summary_format == 'parquet' and pa is None:
+        raise ImportError('pyarrow is needed to write parquet summaries: pip install pyarrow')
+
+
+def write_summary_index(summaries, summary_path, summary_format='npz'):
+    """
+    Write a batch's per-assembly BGC summaries as a columnar index.
+    npz has an array per column, plus `class_names` and an assemblies x classes `class_counts` matrix.
+    Parquet has a `class:<name>` count column per class.
+    """
+    check_summary_format(summary_format)
+    columns, mibig_classes, class_counts = get_summary_columns(summaries)
+    if summary_format == 'npz':
+        arrays = {
+            'assembly': np.array(columns['assembly'], dtype=str),
+            'gff_name': np.array(columns['gff_name'], dtype=str),
+            'class_names': np.array(mibig_classes, dtype=str),
+            'class_counts': np.array(class_counts, dtype=np.int32).reshape(len(class_counts), len(mibig_classes)),
+        }
+        for column in INTEGER_LENGTH_COLUMNS:
+            arrays[column] = np.array(columns[column], dtype=np.int64)
+        for column in FLOAT_LENGTH_COLUMNS:
+            arrays[column] = np.array(columns[column], dtype=np.float64)
+        with open(summary_path, 'wb') as summary_file:
+            np.savez_compressed(summary_file, **arrays)
+    else:
+        for i, mibig_class in enumerate(mibig_classes):
+            columns[f'class:{mibig_class}'] = [assembly_counts[i] for assembly_counts in class_counts]
+        table = pa.table(columns).replace_schema_metadata({'mibig_classes': json.dumps(mibig_classes)})
+        pq.write_table(table, summary_path)
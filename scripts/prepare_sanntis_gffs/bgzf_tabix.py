@@ -0,0 +1,153 @@
+import struct
+import zlib
+
+# Uncompressed bytes per BGZF block, as used by bgzip, leaving room for incompressible data within the 64 KiB limit
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_EOF_BLOCK = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# Tabix's GFF preset: sequence name, start and end in columns 1, 4 and 5, 1-based, with '#' lines skipped
+TABIX_GFF_PRESET = {'format': 0, 'col_seq': 1, 'col_beg': 4, 'col_end': 5, 'meta': '#', 'skip': 0}
+TABIX_LINEAR_SHIFT = 14
+
+
+class BgzfWriter:
+    """
+    Writes a BGZF file, the blocked gzip used by bgzip, which any gzip reader can decompress.
+    `tell()` gives the virtual offset (block address << 16 | offset within the block) that tabix indexes point at.
+    """
+
+    def __init__(self, path, compression_level=6):
+        self.file = open(path, 'wb')
+        self.compression_level = compression_level
+        self.buffer = bytearray()
+        self.block_address = 0
+
+    def tell(self):
+        return (self.block_address << 16) | len(self.buffer)
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= BGZF_BLOCK_SIZE:
+            self.write_block(bytes(self.buffer[:BGZF_BLOCK_SIZE]))
+            del self.buffer[:BGZF_BLOCK_SIZE]
+
+    def write_block(self, data):
+        compressor = zlib.compressobj(self.compression_level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        # gzip member header with the BC extra subfield holding the total block size minus one
+        header = struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2,
+                             len(compressed) + 25)
+        footer = struct.pack('<2I', zlib.crc32(data), len(data))
+        self.file.write(header + compressed + footer)
+        self.block_address += len(header) + len(compressed) + len(footer)
+
+    def close(self):
+        if self.buffer:
+            self.write_block(bytes(self.buffer))
+            self.buffer.clear()
+        self.file.write(BGZF_EOF_BLOCK)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def region_to_bin(beg, end):
+    """The UCSC/tabix bin for the 0-based, half-open region [beg, end)."""
+    end -= 1
+    for shift, offset in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        if beg >> shift == end >> shift:
+            return offset + (beg >> shift)
+    return 0
+
+
+def merge_chunks_within_blocks(chunks):
+    """Merge chunks that end and start in the same BGZF block, which tabix would decompress once anyway."""
+    merged = [list(chunks[0])]
+    for offset_beg, offset_end in chunks[1:]:
+        if merged[-1][1] >> 16 == offset_beg >> 16:
+            merged[-1][1] = offset_end
+        else:
+            merged.append([offset_beg, offset_end])
+    return merged
+
+
+class TabixIndexBuilder:
+    """
+    Builds a .tbi index for a BGZF file of sorted records, from each record's contig, 1-based coordinates
+    and the virtual offsets it was written between.
+    """
+
+    def __init__(self):
+        self.contig_names = []
+        self.contig_bins = []
+        self.contig_linear_offsets = []
+
+    def add(self, contig, start, end, offset_beg, offset_end):
+        if not self.contig_names or self.contig_names[-1] != contig:
+            if contig in self.contig_names:
+                raise ValueError(f'Records for contig {contig} are not contiguous, so the file cannot be indexed')
+            self.contig_names.append(contig)
+            self.contig_bins.append({})
+            self.contig_linear_offsets.append([])
+
+        beg = start - 1
+        chunks = self.contig_bins[-1].setdefault(region_to_bin(beg, end), [])
+        if chunks and chunks[-1][1] == offset_beg:
+            chunks[-1][1] = offset_end
+        else:
+            chunks.append([offset_beg, offset_end])
+
+        linear_offsets = self.contig_linear_offsets[-1]
+        last_window = (end - 1) >> TABIX_LINEAR_SHIFT
+        if len(linear_offsets) <= last_window:
+            linear_offsets.extend([None] * (last_window + 1 - len(linear_offsets)))
+        for window in range(beg >> TABIX_LINEAR_SHIFT, last_window + 1):
+            if linear_offsets[window] is None:
+                linear_offsets[window] = offset_beg
+
+    def to_bytes(self):
+        names = b''.join(name.encode() + b'\0' for name in self.contig_names)
+        index = bytearray(b'TBI\1')
+        index += struct.pack('<8i', len(self.contig_names), TABIX_GFF_PRESET['format'],
+                             TABIX_GFF_PRESET['col_seq'], TABIX_GFF_PRESET['col_beg'], TABIX_GFF_PRESET['col_end'],
+                             ord(TABIX_GFF_PRESET['meta']), TABIX_GFF_PRESET['skip'], len(names))
+        index += names
+        for bins, linear_offsets in zip(self.contig_bins, self.contig_linear_offsets):
+            index += struct.pack('<i', len(bins))
+            for bin_number, chunks in sorted(bins.items()):
+                chunks = merge_chunks_within_blocks(chunks)
+                index += struct.pack('<Ii', bin_number, len(chunks))
+                for chunk in chunks:
+                    index += struct.pack('<2Q', *chunk)
+            # Windows no record starts in point at the next record, as tabix expects
+            filled_offsets = []
+            next_offset = 0
+            for offset in reversed(linear_offsets):
+                next_offset = offset if offset is not None else next_offset
+                filled_offsets.append(next_offset)
+            index += struct.pack('<i', len(filled_offsets))
+            index += struct.pack(f'<{len(filled_offsets)}Q', *reversed(filled_offsets))
+        return bytes(index)
+
+    def write(self, index_path):
+        with BgzfWriter(index_path) as index_file:
+            index_file.write(self.to_bytes())
+
+
+def write_bgzipped_gff(records, gff_gz_path, header='##gff-version 3\n'):
+    """
+    Sort GffRecords by contig and start, write them to a bgzipped GFF and index it as `{gff_gz_path}.tbi`,
+    so that a contig or region can be read without decompressing the whole file.
+    """
+    index = TabixIndexBuilder()
+    with BgzfWriter(gff_gz_path) as gff_gz:
+        gff_gz.write(header.encode())
+        for record in sorted(records, key=lambda record: (record.seqid, record.start, record.end)):
+            offset_beg = gff_gz.tell()
+            gff_gz.write(record.to_line().encode())
+            index.add(record.seqid, record.start, record.end, offset_beg, gff_gz.tell())
+    index.write(f'{gff_gz_path}.tbi')
@@ -0,0 +1,107 @@
+from pathlib import Path
+
+
+class GffRecord:
+    """
+    One GFF annotation, split into its nine columns once.
+    Column 9 is only parsed into key/value pairs if a filter asks for an attribute.
+    """
+    __slots__ = ('seqid', 'source', 'type', 'start', 'end', 'score', 'strand', 'phase', 'attributes',
+                 '_attribute_values')
+
+    def __init__(self, line):
+        (self.seqid, self.source, self.type, start, end,
+         self.score, self.strand, self.phase, self.attributes) = line.rstrip('\r\n').split('\t', 8)
+        self.start = int(start)
+        self.end = int(end)
+        self._attribute_values = None
+
+    @property
+    def length(self):
+        return self.end - self.start
+
+    def get_attribute(self, key, default=None):
+        if self._attribute_values is None:
+            self._attribute_values = dict(
+                pair.split('=', 1) for pair in self.attributes.split(';') if '=' in pair
+            )
+        return self._attribute_values.get(key, default)
+
+    def to_line(self):
+        return (f'{self.seqid}\t{self.source}\t{self.type}\t{self.start}\t{self.end}\t'
+                f'{self.score}\t{self.strand}\t{self.phase}\t{self.attributes}\n')
+
+
+def min_length_filter(min_length: int = 3000):
+    def is_long_enough(record):
+        return record.length >= min_length
+    return is_long_enough
+
+
+def mibig_class_filter(mibig_classes):
+    """
+    Keep BGCs whose nearest_MiBIG_class includes any of `mibig_classes` (hybrid classes like "NRP Terpene" are
+    space separated).
+    """
+    mibig_classes = set(mibig_classes)
+
+    def has_mibig_class(record):
+        return not mibig_classes.isdisjoint(record.get_attribute('nearest_MiBIG_class', '').split())
+    return has_mibig_class
+
+
+def max_jaccard_distance_filter(max_distance: float):
+    def is_close_enough(record):
+        distance = record.get_attribute('nearest_MiBIG_jaccardDistance')
+        return distance is not None and float(distance) <= max_distance
+    return is_close_enough
+
+
+def contig_renamer(erz):
+    """
+    Prefix contig names with the ERZ accession of their assembly and use '-' in place of '_',
+    leaving contigs that are already prefixed alone.
+    """
+    def rename_contig(record):
+        if not record.seqid.startswith('ERZ'):
+            record.seqid = f"{erz}.{record.seqid.replace('_', '-')}"
+        return record
+    return rename_contig
+
+
+class GffTransform:
+    """
+    Applies a chain of filters (record -> bool) and rewrites (record -> record) to GFF annotations,
+    parsing and serialising each record once. Comment and directive lines are dropped.
+    """
+
+    def __init__(self, filters=(), rewrites=()):
+        self.filters = list(filters)
+        self.rewrites = list(rewrites)
+        self.records_read = 0
+        self.records_kept = 0
+
+    def transform_records(self, lines):
+        for line in lines:
+            if line.startswith('#') or not line.strip():
+                continue
+            record = GffRecord(line)
+            self.records_read += 1
+            if not all(keep(record) for keep in self.filters):
+                continue
+            for rewrite in self.rewrites:
+                record = rewrite(record)
+            self.records_kept += 1
+            yield record
+
+    def transform_lines(self, lines):
+        for record in self.transform_records(lines):
+            yield record.to_line()
+
+    def transform_file(self, gff_path, out_file):
+        with open(gff_path, 'r') as gff:
+            out_file.writelines(self.transform_lines(gff))
+
+
+def get_erz_accession(gff_path):
+    return Path(gff_path).stem.split('.')[0]
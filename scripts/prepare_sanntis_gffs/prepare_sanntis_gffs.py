@@ -1,10 +1,19 @@
 import argparse
+import os
+import sys
+from multiprocessing import Pool
 from pathlib import Path
 
+from bgc_summary import SUMMARY_FORMATS, BgcSummary, check_summary_format, write_summary_index
+from bgzf_tabix import write_bgzipped_gff
+from gff_transform import (GffTransform, contig_renamer, get_erz_accession, max_jaccard_distance_filter,
+                           mibig_class_filter, min_length_filter)
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+
 
 def is_bgc_long_enough(annotation, min_length: int = 3000):
     fields = annotation.split('\t')
-    print(fields)
     start = int(fields[3])
     end = int(fields[4])
     return (end - start) >= min_length
@@ -19,10 +28,76 @@ def rename_contig(annotation, filename):
     return '\t'.join(annotation)
 
 
+def build_gff_transform(gff_path, min_length=3000, mibig_classes=None, max_jaccard_distance=None, summary=None):
+    filters = [min_length_filter(min_length)]
+    if mibig_classes:
+        filters.append(mibig_class_filter(mibig_classes))
+    if max_jaccard_distance is not None:
+        filters.append(max_jaccard_distance_filter(max_jaccard_distance))
+    rewrites = [contig_renamer(get_erz_accession(gff_path))]
+    if summary is not None:
+        rewrites.append(summary.add_record)
+    return GffTransform(filters=filters, rewrites=rewrites)
+
+
+def prepare_gff(gff_path, out_dir, filter_options=None, bgzip=False, summarise=False):
+    """
+    Filter and rename the annotations of one GFF into out_dir, a line at a time.
+    With bgzip, the kept annotations are instead sorted and written as a bgzipped GFF with a tabix index.
+    With summarise, a BgcSummary of the annotations kept is accumulated as they are written.
+    Returns (gff_path, number of annotations read, number kept, error message or None,
+    BgcSummary of those kept or None if not summarising).
+    """
+    summary = BgcSummary(get_erz_accession(gff_path), Path(gff_path).name) if summarise else None
+    gff_transform = build_gff_transform(gff_path, summary=summary, **(filter_options or {}))
+    out_path = Path(out_dir) / Path(gff_path).name
+    try:
+        if bgzip:
+            with open(gff_path, 'r') as gff:
+                write_bgzipped_gff(gff_transform.transform_records(gff), f'{out_path}.gz')
+        else:
+            with open(out_path, 'w', buffering=WRITE_BUFFER_SIZE) as new_gff:
+                new_gff.write('##gff-version 3\n')
+                gff_transform.transform_file(gff_path, new_gff)
+    except (OSError, ValueError) as e:
+        remove_partial_output(out_path, bgzip)
+        return gff_path, gff_transform.records_read, gff_transform.records_kept, str(e), None
+    return gff_path, gff_transform.records_read, gff_transform.records_kept, None, summary
+
+
+def remove_partial_output(out_path, bgzip=False):
+    """Remove whatever was written for a GFF that failed part way, so that it is not taken for prepared output."""
+    for path in ([f'{out_path}.gz', f'{out_path}.gz.tbi'] if bgzip else [out_path]):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def read_gff_paths(gffs_list_file):
+    with open(gffs_list_file, 'r') as gffs_file:
+        for gff_path in gffs_file:
+            gff_path = gff_path.strip(' \n\r')
+            if gff_path:
+                yield gff_path
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description='Prepare SanntiS GFFs for consumption by EMG webuploader')
     parser.add_argument('gffs_list_file', help='A text file with a list of GFF paths')
     parser.add_argument('out_dir', help='A directory to output the prepared GFFs into')
+    parser.add_argument('--workers', type=int, default=1, help='Number of GFFs to prepare in parallel')
+    parser.add_argument('--min_length', type=int, default=3000, help='Minimum length of the BGCs to keep')
+    parser.add_argument('--mibig_classes', nargs='+', default=None,
+                        help='Only keep BGCs whose nearest MiBIG class is one of these, e.g. Terpene NRP')
+    parser.add_argument('--max_jaccard_distance', type=float, default=None,
+                        help='Only keep BGCs whose nearest_MiBIG_jaccardDistance is at most this')
+    parser.add_argument('--bgzip', action='store_true',
+                        help='Write sorted, bgzipped GFFs with tabix indexes (.gff.gz and .gff.gz.tbi)')
+    parser.add_argument('--summary', default=None,
+                        help='Also write a per-assembly summary of the BGCs kept (counts, lengths, MiBIG classes) here')
+    parser.add_argument('--summary_format', choices=SUMMARY_FORMATS, default='npz',
+                        help='Columnar format of the summary: npz needs numpy, parquet needs pyarrow')
     args = parser.parse_args()
     return args
 
@@ -36,19 +111,51 @@ def main():
     out_path = Path(args.out_dir)
     assert out_path.is_dir()
 
-    with open(args.gffs_list_file, 'r') as gffs_file:
-        for gff_path in gffs_file.readlines():
-            gff_path = gff_path.strip(' \n\r')
-            print(f'Working on {gff_path}')
-            with open(gff_path, 'r') as original_gff:
-                with open(out_path / Path(gff_path).name, 'w') as new_gff:
-                    new_gff.write('##gff-version 3\n')
-                    for annotation in original_gff.readlines():
-                        if annotation.startswith('#'):
-                            continue
-                        if is_bgc_long_enough(annotation):
-                            new_annotation = rename_contig(annotation, Path(gff_path).stem)
-                            new_gff.write(new_annotation)
+    if args.summary:
+        check_summary_format(args.summary_format)
+
+    filter_options = {
+        'min_length': args.min_length,
+        'mibig_classes': args.mibig_classes,
+        'max_jaccard_distance': args.max_jaccard_distance,
+    }
+    tasks = ((gff_path, out_path, filter_options, args.bgzip, bool(args.summary))
+             for gff_path in read_gff_paths(args.gffs_list_file))
+    if args.workers > 1:
+        with Pool(processes=args.workers) as pool:
+            summaries, failed = report_results(pool.imap_unordered(prepare_gff_task, tasks, chunksize=16))
+    else:
+        summaries, failed = report_results(map(prepare_gff_task, tasks))
+
+    if args.summary:
+        write_summary_index(summaries, args.summary, args.summary_format)
+        print(f'Wrote a summary of {len(summaries)} assemblies to {args.summary}')
+    if failed:
+        sys.exit(1)
+
+
+def prepare_gff_task(task):
+    return prepare_gff(*task)
+
+
+def report_results(results):
+    """Print how each GFF went, returning the summaries of those prepared and the paths of those that failed."""
+    files = annotations_read = annotations_kept = 0
+    summaries = []
+    failed = []
+    for gff_path, read, kept, error, summary in results:
+        files += 1
+        if error:
+            failed.append(gff_path)
+            print(f'Failed on {gff_path}: {error}')
+            continue
+        annotations_read += read
+        annotations_kept += kept
+        summaries.append(summary)
+        print(f'Prepared {gff_path}: kept {kept} of {read} BGCs')
+
+    print(f'Prepared {files - len(failed)} of {files} GFFs, keeping {annotations_kept} of {annotations_read} BGCs')
+    return summaries, failed
 
 
 if __name__ == '__main__':
@@ -0,0 +1,179 @@
+import contextlib
+import gzip
+import io
+import shutil
+import statistics
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from bgc_summary import BgcSummary, get_summary_columns
+from gff_transform import (GffRecord, GffTransform, contig_renamer, max_jaccard_distance_filter,
+                           mibig_class_filter, min_length_filter)
+from prepare_sanntis_gffs import is_bgc_long_enough, main, prepare_gff, rename_contig
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+TEST_DATA = Path(__file__).resolve().parent / 'test_data'
+GFF_PATHS = sorted(TEST_DATA.glob('*.emerald.full.gff'))
+
+
+def read_annotations(gff_path):
+    with open(gff_path, 'r') as gff:
+        return [line for line in gff if not line.startswith('#') and line.strip()]
+
+
+def prepare_with_line_functions(gff_path):
+    """The prepared GFF as the original line functions wrote it, to check the streamed output against."""
+    kept = [rename_contig(line, Path(gff_path).name) for line in read_annotations(gff_path)
+            if is_bgc_long_enough(line)]
+    return '##gff-version 3\n' + ''.join(kept)
+
+
+class TestPrepareGff(unittest.TestCase):
+    def setUp(self):
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.out_dir)
+
+    def test_plain_output_is_unchanged(self):
+        for gff_path in GFF_PATHS:
+            result = prepare_gff(str(gff_path), self.out_dir)
+            self.assertIsNone(result[3])
+            self.assertIsNone(result[4])
+            expected = prepare_with_line_functions(gff_path)
+            self.assertEqual((self.out_dir / gff_path.name).read_text(), expected)
+            self.assertEqual(result[1:3], (len(read_annotations(gff_path)), expected.count('\n') - 1))
+
+    def test_missing_gff_does_not_abort_batch(self):
+        gffs_list_file = self.out_dir / 'gff_paths.txt'
+        missing_gff_path = TEST_DATA / 'ERZ0000000.missing.gff'
+        gffs_list_file.write_text(f'{GFF_PATHS[0]}\n\n{missing_gff_path}\n{GFF_PATHS[1]}\n')
+        output = io.StringIO()
+
+        with mock.patch('sys.argv', ['prepare_sanntis_gffs.py', str(gffs_list_file), str(self.out_dir),
+                                     '--workers', '2']), contextlib.redirect_stdout(output):
+            with self.assertRaises(SystemExit) as exit_context:
+                main()
+
+        self.assertEqual(exit_context.exception.code, 1)
+        self.assertIn(f'Failed on {missing_gff_path}', output.getvalue())
+        self.assertIn('Prepared 2 of 3 GFFs', output.getvalue())
+        for gff_path in GFF_PATHS:
+            self.assertEqual((self.out_dir / gff_path.name).read_text(), prepare_with_line_functions(gff_path))
+
+    def test_failed_gff_leaves_no_partial_output(self):
+        gff_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, gff_dir)
+        bad_gff_path = gff_dir / 'ERZ0000001.emerald.full.gff'
+        bad_gff_path.write_text(read_annotations(GFF_PATHS[0])[0] + 'NODE_2\tEMERALD\tCLUSTER\tnot-a-start\t9000\n')
+
+        for bgzip in (False, True):
+            self.assertIsNotNone(prepare_gff(str(bad_gff_path), self.out_dir, bgzip=bgzip)[3])
+            self.assertEqual(list(self.out_dir.iterdir()), [])
+
+    def test_bgzipped_output_is_readable_with_gzip(self):
+        for gff_path in GFF_PATHS:
+            self.assertIsNone(prepare_gff(str(gff_path), self.out_dir, bgzip=True)[3])
+            with gzip.open(self.out_dir / f'{gff_path.name}.gz', 'rt') as gff_gz:
+                lines = gff_gz.readlines()
+            self.assertEqual(lines[0], '##gff-version 3\n')
+            expected = prepare_with_line_functions(gff_path).splitlines(keepends=True)[1:]
+            self.assertEqual(sorted(lines[1:]), sorted(expected))
+            records = [GffRecord(line) for line in lines[1:]]
+            self.assertEqual([(record.seqid, record.start) for record in records],
+                             sorted((record.seqid, record.start) for record in records))
+
+    @unittest.skipIf(pysam is None, 'pysam is not installed')
+    def test_region_query_matches_linear_scan(self):
+        gff_path = GFF_PATHS[0]
+        prepare_gff(str(gff_path), self.out_dir, bgzip=True)
+        gff_gz_path = str(self.out_dir / f'{gff_path.name}.gz')
+        with gzip.open(gff_gz_path, 'rt') as gff_gz:
+            records = [GffRecord(line) for line in gff_gz if not line.startswith('#')]
+
+        with pysam.TabixFile(gff_gz_path) as tabix:
+            self.assertEqual(sorted(tabix.contigs), sorted({record.seqid for record in records}))
+            for contig in {record.seqid for record in records}:
+                contig_end = max(record.end for record in records if record.seqid == contig)
+                for beg, end in ((0, contig_end), (0, contig_end // 2), (contig_end // 2, contig_end)):
+                    expected = [record.to_line() for record in records
+                                if record.seqid == contig and record.start - 1 < end and record.end > beg]
+                    self.assertEqual([f'{line}\n' for line in tabix.fetch(contig, beg, end)], expected)
+
+    def test_summary_counts_and_lengths(self):
+        gff_path = GFF_PATHS[0]
+        summary = prepare_gff(str(gff_path), self.out_dir, summarise=True)[4]
+
+        kept = [GffRecord(line) for line in read_annotations(gff_path) if is_bgc_long_enough(line)]
+        lengths = [record.end - record.start for record in kept]
+        class_counts = {}
+        for record in kept:
+            mibig_class = record.get_attribute('nearest_MiBIG_class', 'Unknown')
+            class_counts[mibig_class] = class_counts.get(mibig_class, 0) + 1
+
+        self.assertEqual(summary.assembly, gff_path.name.split('.')[0])
+        self.assertEqual(summary.class_counts, class_counts)
+        self.assertEqual(summary.get_length_stats(), {
+            'bgc_count': len(lengths),
+            'total_length': sum(lengths),
+            'min_length': min(lengths),
+            'max_length': max(lengths),
+            'mean_length': statistics.fmean(lengths),
+            'median_length': float(statistics.median(lengths)),
+        })
+
+
+class TestGffTransform(unittest.TestCase):
+    def test_filters_and_rewrites(self):
+        lines = [
+            '##gff-version 3\n',
+            'NODE_1_length_9000\tEMERALD\tCLUSTER\t1\t5000\t.\t.\t.\tnearest_MiBIG_class=NRP Terpene\n',
+            'NODE_2_length_9000\tEMERALD\tCLUSTER\t1\t100\t.\t.\t.\tnearest_MiBIG_class=Terpene\n',
+            'ERZ1.NODE-3\tEMERALD\tCLUSTER\t1\t5000\t.\t.\t.\tnearest_MiBIG_class=Terpene\n',
+            'NODE_4_length_9000\tEMERALD\tCLUSTER\t1\t5000\t.\t.\t.\tnearest_MiBIG_class=RiPP\n',
+        ]
+        gff_transform = GffTransform(filters=[min_length_filter(3000), mibig_class_filter(['Terpene'])],
+                                     rewrites=[contig_renamer('ERZ1')])
+
+        self.assertEqual(list(gff_transform.transform_lines(lines)), [
+            'ERZ1.NODE-1-length-9000\tEMERALD\tCLUSTER\t1\t5000\t.\t.\t.\tnearest_MiBIG_class=NRP Terpene\n',
+            'ERZ1.NODE-3\tEMERALD\tCLUSTER\t1\t5000\t.\t.\t.\tnearest_MiBIG_class=Terpene\n',
+        ])
+        self.assertEqual((gff_transform.records_read, gff_transform.records_kept), (4, 2))
+
+    def test_jaccard_distance_filter(self):
+        lines = [
+            'NODE_1\tEMERALD\tCLUSTER\t1\t5000\t.\t.\t.\tnearest_MiBIG_jaccardDistance=0.500\n',
+            'NODE_2\tEMERALD\tCLUSTER\t1\t5000\t.\t.\t.\tnearest_MiBIG_jaccardDistance=0.900\n',
+            'NODE_3\tEMERALD\tCLUSTER\t1\t5000\t.\t.\t.\tID=NODE_3\n',
+        ]
+        gff_transform = GffTransform(filters=[max_jaccard_distance_filter(0.75)])
+        self.assertEqual([record.seqid for record in gff_transform.transform_records(lines)], ['NODE_1'])
+
+
+class TestBgcSummary(unittest.TestCase):
+    def test_summary_columns(self):
+        summaries = []
+        for assembly, records in (('ERZ2', [(1, 101, 'Terpene'), (1, 301, 'NRP')]), ('ERZ1', [])):
+            summary = BgcSummary(assembly, f'{assembly}.gff')
+            for start, end, mibig_class in records:
+                summary.add_record(GffRecord(f'contig\t.\tCLUSTER\t{start}\t{end}\t.\t.\t.\t'
+                                             f'nearest_MiBIG_class={mibig_class}\n'))
+            summaries.append(summary)
+
+        columns, mibig_classes, class_counts = get_summary_columns(summaries)
+        self.assertEqual(columns['assembly'], ['ERZ1', 'ERZ2'])
+        self.assertEqual(columns['bgc_count'], [0, 2])
+        self.assertEqual(columns['total_length'], [0, 400])
+        self.assertEqual(columns['median_length'], [0.0, 200.0])
+        self.assertEqual(mibig_classes, ['NRP', 'Terpene'])
+        self.assertEqual(class_counts, [[0, 0], [1, 1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
+